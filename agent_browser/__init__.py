@@ -1,6 +1,8 @@
 from .agent import AgentBrowser
-from .streaming import StreamServer
-from .console import ConsoleStreamServer
+from .streaming import FrameStreamServer, StreamServer
+from .console import ConsoleHubServer, ConsoleStreamServer
+from .pool import BrowserPool
+from .cache import ResponseCache
 import agno
 
-__all__ = ["AgentBrowser", "StreamServer", "ConsoleStreamServer","agno"]
+__all__ = ["AgentBrowser", "BrowserPool", "ResponseCache", "StreamServer", "FrameStreamServer", "ConsoleStreamServer", "ConsoleHubServer","agno"]
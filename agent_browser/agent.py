@@ -8,9 +8,9 @@ import tempfile
 import os
 import random
 import time
-from dataclasses import dataclass, field
+from dataclasses import astuple, dataclass, field, replace
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional
 
 try:
     import cv2
@@ -21,9 +21,13 @@ except ImportError:
 
 from patchright.async_api import Browser, BrowserContext, Page, TimeoutError as PlaywrightTimeoutError, async_playwright
 
-from .console import ConsoleRecorder, ConsoleStreamServer
+from .cache import CACHEABLE_RESOURCE_TYPES, ResponseCache
+from .console import ConsoleHubServer, ConsoleRecorder, ConsoleStreamServer
 from .errors import to_ai_friendly_error
-from .snapshot import EnhancedSnapshot, SnapshotOptions, get_enhanced_snapshot, get_enhanced_snapshot_locator, build_snapshot_index_text, resolve_path_locator, search_snapshot_index_text, get_multiview_index_data, build_multiview_index_text, search_multiview_index_text, RefTarget
+from .events import PageEventJournal
+from .resources import ResourceMatcher, ResourcePolicySpec, compile_resource_policy
+from .settle import SettleTracker
+from .snapshot import AriaTree, RefRegistry, SnapshotBaseline, SnapshotOptions, NODE_HANDLE_ATTR, attach_node_handles, build_path_snapshot, build_search_results, build_snapshot_diff, capture_backend_node_ids, get_dom_version, get_filtered_aria_tree, get_enhanced_snapshot_locator, get_section_snapshots, iter_snapshot_chunks, resolve_path_locator, get_multiview_index_data, build_multiview_index_text, RefTarget, parse_aria_tree
 from .storage import cookies_clear, cookies_get, cookies_set, storage_clear, storage_get, storage_set
 from .streaming import StreamServer
 
@@ -45,6 +49,9 @@ def build_llm_method_tutorial(method_names: Iterable[str]) -> str:
         "console_get",
         "console_stream_start",
         "console_stream_stop",
+        "console_hub_start",
+        "console_hub_stop",
+        "snapshot_stream",
         "stream_start",
         "stream_stop",
         "stream_inject_mouse",
@@ -77,6 +84,7 @@ def build_llm_method_tutorial(method_names: Iterable[str]) -> str:
         "uncheck",
         "upload",
         "inner_html",
+        "batch",
     }
     needs_page_id = {
         "snapshot",
@@ -91,13 +99,14 @@ def build_llm_method_tutorial(method_names: Iterable[str]) -> str:
         "upload",
         "inner_html",
         "find",
+        "batch",
         "back",
         "get_url",
         "get_title",
     }
     tutorials: dict[str, str] = {
         "open": "open(url): Open a new page and navigate to url, returns page_id.",
-        "snapshot": "snapshot(page_id, ...): Get a readable snapshot and stable @eN refs.",
+        "snapshot": "snapshot(page_id, ...): Get a readable snapshot and stable @eN refs; max_tokens caps its size, expand \"(+N hidden) [path=...]\" with selector=\"path=...\".",
         "snapshot_index": "snapshot_index(page_id, ...): Return a hierarchical index with paths.",
         "snapshot_search": "snapshot_search(page_id, query, ...): Search the index text and return matched paths.",
         "click": "click(page_id, selector_or_ref): Click an element.",
@@ -109,6 +118,7 @@ def build_llm_method_tutorial(method_names: Iterable[str]) -> str:
         "upload": "upload(page_id, selector_or_ref, files): Upload local files.",
         "inner_html": "inner_html(page_id, selector_or_ref): Get the element HTML.",
         "find": "find(page_id, strategy, action, ...): Unified locate+action, pass action_value/files when needed.",
+        "batch": "batch(page_id, actions, ...): Run several {action, target, value} steps in one call, returns per-step results and a snapshot diff.",
         "back": "back(page_id, steps=1): Navigate back in history.",
         "get_url": "get_url(page_id): Get the current page URL.",
         "get_title": "get_title(page_id): Get the current page title.",
@@ -928,17 +938,108 @@ POPUP_GUARD_JS = """
 """
 
 
+async def resolve_default_user_agent(browser: Browser) -> Optional[str]:
+    """
+    Read the browser's default user agent with the headless marker removed.
+    """
+    context = await browser.new_context()
+    try:
+        page = await context.new_page()
+        user_agent = await page.evaluate("() => navigator.userAgent")
+    finally:
+        await context.close()
+    if not user_agent:
+        return None
+    return user_agent.replace("HeadlessChrome", "Chrome")
+
+
 @dataclass
 class PageState:
     page: Page
-    refs: Dict[str, Any] = field(default_factory=dict)
+    refs: RefRegistry = field(default_factory=RefRegistry)
     console: ConsoleRecorder = field(default_factory=ConsoleRecorder)
     stream_server: Optional[StreamServer] = None
     console_server: Optional[ConsoleStreamServer] = None
     index_paths: Dict[str, str] = field(default_factory=dict)
     last_aria_tree: Optional[str] = None
+    last_aria_parsed: Optional[AriaTree] = None
     last_aria_tree_url: Optional[str] = None
-    last_aria_tree_ts: float = 0.0
+    last_aria_tree_version: Optional[str] = None
+    snapshot_baselines: Dict[tuple, SnapshotBaseline] = field(default_factory=dict)
+    settle: SettleTracker = field(default_factory=SettleTracker)
+    events: PageEventJournal = field(default_factory=PageEventJournal)
+    cdp_session: Optional[Any] = None
+    handle_seq: int = 0
+    action_epoch: int = 0
+
+
+# Max number of lazily recorded console messages whose args one console_get() serializes.
+CONSOLE_ARG_BUDGET = 50
+
+# How long a click on a link or form marked to open a new window or download (see
+# NEW_WINDOW_TARGET_JS), or one that left a main-frame navigation uncommitted, waits for the
+# popup or download event after the page has loaded.
+CLICK_EVENT_GRACE_MS = 300
+# Baselines for diff_since="last" are kept per option set; the oldest set is dropped first.
+MAX_SNAPSHOT_BASELINES = 4
+# The cached ARIA tree is reused for at most this window even when no change was seen: script
+# writes to el.value/el.checked fire no events, and some shadow roots go unobserved.
+ARIA_TREE_REUSE_WINDOW_S = 3
+
+LAUNCH_ARGS = (
+    "--disable-blink-features=AutomationControlled",
+    "--disable-infobars",
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--no-first-run",
+    "--no-zygote",
+)
+
+BATCH_ACTIONS = {
+    "click",
+    "fill",
+    "select",
+    "press",
+    "check",
+    "uncheck",
+    "upload",
+    "inner_html",
+    "text",
+    "value",
+    "hover",
+    "count",
+    "is_visible",
+    "is_enabled",
+    "is_checked",
+}
+# Actions that only read the page and leave the cached ARIA tree valid.
+READ_ONLY_ACTIONS = {"inner_html", "text", "value", "count", "is_visible", "is_enabled", "is_checked"}
+
+REF_OBJECT_GROUP = "agent-browser-refs"
+
+STAMP_NODE_JS = """
+function(attr, token) {
+    if (!this.isConnected) return false;
+    this.setAttribute(attr, token);
+    return true;
+}
+"""
+
+# True when clicking the element follows a link or submits a form into another window
+# (target, formtarget or <base target>) or starts a download.
+NEW_WINDOW_TARGET_JS = """
+(el) => {
+    const owner = el.closest("a[href], area[href]") || el.form || el.closest("form");
+    if (!owner) return false;
+    if (owner.hasAttribute("download")) return true;
+    const base = document.querySelector("base[target]");
+    const target = (
+        el.getAttribute("formtarget") || owner.getAttribute("target") || (base && base.getAttribute("target")) || ""
+    ).toLowerCase();
+    return target !== "" && !["_self", "_parent", "_top"].includes(target);
+}
+"""
 
 
 class AgentBrowser:
@@ -965,6 +1066,14 @@ class AgentBrowser:
         use_temp_profile: bool = False,
         cookie_policy: str = "accept_all",
         stealth_js: Optional[str] = None,
+        ref_node_ids: bool = False,
+        context: Optional[BrowserContext] = None,
+        warm_pages: int = 0,
+        resource_policy: ResourcePolicySpec = None,
+        response_cache: Optional[ResponseCache | str] = None,
+        action_wait: str = "load",
+        settle_quiet_ms: int = 200,
+        console_args: str = "eager",
     ) -> None:
         """
         Create an AgentBrowser instance.
@@ -982,6 +1091,25 @@ class AgentBrowser:
             executable_path: Custom Chrome/Chromium executable path.
             profile_dir: User data directory for browser profile.
             use_temp_profile: Whether to create a temporary profile dir when none is provided.
+            ref_node_ids: Whether to pin refs to DOM nodes (CDP backend node ids, or injected
+                handles for in-page snapshots) so actions skip the role/name lookup.
+            context: An existing browser context to use (e.g. from BrowserPool). start() then
+                launches nothing, and close() closes only this context.
+            warm_pages: Number of blank pages to keep ready (timeouts and handlers attached)
+                so open() can skip page creation. Refilled in the background.
+            resource_policy: Requests to abort for every page: a preset ("text_only", "no_media",
+                "no_third_party", "no_trackers"), a dict of rules (block_types, block_patterns,
+                allow_patterns, block_third_party), or a list of these. Routing disables the
+                browser HTTP cache for the context.
+            response_cache: A ResponseCache (or its directory) that serves static GET responses
+                (scripts, stylesheets, images, fonts, media) from disk. Share one directory between
+                instances and processes to reuse downloads.
+            action_wait: How click/press wait for the page afterwards: "load" waits for
+                domcontentloaded, "settle" returns as soon as network and DOM are quiet.
+            settle_quiet_ms: Quiet period used by action_wait="settle".
+            console_args: When console message arguments are serialized: "eager" (on every
+                message), "lazy" (on console_get, for the most recent messages only) or "errors"
+                (eager for error/warning, lazy for the rest).
 
         Returns:
             None
@@ -1001,13 +1129,33 @@ class AgentBrowser:
         self._temp_profile_dir: Optional[str] = None
         self._cookie_policy = cookie_policy
         self._stealth_js = stealth_js
+        self._ref_node_ids = ref_node_ids
         self._playwright = None
         self._browser: Optional[Browser] = None
-        self._context: Optional[BrowserContext] = None
+        self._context: Optional[BrowserContext] = context
+        self._external_context = context is not None
         self._pages: Dict[str, PageState] = {}
         self._page_counter = 0
         self._stream_all_config: Optional[Dict[str, Any]] = None
         self._stream_all_page_ids: set[str] = set()
+        self._warm_target = max(0, warm_pages)
+        self._warm_states: list[PageState] = []
+        self._warm_task: Optional[asyncio.Task] = None
+        # Called with every page handed to the caller (open() and popups), not warm pages.
+        self._on_page_registered: Optional[Callable[[Page], None]] = None
+        self._resource_matcher = compile_resource_policy(resource_policy)
+        if isinstance(response_cache, str):
+            response_cache = ResponseCache(response_cache)
+        self._response_cache: Optional[ResponseCache] = response_cache
+        if action_wait not in ("load", "settle"):
+            raise ValueError(f'Unsupported action_wait: {action_wait} (expected "load" or "settle")')
+        self._action_wait = action_wait
+        self._settle_quiet_ms = settle_quiet_ms
+        if console_args not in ("eager", "lazy", "errors"):
+            raise ValueError(f'Unsupported console_args: {console_args} (expected "eager", "lazy" or "errors")')
+        self._console_args = console_args
+        self._console_hub: Optional[ConsoleHubServer] = None
+        self._context_routed: Optional[BrowserContext] = None
 
     async def start(self) -> None:
         """
@@ -1020,18 +1168,13 @@ class AgentBrowser:
             None
         """
         if self._browser or self._context:
+            await self._route_context()
             return
+        if self._external_context:
+            raise RuntimeError("外部传入的浏览器上下文已关闭")
         self._playwright = await async_playwright().start()
 
-        args = [
-            "--disable-blink-features=AutomationControlled",
-            "--disable-infobars",
-            "--no-sandbox",
-            "--disable-setuid-sandbox",
-            "--disable-dev-shm-usage",
-            "--no-first-run",
-            "--no-zygote",
-        ]
+        args = list(LAUNCH_ARGS)
         profile_dir = None
         if self._profile_dir:
             profile_dir = str(Path(self._profile_dir).expanduser())
@@ -1129,13 +1272,17 @@ class AgentBrowser:
             if self._user_agent:
                 context_kwargs["user_agent"] = self._user_agent
             self._context = await self._browser.new_context(**context_kwargs)
+        await self._route_context()
+        self._schedule_warm_refill()
 
-    async def open(self, url: str) -> str:
+    async def open(self, url: str, resource_policy: ResourcePolicySpec = None) -> str:
         """
         Open a new page and navigate to the given URL.
 
         Args:
             url: Target URL to navigate to.
+            resource_policy: Optional policy for this page only, replacing the instance-wide
+                one (same forms as the constructor argument; "none" disables blocking).
 
         Returns:
             A page_id string that identifies the opened page in this AgentBrowser instance.
@@ -1143,8 +1290,14 @@ class AgentBrowser:
         await self.start()
         if not self._context:
             raise RuntimeError("浏览器上下文未初始化")
-        page = await self._context.new_page()
-        page.set_default_timeout(self._timeout_ms)
+        state = self._take_warm_state()
+        if state is None:
+            state = self._prepare_page(await self._context.new_page())
+        self._schedule_warm_refill()
+        page = state.page
+        if resource_policy is not None:
+            matcher = compile_resource_policy(resource_policy)
+            await page.route("**/*", lambda route: self._route_request(route, matcher))
         
         # Add freeze script as an init script so it runs before page load
         # await page.add_init_script(FREEZE_ANIMATIONS_JS)
@@ -1160,9 +1313,100 @@ class AgentBrowser:
         # await self._handle_cookie_banner(page)
         # await self._evaluate_script(page, POPUP_GUARD_JS)
         # await self._handle_popups(page)
-        page_id = await self._register_page(page)
+        page_id = await self._register_page(page, state)
         return page_id
 
+    async def _route_context(self) -> None:
+        if not self._context:
+            return
+        if self._resource_matcher is None and self._response_cache is None:
+            return
+        if self._context_routed is self._context:
+            return
+        matcher = self._resource_matcher
+        await self._context.route("**/*", lambda route: self._route_request(route, matcher))
+        self._context_routed = self._context
+
+    async def _route_request(self, route, matcher: Optional[ResourceMatcher]) -> None:
+        request = route.request
+        if matcher is not None:
+            try:
+                page_url = request.frame.page.url
+            except Exception:
+                page_url = None
+            if matcher.should_block(
+                request.url,
+                request.resource_type,
+                is_navigation=request.is_navigation_request(),
+                page_url=page_url,
+            ):
+                try:
+                    await route.abort("blockedbyclient")
+                except Exception:
+                    pass
+                return
+        cache = self._response_cache
+        if cache is not None and request.method == "GET" and request.resource_type in CACHEABLE_RESOURCE_TYPES:
+            if await self._fulfill_from_cache(route, cache):
+                return
+        try:
+            await route.continue_()
+        except Exception:
+            # The page may have closed or navigated away while the request was paused.
+            pass
+
+    async def _fulfill_from_cache(self, route, cache: ResponseCache) -> bool:
+        request = route.request
+        # request.headers leaves out Cookie, which Vary and the sharing rules depend on.
+        try:
+            request_headers = await request.all_headers()
+        except Exception as error:
+            logger.debug("Response cache skipped for %s: %s", request.url, error)
+            return False
+        cached = await asyncio.to_thread(cache.get, request.url, request_headers)
+        try:
+            if cached is not None:
+                await route.fulfill(status=cached.status, headers=cached.headers, body=cached.body)
+                return True
+            response = await route.fetch()
+            body = await response.body()
+            await route.fulfill(response=response, body=body)
+        except Exception as error:
+            logger.debug("Response cache failed for %s: %s", request.url, error)
+            return False
+        try:
+            await asyncio.to_thread(
+                cache.put, request.url, request_headers, response.status, response.headers, body
+            )
+        except Exception as error:
+            logger.debug("Response cache store failed for %s: %s", request.url, error)
+        return True
+
+    def _take_warm_state(self) -> Optional[PageState]:
+        while self._warm_states:
+            state = self._warm_states.pop(0)
+            if not state.page.is_closed():
+                return state
+        return None
+
+    def _schedule_warm_refill(self) -> None:
+        if self._warm_target <= 0 or not self._context:
+            return
+        if self._warm_task and not self._warm_task.done():
+            return
+        if len(self._warm_states) >= self._warm_target:
+            return
+        self._warm_task = asyncio.create_task(self._refill_warm_pages())
+
+    async def _refill_warm_pages(self) -> None:
+        while self._context and len(self._warm_states) < self._warm_target:
+            try:
+                page = await self._context.new_page()
+            except Exception as error:
+                logger.debug("Warm page creation failed: %s", error)
+                return
+            self._warm_states.append(self._prepare_page(page))
+
     async def _evaluate_script(self, page: Page, script: str) -> None:
         last_error: Exception | None = None
         for _ in range(2):
@@ -1186,15 +1430,7 @@ class AgentBrowser:
     async def _resolve_default_user_agent(self) -> Optional[str]:
         if not self._browser:
             return None
-        context = await self._browser.new_context()
-        try:
-            page = await context.new_page()
-            user_agent = await page.evaluate("() => navigator.userAgent")
-        finally:
-            await context.close()
-        if not user_agent:
-            return None
-        return user_agent.replace("HeadlessChrome", "Chrome")
+        return await resolve_default_user_agent(self._browser)
 
     async def _maybe_has_cookie_banner(self, page: Page, selectors: list[str]) -> bool:
         selector_union = ",".join(selectors)
@@ -1628,14 +1864,25 @@ class AgentBrowser:
         await self._handle_popups(page)
         await self._disable_overlays(page)
 
-    async def _register_page(self, page: Page) -> str:
-        self._page_counter += 1
-        page_id = f"p{self._page_counter}"
+    def _prepare_page(self, page: Page) -> PageState:
         page.set_default_timeout(self._timeout_ms)
-        state = PageState(page=page)
+        state = PageState(page=page, console=ConsoleRecorder(args_mode=self._console_args))
         state.console.attach(page)
+        state.settle.attach(page)
+        state.events.attach(page)
         self._attach_dialog_handler(page)
+        return state
+
+    async def _register_page(self, page: Page, state: Optional[PageState] = None) -> str:
+        self._page_counter += 1
+        page_id = f"p{self._page_counter}"
+        if state is None:
+            state = self._prepare_page(page)
         self._pages[page_id] = state
+        if self._on_page_registered:
+            self._on_page_registered(page)
+        if self._console_hub:
+            self._console_hub.add_page(page_id, state.console)
         if self._stream_all_config:
             await self._start_stream_for_page(page_id, self._stream_all_config)
             self._stream_all_page_ids.add(page_id)
@@ -1664,12 +1911,27 @@ class AgentBrowser:
                     await state.stream_server.stop()
                 if state.console_server:
                     await state.console_server.stop()
+                if self._console_hub:
+                    self._console_hub.remove_page(page_id)
                 await state.page.close()
             self._stream_all_page_ids.discard(page_id)
             return
 
         for pid in list(self._pages.keys()):
             await self.close(pid)
+        if self._console_hub:
+            await self._console_hub.stop()
+            self._console_hub = None
+        if self._warm_task:
+            self._warm_task.cancel()
+            await asyncio.gather(self._warm_task, return_exceptions=True)
+            self._warm_task = None
+        for warm_state in self._warm_states:
+            try:
+                await warm_state.page.close()
+            except Exception:
+                pass
+        self._warm_states = []
 
         if self._context:
             await self._context.close()
@@ -1713,19 +1975,39 @@ class AgentBrowser:
             raise KeyError(f"未知的 page_id: {page_id}")
         return self._pages[page_id]
 
-    def _cache_aria_tree(self, state: PageState, aria_tree: str) -> None:
+    def _cache_aria_tree(self, state: PageState, aria_tree: str, version: Optional[str]) -> AriaTree:
         state.last_aria_tree = aria_tree
+        state.last_aria_parsed = parse_aria_tree(aria_tree)
         state.last_aria_tree_url = state.page.url
-        state.last_aria_tree_ts = time.monotonic()
+        state.last_aria_tree_version = version
+        return state.last_aria_parsed
 
-    def _get_cached_aria_tree(self, state: PageState, max_age: float) -> Optional[str]:
-        if not state.last_aria_tree:
+    def _mark_page_changed(self, state: PageState) -> None:
+        # Actions can change what the ARIA tree shows without a DOM mutation (form properties
+        # set by the browser, :hover styles), so every action retires the cached tree.
+        state.action_epoch += 1
+
+    def _get_cached_aria_tree(self, state: PageState, version: Optional[str]) -> Optional[AriaTree]:
+        if not state.last_aria_tree or state.last_aria_parsed is None:
             return None
-        if state.last_aria_tree_url != state.page.url:
+        if version is None or state.last_aria_tree_version != version:
             return None
-        if time.monotonic() - state.last_aria_tree_ts > max_age:
+        if state.last_aria_tree_url != state.page.url:
             return None
-        return state.last_aria_tree
+        return state.last_aria_parsed
+
+    async def _get_aria_tree(self, state: PageState, timeout_ms: int) -> AriaTree:
+        # The version is read before capturing, so a change made during the capture
+        # only invalidates the cached tree early.
+        epoch = state.action_epoch
+        window = int(time.monotonic() // ARIA_TREE_REUSE_WINDOW_S)
+        dom_version = await get_dom_version(state.page)
+        version = None if dom_version is None else f"{dom_version}/{epoch}/{window}"
+        tree = self._get_cached_aria_tree(state, version)
+        if tree is None:
+            aria_tree = await state.page.locator(":root").aria_snapshot(timeout=timeout_ms)
+            tree = self._cache_aria_tree(state, aria_tree, version)
+        return tree
 
     async def _start_stream_for_page(
         self,
@@ -1745,6 +2027,12 @@ class AgentBrowser:
             max_width=config.get("max_width"),
             max_height=config.get("max_height"),
             every_nth_frame=config.get("every_nth_frame"),
+            frame_encoding=config.get("frame_encoding", "base64"),
+            adaptive=config.get("adaptive", False),
+            target_fps=config.get("target_fps", 10.0),
+            target_kbps=config.get("target_kbps"),
+            dedupe=config.get("dedupe", "hash"),
+            tile_size=config.get("tile_size"),
         )
         await state.stream_server.start()
         return state.stream_server
@@ -1758,6 +2046,10 @@ class AgentBrowser:
         selector: Optional[str] = None,
         text_limit: Optional[int] = None,
         summary: bool = False,
+        diff_since: Optional[str] = None,
+        in_page: bool = False,
+        max_chars: Optional[int] = None,
+        max_tokens: Optional[int] = None,
     ) -> str:
         """
         Get an accessibility snapshot of the page and generate stable refs.
@@ -1767,9 +2059,19 @@ class AgentBrowser:
             interactive: If True, only include interactive elements in the snapshot.
             max_depth: Optional maximum tree depth to include.
             compact: If True, filter out purely structural unnamed nodes.
-            selector: Optional CSS selector to scope the snapshot.
+            selector: Optional CSS selector, @ref, or "path=..." to scope the snapshot. A path
+                renders that subtree of the full-page tree with the full-page refs.
             text_limit: Optional max length for node labels.
             summary: If True, generate a summary with only headings, landmarks, and interactive elements.
+            diff_since: Set to "last" to return only subtrees added, removed or changed since the
+                previous full-page snapshot taken with the same options. Unchanged nodes keep
+                their refs. Ignored with selector.
+            in_page: If True and interactive or summary is set, filter the tree inside the page so
+                only kept nodes are transferred. Roles and names are approximated in-page.
+            max_chars: Keep the output under this many characters. Interactive and content
+                nodes are kept first; other subtrees collapse into "(+N hidden) [path=...]"
+                lines that can be expanded with selector="path=...".
+            max_tokens: Same as max_chars, counted as roughly 4 characters per token.
 
         Returns:
             An EnhancedSnapshot object with:
@@ -1783,27 +2085,85 @@ class AgentBrowser:
             compact=compact,
             text_limit=text_limit,
             summary=summary,
+            in_page=in_page,
+            max_chars=max_chars,
+            max_tokens=max_tokens,
         )
+        if diff_since not in (None, "last"):
+            raise ValueError(f'Unsupported diff_since: {diff_since} (expected "last")')
         snapshot_timeout_ms = min(10000, self._timeout_ms)
+        path = self._normalize_path(selector) if selector else None
+        if path is not None and not path.startswith("v:"):
+            try:
+                tree = await self._get_aria_tree(state, snapshot_timeout_ms)
+            except PlaywrightTimeoutError:
+                return f"[timeout after {snapshot_timeout_ms}ms]"
+            try:
+                snapshot = build_path_snapshot(tree, replace(options, in_page=False), path, registry=state.refs)
+            except KeyError as error:
+                raise ValueError(error.args[0]) from error
+            return snapshot.tree
         if not selector:
+            filter_in_page = in_page and (interactive or summary)
+            root = state.page.locator(":root")
+            handles: list[str] = []
             try:
-                snapshot = await get_enhanced_snapshot(
-                    state.page,
-                    options,
-                    timeout_ms=snapshot_timeout_ms,
-                )
+                if filter_in_page:
+                    handle_prefix = None
+                    if self._ref_node_ids:
+                        state.handle_seq += 1
+                        handle_prefix = f"s{state.handle_seq}-"
+                    aria_tree, handles = await get_filtered_aria_tree(
+                        root,
+                        options,
+                        timeout_ms=snapshot_timeout_ms,
+                        handle_prefix=handle_prefix,
+                    )
+                    # Paths of a filtered tree do not match the full tree, so keep it out of the path cache.
+                    tree = parse_aria_tree(aria_tree)
+                else:
+                    tree = await self._get_aria_tree(state, snapshot_timeout_ms)
             except PlaywrightTimeoutError:
                 return f"[timeout after {snapshot_timeout_ms}ms]"
-            state.refs = snapshot.refs
+            # A diff is only meaningful against a tree rendered with the same filters,
+            # so each option set keeps its own baseline.
+            baseline_key = astuple(replace(options, in_page=filter_in_page))
+            previous = state.snapshot_baselines.get(baseline_key) if diff_since == "last" else None
+            snapshot, baseline = build_snapshot_diff(
+                tree,
+                options,
+                previous,
+                registry=state.refs,
+                scope="in_page" if filter_in_page else "",
+            )
+            state.snapshot_baselines.pop(baseline_key, None)
+            state.snapshot_baselines[baseline_key] = baseline
+            while len(state.snapshot_baselines) > MAX_SNAPSHOT_BASELINES:
+                del state.snapshot_baselines[next(iter(state.snapshot_baselines))]
+            if diff_since == "last" and previous is None and len(state.snapshot_baselines) > 1:
+                snapshot.tree = (
+                    "diff (since=last): no earlier snapshot with the same options, full tree follows\n"
+                    + snapshot.tree
+                )
+            if self._ref_node_ids:
+                if filter_in_page:
+                    attach_node_handles(tree, snapshot, handles)
+                else:
+                    await self._capture_ref_node_ids(state, tree, snapshot.refs)
             return snapshot.tree
 
         locator = None
-        if selector.startswith("@"):
+        if path is not None:
+            try:
+                locator = await self._resolve_path_locator(state, path)
+            except KeyError as error:
+                raise ValueError(error.args[0]) from error
+        elif selector.startswith("@"):
             ref_id = selector[1:]
             try:
-                locator = self._resolve_ref_locator(state, ref_id)
-            except KeyError:
-                raise ValueError(f"Unknown ref: {selector}")
+                locator = await self._resolve_ref_locator(state, ref_id)
+            except KeyError as error:
+                raise ValueError(error.args[0]) from error
         else:
             locator = state.page.locator(selector)
 
@@ -1816,26 +2176,147 @@ class AgentBrowser:
                     locator,
                     options,
                     timeout_ms=snapshot_timeout_ms,
+                    registry=state.refs,
+                    scope=selector,
                 )
             except PlaywrightTimeoutError:
                 return f"[timeout after {snapshot_timeout_ms}ms]"
-            state.refs = snapshot.refs
             return snapshot.tree
+        handle_prefix = None
+        if self._ref_node_ids:
+            state.handle_seq += 1
+            handle_prefix = f"s{state.handle_seq}-"
+        note = f'Note: selector "{selector}" matched {count} elements; rendering in order.'
+        section_options = options
+        budget = options.char_budget()
+        if budget is not None:
+            # Section headers and the note come out of the same budget.
+            overhead = len(note) + 2 + count * len(f"section (selector={selector}#{count})\n\n")
+            section_options = replace(options, max_chars=max(0, budget - overhead), max_tokens=None)
+        try:
+            snapshots = await get_section_snapshots(
+                locator,
+                count,
+                section_options,
+                timeout_ms=snapshot_timeout_ms,
+                registry=state.refs,
+                scope=selector,
+                handle_prefix=handle_prefix,
+            )
+        except PlaywrightTimeoutError:
+            return f"[timeout after {snapshot_timeout_ms}ms]"
         sections: list[str] = []
-        for index in range(count):
+        for index, snapshot in enumerate(snapshots):
+            body = snapshot.tree if snapshot is not None else f"[timeout after {snapshot_timeout_ms}ms]"
+            sections.append(f"section (selector={selector}#{index + 1})\n{body}")
+        return "\n".join([note, "", *sections])
+
+    async def snapshot_stream(
+        self,
+        page_id: str,
+        interactive: bool = False,
+        max_depth: Optional[int] = None,
+        compact: bool = False,
+        selector: Optional[str] = None,
+        text_limit: Optional[int] = None,
+        summary: bool = False,
+        in_page: bool = False,
+        chunk_lines: int = 200,
+        max_nodes: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Yield a snapshot in chunks of rendered lines (with inline @eN refs) as they are produced.
+
+        Args:
+            page_id: Target page id returned by open().
+            interactive: If True, only include interactive elements.
+            max_depth: Optional maximum tree depth to include.
+            compact: If True, filter out purely structural unnamed nodes.
+            selector: Optional CSS selector or @ref to scope the snapshot (first match).
+            text_limit: Optional max length for node labels.
+            summary: If True, only headings, landmarks, and interactive elements.
+            in_page: If True and interactive or summary is set, filter inside the page.
+            chunk_lines: Target number of lines per chunk; chunks end at top-level subtrees.
+            max_nodes: Stop after this many nodes.
+            max_chars: Character budget, planned like snapshot(max_chars=...): low-value
+                subtrees collapse into "(+N hidden) [path=...]" lines.
+            max_tokens: Same as max_chars, counted as roughly 4 characters per token.
+
+        Returns:
+            An async iterator of text chunks. The last chunk ends with "... (truncated ...)"
+            when a budget stopped the walk.
+        """
+        state = self._get_state(page_id)
+        options = SnapshotOptions(
+            interactive=interactive,
+            max_depth=max_depth,
+            compact=compact,
+            text_limit=text_limit,
+            summary=summary,
+            in_page=in_page,
+            max_chars=max_chars,
+            max_tokens=max_tokens,
+        )
+        snapshot_timeout_ms = min(10000, self._timeout_ms)
+        filter_in_page = in_page and (interactive or summary)
+        if selector and selector.startswith("@"):
             try:
-                snapshot = await get_enhanced_snapshot_locator(
-                    locator.nth(index),
+                root = await self._resolve_ref_locator(state, selector[1:])
+            except KeyError as error:
+                raise ValueError(error.args[0]) from error
+        elif selector:
+            root = state.page.locator(selector).first
+        else:
+            root = state.page.locator(":root")
+        handle_prefix = None
+        if self._ref_node_ids and filter_in_page:
+            state.handle_seq += 1
+            handle_prefix = f"s{state.handle_seq}-"
+        handles: list[str] = []
+        try:
+            if filter_in_page:
+                aria_tree, handles = await get_filtered_aria_tree(
+                    root,
                     options,
                     timeout_ms=snapshot_timeout_ms,
+                    handle_prefix=handle_prefix,
                 )
-                sections.append(f"section (selector={selector}#{index + 1})\n{snapshot.tree}")
-            except PlaywrightTimeoutError:
-                sections.append(
-                    f"section (selector={selector}#{index + 1})\n[timeout after {snapshot_timeout_ms}ms]"
-                )
-        note = f'Note: selector "{selector}" matched {count} elements; rendering in order.'
-        return "\n".join([note, "", *sections])
+                tree = parse_aria_tree(aria_tree)
+                del aria_tree
+            elif selector:
+                tree = parse_aria_tree(await root.aria_snapshot(timeout=snapshot_timeout_ms))
+            else:
+                tree = await self._get_aria_tree(state, snapshot_timeout_ms)
+        except PlaywrightTimeoutError:
+            yield f"[timeout after {snapshot_timeout_ms}ms]"
+            return
+        if selector and not selector.startswith("@"):
+            # Only the first match is rendered, so refs must resolve inside that element alone.
+            scope = f"{selector}#1"
+        else:
+            scope = selector or ("in_page" if filter_in_page else "")
+        line_handles: Dict[int, str] = {}
+        for line_index, node_id in enumerate(tree.line_nodes):
+            if node_id >= 0 and line_index < len(handles):
+                line_handles[node_id] = handles[line_index]
+        streamed_refs: Dict[str, RefTarget] = {}
+        for chunk in iter_snapshot_chunks(
+            tree,
+            options,
+            registry=state.refs,
+            scope=scope,
+            chunk_lines=chunk_lines,
+            max_nodes=max_nodes,
+        ):
+            for ref_id, node_id in chunk.ref_nodes.items():
+                chunk.refs[ref_id].handle = line_handles.get(node_id)
+            streamed_refs.update(chunk.refs)
+            yield chunk.text
+        if self._ref_node_ids and not scope:
+            # Refs are already out; node ids are attached to the same targets afterwards.
+            await self._capture_ref_node_ids(state, tree, streamed_refs)
 
     async def snapshot_index(
         self,
@@ -1884,63 +2365,134 @@ class AgentBrowser:
         Args:
             page_id: Target page id returned by open().
             query: Search keyword or regex pattern.
-            mode: "fuzzy" for substring match, "regex" for regular expression.
+            mode: "fuzzy" for ranked token search (exact, prefix, substring and
+                near-miss spellings), "regex" for a regular expression.
             limit: Maximum number of matches to return.
             text_limit: Max length for node labels.
 
         Returns:
-            A list of matching nodes with their @ref IDs.
-        """
-        # Get full snapshot to search everything
-        # We use a larger text_limit to ensure we can find content
-        tree = await self.snapshot(
-            page_id, 
-            interactive=False, 
-            summary=False, 
-            text_limit=500  # Allow more text for searching
-        )
-        
-        lines = tree.splitlines()
-        results = []
-        
-        import re
+            Matching nodes, best first, with their @ref IDs and paths.
+        """
+        if mode not in ("fuzzy", "regex"):
+            raise ValueError(f'Unsupported mode: {mode} (expected "fuzzy" or "regex")')
+        state = self._get_state(page_id)
+        # The index lives on the parsed tree, so repeated searches on the same page
+        # version reuse it instead of taking a new snapshot.
+        snapshot_timeout_ms = min(10000, self._timeout_ms)
+        try:
+            tree = await self._get_aria_tree(state, snapshot_timeout_ms)
+        except PlaywrightTimeoutError:
+            return f"[timeout after {snapshot_timeout_ms}ms]"
+        index = tree.search_index()
         if mode == "regex":
-             try:
-                 pattern = re.compile(query, re.I)
-                 match_func = lambda s: pattern.search(s)
-             except re.error as e:
-                 return f"Invalid regex: {e}"
+            try:
+                pattern = re.compile(query, re.I)
+            except re.error as e:
+                return f"Invalid regex: {e}"
+            node_ids = index.search_regex(pattern, limit=limit)
         else:
-             needle = query.lower()
-             match_func = lambda s: needle in s.lower()
-             
-        for line in lines:
-            if match_func(line):
-                # If text_limit is requested for output, we might need to truncate again?
-                # But the line is already formatted.
-                # Just return the line.
-                results.append(line.strip())
-                if len(results) >= limit:
-                    break
-        
-        if not results:
-             return "(no matches)"
-             
+            node_ids = index.search(query, tree, limit=limit)
+        if not node_ids:
+            return "(no matches)"
+        results = build_search_results(
+            tree,
+            node_ids,
+            SnapshotOptions(text_limit=text_limit),
+            registry=state.refs,
+        )
         header = f'search (query="{query}", mode={mode}, limit={limit})'
         return "\n".join([header, *results])
 
-    def _resolve_ref_locator(self, state: PageState, ref_id: str):
-        if ref_id not in state.refs:
+    async def _get_cdp_session(self, state: PageState):
+        if state.cdp_session is None:
+            state.cdp_session = await state.page.context.new_cdp_session(state.page)
+        return state.cdp_session
+
+    async def _capture_ref_node_ids(self, state: PageState, tree: AriaTree, refs: Dict[str, RefTarget]) -> None:
+        try:
+            session = await self._get_cdp_session(state)
+            await capture_backend_node_ids(session, tree, refs)
+        except Exception as error:
+            # Node ids are an optimization; refs still resolve by role and name.
+            logger.debug("Capture backend node ids failed: %s", error)
+
+    async def _resolve_node_locator(self, state: PageState, backend_node_id: int):
+        session = await self._get_cdp_session(state)
+        token = f"n{backend_node_id}"
+        try:
+            resolved = await session.send(
+                "DOM.resolveNode",
+                {"backendNodeId": backend_node_id, "objectGroup": REF_OBJECT_GROUP},
+            )
+            object_id = resolved["object"]["objectId"]
+            stamped = await session.send(
+                "Runtime.callFunctionOn",
+                {
+                    "objectId": object_id,
+                    "functionDeclaration": STAMP_NODE_JS,
+                    "arguments": [{"value": NODE_HANDLE_ATTR}, {"value": token}],
+                    "returnByValue": True,
+                },
+            )
+            await session.send("Runtime.releaseObjectGroup", {"objectGroup": REF_OBJECT_GROUP})
+        except Exception:
+            return None
+        if not stamped.get("result", {}).get("value"):
+            return None
+        return state.page.locator(f'[{NODE_HANDLE_ATTR}="{token}"]')
+
+    async def _resolve_ref_locator(self, state: PageState, ref_id: str):
+        target = state.refs.get(ref_id)
+        if target is None:
             raise KeyError(f"Unknown ref: {ref_id}")
-        target = state.refs[ref_id]
+        if state.refs.is_stale(ref_id):
+            raise KeyError(f"Stale ref: @{ref_id} is not in the latest snapshot, take a new snapshot first")
+        if target.backend_node_id is not None:
+            locator = await self._resolve_node_locator(state, target.backend_node_id)
+            if locator is not None:
+                return locator
+            target.backend_node_id = None
+        if target.handle:
+            locator = state.page.locator(f'[{NODE_HANDLE_ATTR}="{target.handle}"]')
+            if await locator.count() == 1:
+                return locator
+            target.handle = None
+        if not target.scope or target.scope == "in_page":
+            return self._role_locator(state.page, target)
+        # nth counts within the snapshot's scope; on the whole page it could match another element.
+        try:
+            root = await self._ref_scope_root(state, target.scope)
+        except KeyError:
+            root = None
+        if root is not None:
+            locator = self._role_locator(root, target)
+            if await locator.count():
+                return locator
+        raise KeyError(
+            f"Stale ref: @{ref_id} is no longer inside {target.scope}, take a new snapshot first"
+        )
+
+    def _role_locator(self, root, target: RefTarget):
         if target.name:
-            locator = state.page.get_by_role(target.role, name=target.name, exact=True)
+            locator = root.get_by_role(target.role, name=target.name, exact=True)
         else:
-            locator = state.page.get_by_role(target.role)
+            locator = root.get_by_role(target.role)
         if target.nth is not None:
             locator = locator.nth(target.nth)
         return locator
 
+    async def _ref_scope_root(self, state: PageState, scope: str):
+        base, separator, index = scope.rpartition("#")
+        if not (separator and base and index.isdigit()):
+            base, index = scope, ""
+        if base.startswith("@"):
+            root = await self._resolve_ref_locator(state, base[1:])
+        else:
+            root = state.page.locator(base)
+        if index:
+            root = root.nth(int(index) - 1)
+        return root
+
     def _is_path(self, selector_or_ref: str) -> bool:
         normalized = self._normalize_path(selector_or_ref)
         return normalized is not None
@@ -1980,19 +2532,12 @@ class AgentBrowser:
             if normalized not in state.index_paths:
                 raise KeyError(f"未知的 path: {normalized}")
             return state.page.locator(state.index_paths[normalized])
-        cached = self._get_cached_aria_tree(state, max_age=3.0)
-        if cached:
-            try:
-                return resolve_path_locator(state.page, cached, normalized)
-            except KeyError:
-                pass
         snapshot_timeout_ms = min(10000, self._timeout_ms)
         try:
-            aria_tree = await state.page.locator(":root").aria_snapshot(timeout=snapshot_timeout_ms)
+            tree = await self._get_aria_tree(state, snapshot_timeout_ms)
         except PlaywrightTimeoutError as error:
             raise ValueError(f"Path snapshot timed out after {snapshot_timeout_ms}ms") from error
-        self._cache_aria_tree(state, aria_tree)
-        return resolve_path_locator(state.page, aria_tree, normalized)
+        return resolve_path_locator(state.page, tree, normalized)
 
     async def _get_locator_text(self, locator) -> Optional[str]:
         try:
@@ -2011,9 +2556,9 @@ class AgentBrowser:
 
     async def _get_locator_with_note(self, state: PageState, selector_or_ref: str):
         if selector_or_ref.startswith("@"):
-            return self._resolve_ref_locator(state, selector_or_ref[1:]), None
+            return await self._resolve_ref_locator(state, selector_or_ref[1:]), None
         if re.fullmatch(r"e\d+", selector_or_ref):
-            return self._resolve_ref_locator(state, selector_or_ref), None
+            return await self._resolve_ref_locator(state, selector_or_ref), None
         if self._is_path(selector_or_ref):
             locator = await self._resolve_path_locator(state, selector_or_ref)
             return locator, None
@@ -2045,62 +2590,70 @@ class AgentBrowser:
             result["note"] = note
         return result
 
+    async def wait_for_settle(self, page_id: str, quiet_ms: int = 300, timeout_ms: int = 5000) -> dict:
+        """
+        Wait until the page has no pending requests and no DOM mutations for quiet_ms.
+
+        Args:
+            page_id: Target page id returned by open().
+            quiet_ms: Required quiet period in milliseconds.
+            timeout_ms: Maximum time to wait in milliseconds.
+
+        Returns:
+            A dict with settled (False on timeout), elapsed_ms, pending_requests, navigated and url.
+        """
+        state = self._get_state(page_id)
+        result = await state.settle.wait(state.page, quiet_ms=quiet_ms, timeout_ms=timeout_ms)
+        result["url"] = state.page.url
+        return result
+
+    async def _wait_after_action(self, state: PageState, timeout_ms: int) -> None:
+        if self._action_wait == "settle":
+            await state.settle.wait(state.page, quiet_ms=self._settle_quiet_ms, timeout_ms=timeout_ms)
+            return
+        try:
+            await state.page.wait_for_load_state("domcontentloaded", timeout=timeout_ms)
+        except PlaywrightTimeoutError:
+            pass
+
     async def _click_locator(self, state: PageState, locator, selector: str) -> dict:
         url_before = state.page.url
-        popup_timeout_ms = min(1500, self._timeout_ms)
-        download_timeout_ms = min(1500, self._timeout_ms)
+        wait_timeout_ms = min(1500, self._timeout_ms)
+        grace = min(CLICK_EVENT_GRACE_MS, self._timeout_ms) / 1000
         async def click_once() -> dict:
-            new_page: Optional[Page] = None
-            download = None
-            page_task = None
-            download_task = None
-            tasks: list[asyncio.Task] = []
+            seq = state.events.seq
             try:
-                if self._context:
-                    page_task = asyncio.create_task(
-                        self._context.wait_for_event("page", timeout=popup_timeout_ms)
-                    )
-                    tasks.append(page_task)
-                download_task = asyncio.create_task(
-                    state.page.wait_for_event("download", timeout=download_timeout_ms)
-                )
-                tasks.append(download_task)
-                await locator.click()
-                try:
-                    await state.page.wait_for_load_state("domcontentloaded", timeout=popup_timeout_ms)
-                except PlaywrightTimeoutError:
-                    pass
-            except Exception as error:
-                for task in tasks:
-                    if not task.done():
-                        task.cancel()
-                if tasks:
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                raise error
-
-            if page_task:
-                try:
-                    new_page = await page_task
-                except PlaywrightTimeoutError:
-                    new_page = None
-
-            if download_task:
-                try:
-                    download = await download_task
-                except PlaywrightTimeoutError:
-                    download = None
+                opens_window = await locator.evaluate(NEW_WINDOW_TARGET_JS, timeout=wait_timeout_ms)
+            except Exception:
+                opens_window = False
+            await locator.click()
+            await self._wait_after_action(state, wait_timeout_ms)
+            # Script-driven popups and downloads are reported while the click is dispatched, so by
+            # now they are in the journal. Navigations into another window or a download, and
+            # main-frame navigations that have not committed (an attachment response never does),
+            # can still be in flight; those get a short grace period.
+            if opens_window:
+                events = await state.events.wait_for(seq, {"popup", "download"}, timeout=grace)
+            else:
+                pending = state.events.pending_navigation(seq)
+                if pending is not None:
+                    await state.events.wait_for(pending, {"download", "navigation"}, timeout=grace)
+                events = state.events.since(seq, {"popup", "download"})
 
             new_pages: list[dict] = []
-            if new_page:
-                new_page_id = await self._register_page(new_page)
-                new_pages.append({"page_id": new_page_id, "url": new_page.url})
-
             download_info = None
-            if download:
-                download_info = {
-                    "url": download.url,
-                    "suggested_filename": download.suggested_filename,
-                }
+            for event in events:
+                if event.kind == "popup":
+                    new_page = event.payload
+                    if new_page.is_closed():
+                        continue
+                    new_page_id = await self._register_page(new_page)
+                    new_pages.append({"page_id": new_page_id, "url": new_page.url})
+                elif event.kind == "download" and download_info is None:
+                    download_info = {
+                        "url": event.payload.url,
+                        "suggested_filename": event.payload.suggested_filename,
+                    }
 
             return {
                 "clicked": True,
@@ -2121,6 +2674,8 @@ class AgentBrowser:
                 return await click_once()
             except Exception as retry_error:
                 raise to_ai_friendly_error(retry_error, selector) from retry_error
+        finally:
+            self._mark_page_changed(state)
 
     async def fill(self, page_id: str, selector_or_ref: str, text: str) -> dict:
         """
@@ -2141,6 +2696,8 @@ class AgentBrowser:
             value = await locator.input_value()
         except Exception as error:
             raise to_ai_friendly_error(error, selector_or_ref) from error
+        finally:
+            self._mark_page_changed(state)
         result = {"filled": True, "value": value, "url": state.page.url}
         if note:
             result["note"] = note
@@ -2165,6 +2722,8 @@ class AgentBrowser:
             selected = await locator.input_value()
         except Exception as error:
             raise to_ai_friendly_error(error, selector_or_ref) from error
+        finally:
+            self._mark_page_changed(state)
         result = {"selected": True, "value": selected, "url": state.page.url}
         if note:
             result["note"] = note
@@ -2187,12 +2746,11 @@ class AgentBrowser:
         url_before = state.page.url
         try:
             await locator.press(key)
-            try:
-                await state.page.wait_for_load_state("domcontentloaded", timeout=min(1500, self._timeout_ms))
-            except PlaywrightTimeoutError:
-                pass
+            await self._wait_after_action(state, min(1500, self._timeout_ms))
         except Exception as error:
             raise to_ai_friendly_error(error, selector_or_ref) from error
+        finally:
+            self._mark_page_changed(state)
         result = {"pressed": True, "url_before": url_before, "url_after": state.page.url}
         if note:
             result["note"] = note
@@ -2216,6 +2774,8 @@ class AgentBrowser:
             checked = await locator.is_checked()
         except Exception as error:
             raise to_ai_friendly_error(error, selector_or_ref) from error
+        finally:
+            self._mark_page_changed(state)
         result = {"checked": True, "is_checked": checked, "url": state.page.url}
         if note:
             result["note"] = note
@@ -2239,6 +2799,8 @@ class AgentBrowser:
             checked = await locator.is_checked()
         except Exception as error:
             raise to_ai_friendly_error(error, selector_or_ref) from error
+        finally:
+            self._mark_page_changed(state)
         result = {"unchecked": True, "is_checked": checked, "url": state.page.url}
         if note:
             result["note"] = note
@@ -2262,6 +2824,8 @@ class AgentBrowser:
             await locator.set_input_files(list(files))
         except Exception as error:
             raise to_ai_friendly_error(error, selector_or_ref) from error
+        finally:
+            self._mark_page_changed(state)
         result = {"uploaded": True, "url": state.page.url}
         if note:
             result["note"] = note
@@ -2423,10 +2987,7 @@ class AgentBrowser:
                     raise ValueError("action=press 需要 action_value 参数")
                 url_before = state.page.url
                 await locator.press(value)
-                try:
-                    await state.page.wait_for_load_state("domcontentloaded", timeout=min(1500, self._timeout_ms))
-                except PlaywrightTimeoutError:
-                    pass
+                await self._wait_after_action(state, min(1500, self._timeout_ms))
                 return {"pressed": True, "url_before": url_before, "url_after": state.page.url}
             if action == "check":
                 await locator.check()
@@ -2458,9 +3019,104 @@ class AgentBrowser:
                 return {"checked": await locator.is_checked()}
         except Exception as error:
             raise to_ai_friendly_error(error, selector) from error
+        finally:
+            if action not in READ_ONLY_ACTIONS:
+                self._mark_page_changed(state)
 
         raise ValueError(f"未知的 action: {action}")
 
+    async def batch(
+        self,
+        page_id: str,
+        actions: list[dict],
+        snapshot: Optional[str] = "diff",
+        interactive: bool = True,
+        stop_on_error: bool = True,
+    ) -> dict:
+        """
+        Run a list of actions on one page in a single call.
+
+        Every target is validated and resolved once before the first action runs, so an
+        unknown or stale ref fails the whole batch up front instead of halfway through a form.
+
+        Args:
+            page_id: Target page id returned by open().
+            actions: Steps to run in order, e.g.
+                [{"action": "fill", "target": "@e3", "value": "alice"},
+                 {"action": "check", "target": "@e5"},
+                 {"action": "click", "target": "@e7"}].
+                "action" is any action supported by find(); "value" is required for
+                fill/select/press and "files" for upload.
+            snapshot: "diff" to append a diff since the previous snapshot, "full" to append a
+                new snapshot, or None to skip it.
+            interactive: Passed to the final snapshot.
+            stop_on_error: If True, stop at the first failing step.
+
+        Returns:
+            A dict with per-step results, the number of completed steps, the current url and
+            the final snapshot text (if requested).
+        """
+        if snapshot not in (None, "diff", "full"):
+            raise ValueError(f'Unsupported snapshot: {snapshot} (expected "diff", "full" or None)')
+        state = self._get_state(page_id)
+        for index, step in enumerate(actions):
+            action = step.get("action")
+            if action not in BATCH_ACTIONS:
+                raise ValueError(f"step {index}: 未知的 action: {action}")
+            if not step.get("target"):
+                raise ValueError(f"step {index}: action={action} 需要 target 参数")
+            if action in ("fill", "select", "press") and step.get("value") is None:
+                raise ValueError(f"step {index}: action={action} 需要 value 参数")
+            if action == "upload" and not step.get("files"):
+                raise ValueError(f"step {index}: action=upload 需要 files 参数")
+
+        locators: Dict[str, tuple[Any, Optional[str]]] = {}
+        for index, step in enumerate(actions):
+            target = step["target"]
+            if target in locators:
+                continue
+            try:
+                locators[target] = await self._get_locator_with_note(state, target)
+            except KeyError as error:
+                raise ValueError(f"step {index}: {error.args[0]}") from error
+
+        results: list[dict] = []
+        for index, step in enumerate(actions):
+            target = step["target"]
+            locator, note = locators[target]
+            entry: dict[str, Any] = {"index": index, "action": step["action"], "target": target}
+            try:
+                entry["result"] = await self._perform_action(
+                    state,
+                    locator,
+                    step["action"],
+                    value=step.get("value"),
+                    files=step.get("files"),
+                    selector=target,
+                )
+                entry["ok"] = True
+            except Exception as error:
+                entry["ok"] = False
+                entry["error"] = str(error)
+            if note:
+                entry["note"] = note
+            results.append(entry)
+            if not entry["ok"] and stop_on_error:
+                break
+
+        output: dict[str, Any] = {
+            "results": results,
+            "completed": sum(1 for entry in results if entry["ok"]),
+            "url": state.page.url,
+        }
+        if snapshot:
+            output["snapshot"] = await self.snapshot(
+                page_id,
+                interactive=interactive,
+                diff_since="last" if snapshot == "diff" else None,
+            )
+        return output
+
     async def back(self, page_id: str, steps: int = 1) -> dict:
         """
         Navigate back in the page history.
@@ -2578,7 +3234,12 @@ class AgentBrowser:
         await storage_clear(state.page, storage)
 
     async def console_get(
-        self, page_id: str, since: Optional[float] = None, limit: int = 200
+        self,
+        page_id: str,
+        since: Optional[float] = None,
+        limit: int = 200,
+        since_seq: Optional[int] = None,
+        levels: Optional[Iterable[str]] = None,
     ) -> list[dict]:
         """
         Get collected console messages from the page.
@@ -2587,22 +3248,22 @@ class AgentBrowser:
             page_id: Target page id returned by open().
             since: Unix timestamp (seconds). If provided, only returns entries after it.
             limit: Max number of entries to return.
+            since_seq: If provided, only returns entries with a larger seq (pass the last seq seen).
+            levels: Optional message types to keep (e.g. ["error", "warning"]).
 
         Returns:
-            A list of console entry dicts: timestamp/type/text/location/args.
+            A list of console entry dicts: seq/timestamp/type/text/location/args. With lazy
+            console_args, args is None for messages whose arguments were not kept.
         """
         state = self._get_state(page_id)
-        entries = state.console.get_entries(since=since, limit=limit)
-        return [
-            {
-                "timestamp": entry.timestamp,
-                "type": entry.type,
-                "text": entry.text,
-                "location": entry.location,
-                "args": entry.args,
-            }
-            for entry in entries
-        ]
+        entries = state.console.get_entries(
+            since=since,
+            limit=limit,
+            since_seq=since_seq,
+            levels=set(levels) if levels is not None else None,
+        )
+        await state.console.materialize(entries, budget=CONSOLE_ARG_BUDGET)
+        return [entry.to_dict() for entry in entries]
 
     async def console_stream_start(self, page_id: str, host: str = "127.0.0.1", port: int = 9224) -> int:
         """
@@ -2611,17 +3272,17 @@ class AgentBrowser:
         Args:
             page_id: Target page id returned by open().
             host: Bind host.
-            port: Bind port.
+            port: Bind port; 0 picks a free port.
 
         Returns:
-            The port number used by the server.
+            The port number the server is bound to.
         """
         state = self._get_state(page_id)
         if state.console_server:
-            return port
+            return state.console_server.port
         state.console_server = ConsoleStreamServer(state.console, host=host, port=port)
         await state.console_server.start()
-        return port
+        return state.console_server.port
 
     async def console_stream_stop(self, page_id: str) -> None:
         """
@@ -2638,6 +3299,44 @@ class AgentBrowser:
             await state.console_server.stop()
             state.console_server = None
 
+    async def console_hub_start(self, host: str = "127.0.0.1", port: int = 9224) -> int:
+        """
+        Start one WebSocket console server that multiplexes every page of this instance.
+
+        Clients send {"action": "subscribe", "page_id": "p1" or "*", "levels": [...],
+        "since_seq": n} and {"action": "unsubscribe", "page_id": ...}; entries carry a page_id.
+        Pages opened later are added automatically.
+
+        Args:
+            host: Bind host.
+            port: Bind port; 0 picks a free port.
+
+        Returns:
+            The port number the server is bound to.
+        """
+        if self._console_hub:
+            return self._console_hub.port
+        hub = ConsoleHubServer(host=host, port=port)
+        await hub.start()
+        for page_id, state in self._pages.items():
+            hub.add_page(page_id, state.console)
+        self._console_hub = hub
+        return hub.port
+
+    async def console_hub_stop(self) -> None:
+        """
+        Stop the shared WebSocket console server.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._console_hub:
+            await self._console_hub.stop()
+            self._console_hub = None
+
     async def stream_start(
         self,
         page_id: str,
@@ -2648,6 +3347,12 @@ class AgentBrowser:
         max_width: Optional[int] = None,
         max_height: Optional[int] = None,
         every_nth_frame: Optional[int] = None,
+        frame_encoding: str = "base64",
+        adaptive: bool = False,
+        target_fps: float = 10.0,
+        target_kbps: Optional[float] = None,
+        dedupe: str = "hash",
+        tile_size: Optional[int] = None,
     ) -> StreamServer | Dict[str, StreamServer]:
         """
         Start streaming the page viewport via callbacks.
@@ -2661,6 +3366,17 @@ class AgentBrowser:
             max_width: Optional max width for CDP screencast.
             max_height: Optional max height for CDP screencast.
             every_nth_frame: Optional frame sampling for CDP screencast.
+            frame_encoding: "base64" (str data) or "bytes" (raw image bytes, decoded once).
+                Use "bytes" with FrameStreamServer.publish for a binary WebSocket feed.
+            adaptive: Measure callback and ack latency and lower quality, size and frame rate
+                (raising them again when there is headroom); stale frames are dropped, not queued.
+            target_fps: Frame rate cap and latency budget in adaptive mode.
+            target_kbps: Optional output bandwidth budget per page in adaptive mode.
+            dedupe: Screenshot fallback only: "hash" skips byte-identical frames, "thumbnail"
+                compares downsampled grayscale images (needs opencv-python), "off" emits all.
+                Idle pages are polled less often until they change.
+            tile_size: Screenshot fallback only: emit "tiles" payloads with just the changed
+                tiles of this size between periodic full frames (needs opencv-python).
 
         Returns:
             StreamServer for a single page, or a mapping for all pages when page_id="*".
@@ -2673,6 +3389,12 @@ class AgentBrowser:
             "max_width": max_width,
             "max_height": max_height,
             "every_nth_frame": every_nth_frame,
+            "frame_encoding": frame_encoding,
+            "adaptive": adaptive,
+            "target_fps": target_fps,
+            "target_kbps": target_kbps,
+            "dedupe": dedupe,
+            "tile_size": tile_size,
         }
 
         if page_id == "*":
@@ -2756,6 +3478,7 @@ class AgentBrowser:
                 delta_y=delta_y,
                 modifiers=modifiers,
             )
+            self._mark_page_changed(state)
 
     async def stream_inject_keyboard(
         self,
@@ -2789,6 +3512,7 @@ class AgentBrowser:
                 text=text,
                 modifiers=modifiers,
             )
+            self._mark_page_changed(state)
 
     async def stream_inject_touch(
         self,
@@ -2814,6 +3538,7 @@ class AgentBrowser:
             await state.stream_server.inject_touch(
                 event_type=event_type, touch_points=touch_points, modifiers=modifiers
             )
+            self._mark_page_changed(state)
 
     async def get_url(self, page_id: str) -> str:
         """
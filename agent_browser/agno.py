@@ -35,10 +35,11 @@ class AgentBrowserToolkit(Toolkit):
                 (self.check, "check"),
                 (self.uncheck, "uncheck"),
                 (self.upload, "upload"),
+                (self.batch, "batch"),
             ],
             auto_register=True,
             instructions="""
-[Web Page Operation Guidelines] First, use open() to obtain the page ID (the foundational parameter for all operations); prioritize calling snapshot_index() to get a page overview (low token consumption; returns headings, landmarks, and interactive elements with stable @eN refs); you can interact directly with these refs, or if you need to view full content of a specific area, call snapshot(selector="@eN") using the reference ID from the index; all interaction operations—such as fill, click, and select—must be executed using the @eN reference returned by the most recent snapshot operation. Note that each snapshot call regenerates references, invalidating previous ones. In dynamic pages, if click/press doesn't trigger a jump, observe changes via snapshot methods.
+[Web Page Operation Guidelines] First, use open() to obtain the page ID (the foundational parameter for all operations); prioritize calling snapshot_index() to get a page overview (low token consumption; returns headings, landmarks, and interactive elements with stable @eN refs); you can interact directly with these refs, or if you need to view full content of a specific area, call snapshot(selector="@eN") using the reference ID from the index; all interaction operations—such as fill, click, and select—must be executed using the @eN reference returned by the most recent snapshot operation. Refs stay the same across snapshots as long as the element is still on the page; if an action reports a stale ref, take a new snapshot. In dynamic pages, if click/press doesn't trigger a jump, observe changes via snapshot methods.
 """,
             add_instructions=True,
         )
@@ -100,6 +101,7 @@ class AgentBrowserToolkit(Toolkit):
         max_depth: Optional[int] = None,
         compact: bool = False,
         selector: Optional[str] = None,
+        max_tokens: Optional[int] = None,
     ) -> Dict[str, Any]:
         """
         Get an accessibility snapshot of the page and generate stable refs.
@@ -109,7 +111,9 @@ class AgentBrowserToolkit(Toolkit):
             interactive: If True, only include interactive elements in the snapshot.
             max_depth: Optional maximum tree depth to include.
             compact: If True, filter out purely structural unnamed nodes.
-            selector: Optional CSS selector or @ref to scope the snapshot.
+            selector: Optional CSS selector, @ref, or path=... to scope the snapshot.
+            max_tokens: Optional output budget. Parts that do not fit show as
+                "(+N hidden) [path=...]"; pass that path as selector to expand them.
 
         Returns:
             Human-readable accessibility tree text.
@@ -121,6 +125,7 @@ class AgentBrowserToolkit(Toolkit):
                 max_depth=max_depth,
                 compact=compact,
                 selector=selector,
+                max_tokens=max_tokens,
             )
             return s
         except Exception as exc:
@@ -382,6 +387,37 @@ class AgentBrowserToolkit(Toolkit):
             logger.error(f"inner_html error: {exc}", exc_info=True)
             return str(exc)
 
+    async def batch(
+        self,
+        page_id: str,
+        actions: List[Dict[str, Any]],
+        snapshot: Optional[str] = "diff",
+        stop_on_error: bool = True,
+    ) -> Any:
+        """
+        Run several actions on one page in a single call, e.g. filling and submitting a form.
+
+        Args:
+            page_id: Target page id returned by open().
+            actions: Steps to run in order, each like {"action": "fill", "target": "@e3", "value": "text"}.
+                Supported actions: "click", "fill", "select", "press", "check", "uncheck", "upload".
+            snapshot: "diff" to return changes since the last snapshot, "full" for a new snapshot, or None.
+            stop_on_error: If True, stop at the first failing step.
+
+        Returns:
+            A dict with per-step results and the final snapshot text.
+        """
+        try:
+            return await self._browser.batch(
+                page_id,
+                actions,
+                snapshot=snapshot,
+                stop_on_error=stop_on_error,
+            )
+        except Exception as exc:
+            logger.error(f"batch error: {exc}", exc_info=True)
+            return str(exc)
+
     async def find(
         self,
         page_id: str,
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+
+CACHEABLE_RESOURCE_TYPES = {"stylesheet", "script", "image", "font", "media"}
+
+# Bodies handed to route.fulfill() are already decoded and re-framed by the browser.
+_DROPPED_HEADERS = {
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+    "keep-alive",
+    "set-cookie",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+CREATE TABLE IF NOT EXISTS vary (
+    url TEXT PRIMARY KEY,
+    names TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+# Share of a response's age since Last-Modified used as its heuristic lifetime (RFC 9111 4.2.2).
+HEURISTIC_FRESHNESS_FRACTION = 0.1
+
+
+def _http_timestamp(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is None:
+        # HTTP dates are always GMT; "-0000" parses to a naive datetime.
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _freshness_lifetime(headers: Dict[str, str], max_heuristic_ttl: float) -> Optional[float]:
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "private" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return None
+    match = re.search(r"(?:s-maxage|max-age)\s*=\s*(\d+)", cache_control)
+    if match:
+        return float(match.group(1))
+    if "expires" in headers:
+        expires = _http_timestamp(headers["expires"])
+        return 0.0 if expires is None else max(0.0, expires - time.time())
+    # Without explicit freshness only responses with a validator get a heuristic lifetime;
+    # dynamic responses without Last-Modified are not stored.
+    last_modified = _http_timestamp(headers.get("last-modified"))
+    if last_modified is None:
+        return None
+    now = _http_timestamp(headers.get("date")) or time.time()
+    age = max(0.0, now - last_modified)
+    return min(max_heuristic_ttl, age * HEURISTIC_FRESHNESS_FRACTION)
+
+
+def _shared_cacheable(request_headers: Dict[str, str], headers: Dict[str, str]) -> bool:
+    # The cache is shared across contexts, which never share cookies.
+    vary = {name.strip().lower() for name in headers.get("vary", "").split(",")}
+    if "cookie" in vary:
+        return False
+    cache_control = headers.get("cache-control", "").lower()
+    # Responses to authenticated requests may only be shared when marked for it.
+    if "authorization" in request_headers and not ("public" in cache_control or "s-maxage" in cache_control):
+        return False
+    if request_headers.get("cookie") and "public" not in cache_control:
+        return False
+    return True
+
+
+class ResponseCache:
+    """
+    On-disk HTTP response cache shared between AgentBrowser instances and processes.
+
+    Bodies are stored once per content hash under `root/blobs`, and a SQLite index maps
+    (URL + the request headers named by the response's Vary) to a body. The index is
+    evicted least-recently-used first when the stored size exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_bytes: int = 512 * 1024 * 1024,
+        default_ttl: float = 3600.0,
+        max_entry_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        """
+        Create or open a response cache.
+
+        Args:
+            root: Cache directory (defaults to a shared folder under the system temp dir).
+            max_bytes: Total body size kept before least recently used entries are evicted.
+            default_ttl: Upper bound in seconds for the heuristic lifetime of responses that
+                only carry Last-Modified (10% of their age); responses with no freshness
+                information at all are not stored.
+            max_entry_bytes: Larger responses are not stored.
+
+        Returns:
+            None
+        """
+        self.root = Path(root or os.path.join(tempfile.gettempdir(), "agent-browser-cache")).expanduser()
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_entry_bytes = max_entry_bytes
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, url: str, names: list[str], request_headers: Dict[str, str]) -> str:
+        parts = [url]
+        for name in names:
+            parts.append(f"{name}={request_headers.get(name, '')}")
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest
+
+    def get(self, url: str, request_headers: Dict[str, str]) -> Optional[CachedResponse]:
+        """
+        Look up a fresh response for a GET request.
+
+        Args:
+            url: Request URL.
+            request_headers: All request headers, including Cookie (lowercase names).
+
+        Returns:
+            The cached response, or None on a miss or when the entry has expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT names FROM vary WHERE url = ?", (url,)).fetchone()
+            names = json.loads(row[0]) if row else []
+            key = self._key(url, names, request_headers)
+            row = self._db.execute(
+                "SELECT digest, status, headers, expires FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[3] < now:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        digest, status, headers, _ = row
+        try:
+            body = self._blob_path(digest).read_bytes()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedResponse(status=status, headers=json.loads(headers), body=body)
+
+    def put(
+        self,
+        url: str,
+        request_headers: Dict[str, str],
+        status: int,
+        headers: Dict[str, str],
+        body: bytes,
+    ) -> bool:
+        """
+        Store a response if it is cacheable.
+
+        The cache is shared across contexts, so responses that vary on Cookie are never stored,
+        responses to requests with Authorization only when marked public or s-maxage, and
+        responses to requests that carried cookies only when marked public.
+
+        Args:
+            url: Request URL.
+            request_headers: All request headers, including Cookie (lowercase names).
+            status: Response status code.
+            headers: Response headers (lowercase names).
+            body: Decoded response body.
+
+        Returns:
+            True if the response was stored.
+        """
+        if status != 200 or len(body) > self.max_entry_bytes:
+            return False
+        if not _shared_cacheable(request_headers, headers):
+            return False
+        vary = headers.get("vary", "")
+        if vary.strip() == "*":
+            return False
+        lifetime = _freshness_lifetime(headers, self.default_ttl)
+        if not lifetime:
+            return False
+        names = sorted({name.strip().lower() for name in vary.split(",") if name.strip()})
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+            temp_path.write_bytes(body)
+            os.replace(temp_path, path)
+        stored_headers = {name: value for name, value in headers.items() if name not in _DROPPED_HEADERS}
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO vary (url, names) VALUES (?, ?)", (url, json.dumps(names))
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._key(url, names, request_headers),
+                    url,
+                    digest,
+                    status,
+                    json.dumps(stored_headers),
+                    len(body),
+                    now + lifetime,
+                    now,
+                ),
+            )
+            self._db.commit()
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        removed: set[str] = set()
+        rows = self._db.execute("SELECT key, digest, size FROM entries ORDER BY last_access").fetchall()
+        for key, digest, size in rows:
+            if total <= target:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            removed.add(digest)
+            total -= size
+        self._db.commit()
+        for digest in removed:
+            still_used = self._db.execute(
+                "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+            if still_used is None:
+                try:
+                    self._blob_path(digest).unlink()
+                except OSError:
+                    pass
+
+    def clear(self) -> None:
+        """
+        Remove every cached response.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM vary")
+            self._db.commit()
+            for path in (self.root / "blobs").glob("*/*"):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -3,20 +3,35 @@ from __future__ import annotations
 import asyncio
 import json
 import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional, Set
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
 
 import websockets
 from patchright.async_api import ConsoleMessage, Page
 
 
+EAGER_ARG_TYPES = {"error", "warning"}
+
+
 @dataclass
 class ConsoleEntry:
     timestamp: float
     type: str
     text: str
     location: Dict[str, Any]
-    args: List[Any]
+    args: Optional[List[Any]]
+    seq: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "timestamp": self.timestamp,
+            "type": self.type,
+            "text": self.text,
+            "location": self.location,
+            "args": self.args,
+        }
 
 
 class ConsoleRecorder:
@@ -24,20 +39,75 @@ class ConsoleRecorder:
     记录页面 console 事件，并提供查询与订阅能力。
     """
 
-    def __init__(self, max_entries: int = 1000) -> None:
-        self._max_entries = max_entries
-        self._entries: List[ConsoleEntry] = []
+    def __init__(self, max_entries: int = 1000, args_mode: str = "eager", arg_budget: int = 200) -> None:
+        """
+        Args:
+            max_entries: 环形缓冲区容量。
+            args_mode: "eager" 立即序列化所有参数；"lazy" 只记录 text/type/location，参数在
+                materialize() 时再取；"errors" 只立即序列化 error/warning 的参数，其余按 lazy 处理。
+            arg_budget: lazy 模式下最多保留多少条消息的参数句柄，超出后最旧的只保留 text。
+        """
+        if args_mode not in ("eager", "lazy", "errors"):
+            raise ValueError(f"未知的 args_mode: {args_mode}")
+        self._args_mode = args_mode
+        self._arg_budget = max(0, arg_budget)
+        # seq -> 尚未序列化的参数句柄，按写入顺序排列。
+        self._pending_args: Dict[int, list] = OrderedDict()
+        self._dispose_queue: list = []
+        self._max_entries = max(1, max_entries)
+        # 固定容量的环形缓冲区：_start 指向最旧的一条，_size 为当前条数。
+        self._ring: List[Optional[ConsoleEntry]] = [None] * self._max_entries
+        self._start = 0
+        self._size = 0
+        self._next_seq = 1
+        self._counts: Dict[str, int] = {}
         self._subscribers: Set[Callable[[ConsoleEntry], None]] = set()
 
     def attach(self, page: Page) -> None:
         page.on("console", self._handle_console)
 
     def _handle_console(self, message: ConsoleMessage) -> None:
-        asyncio.create_task(self._record_entry(message))
+        if self._args_mode == "eager" or (self._args_mode == "errors" and message.type in EAGER_ARG_TYPES):
+            asyncio.create_task(self._record_entry(message))
+            return
+        handles = list(message.args)
+        entry = ConsoleEntry(
+            timestamp=time.time(),
+            type=message.type,
+            text=message.text,
+            location=message.location,
+            args=[] if not handles else None,
+        )
+        self._append(entry)
+        if not handles:
+            return
+        if self._arg_budget == 0:
+            self._dispose_later(handles)
+            return
+        self._pending_args[entry.seq] = handles
+        while len(self._pending_args) > self._arg_budget:
+            _, evicted = self._pending_args.popitem(last=False)
+            self._dispose_later(evicted)
 
-    async def _record_entry(self, message: ConsoleMessage) -> None:
+    def _dispose_later(self, handles: list) -> None:
+        # 批量释放被淘汰的句柄，避免每条消息都创建任务。
+        self._dispose_queue.extend(handles)
+        if len(self._dispose_queue) < 64:
+            return
+        queued, self._dispose_queue = self._dispose_queue, []
+
+        async def _dispose() -> None:
+            for handle in queued:
+                try:
+                    await handle.dispose()
+                except Exception:
+                    pass
+
+        asyncio.create_task(_dispose())
+
+    async def _serialize_args(self, handles: list) -> List[Any]:
         args = []
-        for arg in message.args:
+        for arg in handles:
             try:
                 args.append(await arg.json_value())
             except Exception:
@@ -49,6 +119,32 @@ class ConsoleRecorder:
                         args.append(str(arg))
                 except Exception:
                     args.append(None)
+        return args
+
+    async def materialize(self, entries: List[ConsoleEntry], budget: Optional[int] = None) -> int:
+        """
+        为 lazy 记录的消息序列化参数。
+
+        Args:
+            entries: 需要参数的记录（通常是 get_entries 的结果）。
+            budget: 本次最多序列化多少条记录，None 表示不限制。
+
+        Returns:
+            实际序列化的记录条数。超出预算或句柄已被淘汰的记录 args 仍为 None。
+        """
+        done = 0
+        for entry in entries:
+            if budget is not None and done >= budget:
+                break
+            handles = self._pending_args.pop(entry.seq, None)
+            if handles is None:
+                continue
+            entry.args = await self._serialize_args(handles)
+            done += 1
+        return done
+
+    async def _record_entry(self, message: ConsoleMessage) -> None:
+        args = await self._serialize_args(message.args)
         entry = ConsoleEntry(
             timestamp=time.time(),
             type=message.type,
@@ -56,17 +152,73 @@ class ConsoleRecorder:
             location=message.location,
             args=args,
         )
-        self._entries.append(entry)
-        if len(self._entries) > self._max_entries:
-            self._entries = self._entries[-self._max_entries :]
+        self._append(entry)
+
+    def _append(self, entry: ConsoleEntry) -> None:
+        entry.seq = self._next_seq
+        self._next_seq += 1
+        if self._size < self._max_entries:
+            self._ring[(self._start + self._size) % self._max_entries] = entry
+            self._size += 1
+        else:
+            self._ring[self._start] = entry
+            self._start = (self._start + 1) % self._max_entries
+        self._counts[entry.type] = self._counts.get(entry.type, 0) + 1
 
         for subscriber in list(self._subscribers):
             subscriber(entry)
 
-    def get_entries(self, since: Optional[float] = None, limit: int = 200) -> List[ConsoleEntry]:
-        if since is None:
-            return self._entries[-limit:]
-        return [entry for entry in self._entries if entry.timestamp >= since][-limit:]
+    def _at(self, index: int) -> ConsoleEntry:
+        return self._ring[(self._start + index) % self._max_entries]
+
+    def _first_index_since(self, since: float) -> int:
+        # 时间戳按写入顺序递增，二分查找第一条 timestamp >= since 的位置。
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._at(middle).timestamp < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @property
+    def last_seq(self) -> int:
+        return self._next_seq - 1
+
+    def counts(self) -> Dict[str, int]:
+        """
+        返回各类型 console 消息的累计条数（包括已被环形缓冲区覆盖的）。
+        """
+        return dict(self._counts)
+
+    def get_entries(
+        self,
+        since: Optional[float] = None,
+        limit: int = 200,
+        since_seq: Optional[int] = None,
+        levels: Optional[Set[str]] = None,
+    ) -> List[ConsoleEntry]:
+        start = 0
+        if since_seq is not None and self._size:
+            # 缓冲区内的序号是连续的，可以直接换算出下标。
+            start = min(self._size, max(0, since_seq + 1 - self._at(0).seq))
+        if since is not None:
+            start = max(start, self._first_index_since(since))
+        if limit <= 0:
+            return []
+        if levels is None:
+            first = max(start, self._size - limit)
+            return [self._at(index) for index in range(first, self._size)]
+        matched: List[ConsoleEntry] = []
+        for index in range(self._size - 1, start - 1, -1):
+            entry = self._at(index)
+            if entry.type in levels:
+                matched.append(entry)
+                if len(matched) >= limit:
+                    break
+        matched.reverse()
+        return matched
 
     def subscribe(self, callback: Callable[[ConsoleEntry], None]) -> None:
         self._subscribers.add(callback)
@@ -75,70 +227,308 @@ class ConsoleRecorder:
         self._subscribers.discard(callback)
 
 
+class ClientSender:
+    """
+    单个 WebSocket 客户端的有界发送队列，由一个写任务批量发送，慢客户端不会拖慢其他客户端。
+    """
+
+    def __init__(
+        self,
+        websocket: Any,
+        max_queue: int = 500,
+        batch_size: int = 50,
+        overflow: str = "drop_oldest",
+        coalesce_repeats: bool = True,
+    ) -> None:
+        if overflow not in ("drop_oldest", "drop_newest"):
+            raise ValueError(f"未知的 overflow 策略: {overflow}")
+        self.websocket = websocket
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._max_queue = max(1, max_queue)
+        self._batch_size = max(1, batch_size)
+        self._overflow = overflow
+        self._coalesce_repeats = coalesce_repeats
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._closed = True
+        self._wakeup.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def offer(self, item: Dict[str, Any]) -> None:
+        if self._closed:
+            return
+        if self._coalesce_repeats and self._queue:
+            last = self._queue[-1]
+            if (
+                last.get("type") == item.get("type")
+                and last.get("text") == item.get("text")
+                and last.get("page_id") == item.get("page_id")
+            ):
+                # 连续重复的消息合并为一条，并记录重复次数。
+                merged = dict(last)
+                merged["repeat"] = last.get("repeat", 1) + 1
+                merged["seq"] = item.get("seq", last.get("seq"))
+                self._queue[-1] = merged
+                return
+        if len(self._queue) >= self._max_queue:
+            self._dropped += 1
+            if self._overflow == "drop_newest":
+                return
+            self._queue.popleft()
+        self._queue.append(item)
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue and not self._closed:
+                batch = [self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))]
+                dropped, self._dropped = self._dropped, 0
+                if len(batch) == 1 and not dropped:
+                    payload = {"type": "console", "data": batch[0]}
+                else:
+                    payload = {"type": "console_batch", "data": batch, "dropped": dropped}
+                try:
+                    await self.websocket.send(json.dumps(payload))
+                except Exception:
+                    self._closed = True
+                    return
+
+
 class ConsoleStreamServer:
     """
     通过 WebSocket 推送 console 事件流，方便外部实时观察。
     """
 
-    def __init__(self, recorder: ConsoleRecorder, host: str = "127.0.0.1", port: int = 9224) -> None:
+    def __init__(
+        self,
+        recorder: ConsoleRecorder,
+        host: str = "127.0.0.1",
+        port: int = 9224,
+        max_queue: int = 500,
+        batch_size: int = 50,
+        overflow: str = "drop_oldest",
+    ) -> None:
         self._recorder = recorder
         self._host = host
         self._port = port
-        self._clients: Set[websockets.WebSocketServerProtocol] = set()
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._overflow = overflow
+        self._clients: Dict[Any, ClientSender] = {}
         self._server: Optional[Any] = None
-        self._lock = asyncio.Lock()
+
+    @property
+    def port(self) -> int:
+        return self._port
 
     async def start(self) -> None:
         self._server = await websockets.serve(self._handle_client, self._host, self._port)
+        # port=0 让系统分配端口，这里记下实际绑定的端口。
+        self._port = self._server.sockets[0].getsockname()[1]
         self._recorder.subscribe(self._broadcast_entry)
 
     async def stop(self) -> None:
         self._recorder.unsubscribe(self._broadcast_entry)
-        async with self._lock:
-            for client in list(self._clients):
-                await client.close()
-            self._clients.clear()
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for sender in clients:
+            await sender.stop()
+            try:
+                await sender.websocket.close()
+            except Exception:
+                pass
 
         if self._server:
             self._server.close()
             await self._server.wait_closed()
             self._server = None
 
-    async def _handle_client(self, websocket: websockets.WebSocketServerProtocol) -> None:
-        async with self._lock:
-            self._clients.add(websocket)
-
+    async def _handle_client(self, websocket: Any) -> None:
+        sender = ClientSender(
+            websocket,
+            max_queue=self._max_queue,
+            batch_size=self._batch_size,
+            overflow=self._overflow,
+        )
         try:
             await websocket.send(json.dumps({"type": "status", "connected": True}))
+            self._clients[websocket] = sender
+            sender.start()
             async for _ in websocket:
                 pass
         finally:
-            async with self._lock:
-                self._clients.discard(websocket)
+            self._clients.pop(websocket, None)
+            await sender.stop()
 
     def _broadcast_entry(self, entry: ConsoleEntry) -> None:
-        payload = json.dumps(
-            {
-                "type": "console",
-                "data": {
-                    "timestamp": entry.timestamp,
-                    "type": entry.type,
-                    "text": entry.text,
-                    "location": entry.location,
-                    "args": entry.args,
-                },
-            }
+        if not self._clients:
+            return
+        item = entry.to_dict()
+        for sender in list(self._clients.values()):
+            sender.offer(item)
+
+
+class ConsoleHubServer:
+    """
+    在一个端口上为所有页面复用 console 事件流，客户端通过订阅消息选择页面与级别。
+
+    客户端消息（JSON）:
+        {"action": "subscribe", "page_id": "p1" | "*", "levels": ["error"], "since_seq": 10}
+        {"action": "unsubscribe", "page_id": "p1" | "*"}
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 9224,
+        max_queue: int = 500,
+        batch_size: int = 50,
+        overflow: str = "drop_oldest",
+    ) -> None:
+        self._host = host
+        self._port = port
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._overflow = overflow
+        self._recorders: Dict[str, ConsoleRecorder] = {}
+        self._callbacks: Dict[str, Callable[[ConsoleEntry], None]] = {}
+        # 每个客户端的订阅：page_id（或 "*"）-> levels（None 表示全部级别）。
+        self._clients: Dict[Any, ClientSender] = {}
+        self._subscriptions: Dict[Any, Dict[str, Optional[Set[str]]]] = {}
+        self._server: Optional[Any] = None
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    async def start(self) -> None:
+        self._server = await websockets.serve(self._handle_client, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for page_id in list(self._recorders):
+            self.remove_page(page_id)
+        clients = list(self._clients.values())
+        self._clients.clear()
+        self._subscriptions.clear()
+        for sender in clients:
+            await sender.stop()
+            try:
+                await sender.websocket.close()
+            except Exception:
+                pass
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def add_page(self, page_id: str, recorder: ConsoleRecorder) -> None:
+        if page_id in self._recorders:
+            return
+
+        def callback(entry: ConsoleEntry) -> None:
+            self._broadcast_entry(page_id, entry)
+
+        self._recorders[page_id] = recorder
+        self._callbacks[page_id] = callback
+        recorder.subscribe(callback)
+
+    def remove_page(self, page_id: str) -> None:
+        recorder = self._recorders.pop(page_id, None)
+        callback = self._callbacks.pop(page_id, None)
+        if recorder and callback:
+            recorder.unsubscribe(callback)
+
+    async def _handle_client(self, websocket: Any) -> None:
+        sender = ClientSender(
+            websocket,
+            max_queue=self._max_queue,
+            batch_size=self._batch_size,
+            overflow=self._overflow,
         )
+        try:
+            await websocket.send(
+                json.dumps({"type": "status", "connected": True, "pages": sorted(self._recorders)})
+            )
+            self._clients[websocket] = sender
+            self._subscriptions[websocket] = {}
+            sender.start()
+            async for message in websocket:
+                self._handle_message(websocket, sender, message)
+        finally:
+            self._clients.pop(websocket, None)
+            self._subscriptions.pop(websocket, None)
+            await sender.stop()
 
-        async def _send() -> None:
-            async with self._lock:
-                clients = list(self._clients)
-            for client in clients:
-                if client.closed:
-                    continue
-                try:
-                    await client.send(payload)
-                except Exception:
-                    pass
+    def _handle_message(self, websocket: Any, sender: ClientSender, message: Any) -> None:
+        try:
+            request = json.loads(message)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(request, dict):
+            return
+        action = request.get("action")
+        page_id = str(request.get("page_id") or "*")
+        subscriptions = self._subscriptions.get(websocket)
+        if subscriptions is None:
+            return
+        if action == "unsubscribe":
+            if page_id == "*":
+                subscriptions.clear()
+            else:
+                subscriptions.pop(page_id, None)
+            return
+        if action != "subscribe":
+            return
+        levels = request.get("levels")
+        subscriptions[page_id] = set(levels) if levels else None
+        since_seq = request.get("since_seq")
+        if since_seq is None:
+            return
+        # 订阅时补发缓冲区中 since_seq 之后的记录。
+        page_ids = list(self._recorders) if page_id == "*" else [page_id]
+        for pid in page_ids:
+            recorder = self._recorders.get(pid)
+            if recorder is None:
+                continue
+            entries = recorder.get_entries(
+                since_seq=int(since_seq),
+                limit=self._max_queue,
+                levels=subscriptions[page_id],
+            )
+            for entry in entries:
+                sender.offer(self._to_item(pid, entry))
+
+    def _to_item(self, page_id: str, entry: ConsoleEntry) -> Dict[str, Any]:
+        item = entry.to_dict()
+        item["page_id"] = page_id
+        return item
 
-        asyncio.create_task(_send())
+    def _broadcast_entry(self, page_id: str, entry: ConsoleEntry) -> None:
+        item: Optional[Dict[str, Any]] = None
+        for websocket, subscriptions in list(self._subscriptions.items()):
+            if page_id in subscriptions:
+                levels = subscriptions[page_id]
+            elif "*" in subscriptions:
+                levels = subscriptions["*"]
+            else:
+                continue
+            if levels is not None and entry.type not in levels:
+                continue
+            sender = self._clients.get(websocket)
+            if sender is None:
+                continue
+            if item is None:
+                item = self._to_item(page_id, entry)
+            sender.offer(item)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Optional
+
+from patchright.async_api import Page
+
+
+@dataclass
+class PageEvent:
+    seq: int
+    kind: str
+    timestamp: float
+    payload: Any = None
+
+
+class PageEventJournal:
+    """
+    按顺序记录页面事件（popup、download、主框架导航请求与导航），动作只需记下序号即可读取之后发生的事件。
+    """
+
+    def __init__(self, max_events: int = 256) -> None:
+        self._events: Deque[PageEvent] = deque(maxlen=max_events)
+        self._seq = 0
+        self._waiter: Optional[asyncio.Event] = None
+        self._attached = False
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def attach(self, page: Page) -> None:
+        if self._attached:
+            return
+        self._attached = True
+        page.on("popup", lambda popup: self.record("popup", popup))
+        page.on("download", lambda download: self.record("download", download))
+        page.on(
+            "framenavigated",
+            lambda frame: self.record("navigation", frame.url) if frame == page.main_frame else None,
+        )
+        page.on("request", lambda request: self._on_request(page, request))
+
+    def _on_request(self, page: Page, request: Any) -> None:
+        # 附件下载的导航请求不会提交，之后只有 download 事件而没有 navigation 事件。
+        if request.is_navigation_request() and request.frame == page.main_frame:
+            self.record("navigation_request", request.url)
+
+    def record(self, kind: str, payload: Any = None) -> None:
+        self._seq += 1
+        self._events.append(PageEvent(seq=self._seq, kind=kind, timestamp=time.time(), payload=payload))
+        if self._waiter is not None:
+            self._waiter.set()
+            self._waiter = None
+
+    def since(self, seq: int, kinds: Optional[set[str]] = None) -> list[PageEvent]:
+        return [
+            event
+            for event in self._events
+            if event.seq > seq and (kinds is None or event.kind in kinds)
+        ]
+
+    def pending_navigation(self, seq: int) -> Optional[int]:
+        """
+        Return the seq of the last main-frame navigation request after seq that has not committed yet.
+        """
+        pending = None
+        for event in self.since(seq, {"navigation_request", "navigation"}):
+            pending = event.seq if event.kind == "navigation_request" else None
+        return pending
+
+    async def wait_for(self, seq: int, kinds: set[str], timeout: float) -> list[PageEvent]:
+        """
+        Return events of the given kinds after seq, waiting up to timeout seconds for the first one.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            events = self.since(seq, kinds)
+            remaining = deadline - loop.time()
+            if events or remaining <= 0:
+                return events
+            if self._waiter is None:
+                self._waiter = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._waiter.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return self.since(seq, kinds)
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from patchright.async_api import Browser, BrowserContext, async_playwright
+
+from .agent import LAUNCH_ARGS, AgentBrowser, resolve_default_user_agent
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PooledBrowser:
+    browser: Browser
+    index: int
+    contexts: set = field(default_factory=set)
+    pages_opened: int = 0
+    retired: bool = False
+
+
+class BrowserPool:
+    """
+    Share a few browser processes between many AgentBrowser instances.
+
+    Every acquire() returns an AgentBrowser bound to a fresh, isolated context (its own
+    cookies and storage) on the least loaded healthy browser. Browsers that disconnect are
+    replaced, and browsers that opened `recycle_after_pages` pages stop taking new contexts
+    and are relaunched once their last context closes.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_contexts_per_browser: int = 8,
+        recycle_after_pages: Optional[int] = 500,
+        headless: bool = True,
+        viewport: tuple[int, int] = (1282, 1783),
+        user_agent: Optional[str] = None,
+        locale: Optional[str] = None,
+        timezone: Optional[str] = None,
+        use_system_chrome: bool = False,
+        executable_path: Optional[str] = None,
+    ) -> None:
+        """
+        Create a BrowserPool.
+
+        Args:
+            size: Number of browser processes to launch.
+            max_contexts_per_browser: Maximum number of live contexts per browser process.
+            recycle_after_pages: Relaunch a browser after its agents have opened this many pages
+                through open() or popups; warm pages are not counted (None disables recycling).
+            headless: Whether to run the browsers in headless mode.
+            viewport: Default viewport size as (width, height) for new contexts.
+            user_agent: Custom user agent; defaults to the browser's own without "Headless".
+            locale: Browser context locale.
+            timezone: Browser context timezone id.
+            use_system_chrome: Whether to launch system Chrome instead of bundled Chromium.
+            executable_path: Custom Chrome/Chromium executable path.
+
+        Returns:
+            None
+        """
+        if size < 1:
+            raise ValueError("size 必须大于 0")
+        if max_contexts_per_browser < 1:
+            raise ValueError("max_contexts_per_browser 必须大于 0")
+        self._size = size
+        self._max_contexts_per_browser = max_contexts_per_browser
+        self._recycle_after_pages = recycle_after_pages
+        self._headless = headless
+        self._viewport = viewport
+        self._user_agent = user_agent
+        self._locale = locale
+        self._timezone = timezone
+        self._use_system_chrome = use_system_chrome
+        self._executable_path = executable_path
+        self._playwright = None
+        self._browsers: list[PooledBrowser] = []
+        self._launch_counter = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._released: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        """
+        Start Playwright and launch the browser processes (idempotent).
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._ensure_primitives()
+        async with self._lock:
+            if self._playwright:
+                return
+            self._playwright = await async_playwright().start()
+            for _ in range(self._size):
+                self._browsers.append(await self._launch())
+            if not self._user_agent:
+                self._user_agent = await resolve_default_user_agent(self._browsers[0].browser)
+
+    async def acquire(
+        self,
+        storage_state: Optional[Any] = None,
+        timeout: Optional[float] = None,
+        **browser_kwargs: Any,
+    ) -> AgentBrowser:
+        """
+        Get an AgentBrowser bound to a new isolated context.
+
+        Waits for a free slot when every browser is at max_contexts_per_browser.
+        Call close() on the returned AgentBrowser to give the slot back.
+
+        Args:
+            storage_state: Optional Playwright storage state (path or dict) for the context.
+            timeout: Maximum seconds to wait for a free slot (None waits forever).
+            browser_kwargs: Extra AgentBrowser options (e.g. timeout_ms, stealth_js, ref_node_ids).
+
+        Returns:
+            An AgentBrowser that is ready for open().
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            async with self._lock:
+                await self._check_health()
+                slot = self._pick_browser()
+                if slot is not None:
+                    context = await self._new_context(slot, storage_state)
+                    break
+                self._released.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError("BrowserPool 没有空闲的 context")
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                raise TimeoutError("BrowserPool 没有空闲的 context") from None
+        kwargs: Dict[str, Any] = {
+            "headless": self._headless,
+            "viewport": self._viewport,
+            "user_agent": self._user_agent,
+            "locale": self._locale,
+            "timezone": self._timezone,
+            "is_work": False,
+        }
+        kwargs.update(browser_kwargs)
+        agent = AgentBrowser(context=context, **kwargs)
+        # Counted per page handed out, so warm pages the agent pre-opens do not hasten recycling.
+        agent._on_page_registered = lambda _page: self._count_page(slot)
+        return agent
+
+    async def health_check(self) -> int:
+        """
+        Replace disconnected browsers and relaunch idle retired ones.
+
+        Args:
+            None
+
+        Returns:
+            The number of browsers that were relaunched.
+        """
+        self._ensure_primitives()
+        async with self._lock:
+            return await self._check_health()
+
+    def stats(self) -> list[dict]:
+        """
+        Describe the load of each browser process.
+
+        Args:
+            None
+
+        Returns:
+            One dict per browser with its index, live contexts, pages opened and state.
+        """
+        return [
+            {
+                "index": slot.index,
+                "contexts": len(slot.contexts),
+                "pages_opened": slot.pages_opened,
+                "retired": slot.retired,
+                "connected": slot.browser.is_connected(),
+            }
+            for slot in self._browsers
+        ]
+
+    async def close(self) -> None:
+        """
+        Close every context and browser, then stop Playwright.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._ensure_primitives()
+        async with self._lock:
+            for slot in self._browsers:
+                await self._close_browser(slot)
+            self._browsers = []
+            if self._playwright:
+                await self._playwright.stop()
+                self._playwright = None
+        self._released.set()
+
+    def _ensure_primitives(self) -> None:
+        # Created lazily so they bind to the running event loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._released = asyncio.Event()
+
+    async def _launch(self) -> PooledBrowser:
+        launch_kwargs: Dict[str, Any] = {
+            "headless": self._headless,
+            "args": list(LAUNCH_ARGS),
+        }
+        if self._headless:
+            launch_kwargs["args"].append("--ignore-gpu-blocklist")
+        if self._executable_path:
+            launch_kwargs["executable_path"] = self._executable_path
+        elif self._use_system_chrome:
+            launch_kwargs["channel"] = "chrome"
+        browser = await self._playwright.chromium.launch(**launch_kwargs)
+        self._launch_counter += 1
+        slot = PooledBrowser(browser=browser, index=self._launch_counter)
+        browser.on("disconnected", lambda _: self._released.set())
+        return slot
+
+    def _pick_browser(self) -> Optional[PooledBrowser]:
+        candidates = [
+            slot
+            for slot in self._browsers
+            if not slot.retired
+            and slot.browser.is_connected()
+            and len(slot.contexts) < self._max_contexts_per_browser
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda slot: (len(slot.contexts), slot.pages_opened))
+
+    async def _new_context(self, slot: PooledBrowser, storage_state: Optional[Any]) -> BrowserContext:
+        context_kwargs: Dict[str, Any] = {
+            "viewport": {"width": self._viewport[0], "height": self._viewport[1]},
+            "locale": self._locale,
+            "timezone_id": self._timezone,
+        }
+        if self._user_agent:
+            context_kwargs["user_agent"] = self._user_agent
+        if storage_state is not None:
+            context_kwargs["storage_state"] = storage_state
+        context = await slot.browser.new_context(**context_kwargs)
+        slot.contexts.add(context)
+
+        def on_close(_context) -> None:
+            slot.contexts.discard(context)
+            self._released.set()
+
+        context.on("close", on_close)
+        return context
+
+    def _count_page(self, slot: PooledBrowser) -> None:
+        slot.pages_opened += 1
+        if self._recycle_after_pages and slot.pages_opened >= self._recycle_after_pages:
+            slot.retired = True
+
+    async def _check_health(self) -> int:
+        relaunched = 0
+        for position, slot in enumerate(self._browsers):
+            connected = slot.browser.is_connected()
+            if connected and not (slot.retired and not slot.contexts):
+                continue
+            if not connected:
+                logger.warning("Pooled browser %s disconnected, relaunching", slot.index)
+            await self._close_browser(slot)
+            self._browsers[position] = await self._launch()
+            relaunched += 1
+        if relaunched:
+            self._released.set()
+        return relaunched
+
+    async def _close_browser(self, slot: PooledBrowser) -> None:
+        for context in list(slot.contexts):
+            try:
+                await context.close()
+            except Exception:
+                pass
+        slot.contexts.clear()
+        try:
+            await slot.browser.close()
+        except Exception:
+            pass
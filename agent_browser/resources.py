@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import fnmatch
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional, Union
+from urllib.parse import urlsplit
+
+
+TRACKER_PATTERNS = (
+    "*://*.doubleclick.net/*",
+    "*://*.googlesyndication.com/*",
+    "*://*.google-analytics.com/*",
+    "*://*.googletagmanager.com/*",
+    "*://*.googleadservices.com/*",
+    "*://*.adservice.google.com/*",
+    "*://*.facebook.net/*",
+    "*://*.hotjar.com/*",
+    "*://*.segment.io/*",
+    "*://*.mixpanel.com/*",
+    "*://*.amazon-adsystem.com/*",
+    "*://*.scorecardresearch.com/*",
+    "*://*.criteo.com/*",
+    "*://*.taboola.com/*",
+    "*://*.outbrain.com/*",
+)
+
+# Stylesheets are kept in every preset: without them hidden menus and dialogs show up
+# in the accessibility tree and visibility checks become wrong.
+RESOURCE_PRESETS: dict[str, dict[str, Any]] = {
+    "no_media": {"block_types": ("image", "media")},
+    "text_only": {
+        "block_types": ("image", "media", "font", "texttrack", "manifest"),
+        "block_patterns": TRACKER_PATTERNS,
+    },
+    "no_third_party": {"block_third_party": True},
+    "no_trackers": {"block_patterns": TRACKER_PATTERNS},
+}
+
+_SECOND_LEVEL_LABELS = {"co", "com", "net", "org", "gov", "edu", "ac", "ne", "or", "go"}
+
+
+@dataclass(frozen=True)
+class ResourcePolicy:
+    """
+    Which requests to abort.
+
+    Patterns are shell-style globs matched against the full URL ("*://*.example.com/*").
+    Allow patterns win over every blocking rule; navigation requests are never blocked.
+    """
+
+    block_types: frozenset[str] = frozenset()
+    block_patterns: tuple[str, ...] = ()
+    allow_patterns: tuple[str, ...] = ()
+    block_third_party: bool = False
+
+    def merge(self, other: ResourcePolicy) -> ResourcePolicy:
+        return ResourcePolicy(
+            block_types=self.block_types | other.block_types,
+            block_patterns=self.block_patterns + other.block_patterns,
+            allow_patterns=self.allow_patterns + other.allow_patterns,
+            block_third_party=self.block_third_party or other.block_third_party,
+        )
+
+
+ResourcePolicySpec = Union[str, dict, ResourcePolicy, Iterable[Union[str, dict, ResourcePolicy]], None]
+
+
+def _compile_globs(patterns: Iterable[str]) -> Optional[re.Pattern]:
+    parts = [fnmatch.translate(pattern) for pattern in patterns if pattern]
+    if not parts:
+        return None
+    return re.compile("|".join(f"(?:{part})" for part in parts))
+
+
+def site_of(host: str) -> str:
+    """
+    Approximate the registrable domain of a host ("a.b.example.co.uk" -> "example.co.uk").
+    """
+    labels = host.lower().rstrip(".").split(".")
+    if len(labels) <= 2:
+        return ".".join(labels)
+    if len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL_LABELS:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+class ResourceMatcher:
+    """
+    Precompiled form of a ResourcePolicy: one regex for all block globs and one for allows.
+    """
+
+    def __init__(self, policy: ResourcePolicy) -> None:
+        self.policy = policy
+        self._block_types = policy.block_types
+        self._block_re = _compile_globs(policy.block_patterns)
+        self._allow_re = _compile_globs(policy.allow_patterns)
+        self._block_third_party = policy.block_third_party
+
+    def should_block(
+        self,
+        url: str,
+        resource_type: str,
+        is_navigation: bool = False,
+        page_url: Optional[str] = None,
+    ) -> bool:
+        if is_navigation or url.startswith(("data:", "blob:", "about:")):
+            return False
+        if self._allow_re is not None and self._allow_re.match(url):
+            return False
+        if resource_type in self._block_types:
+            return True
+        if self._block_re is not None and self._block_re.match(url):
+            return True
+        if self._block_third_party and page_url:
+            host = urlsplit(url).hostname or ""
+            page_host = urlsplit(page_url).hostname or ""
+            if host and page_host and site_of(host) != site_of(page_host):
+                return True
+        return False
+
+
+def resolve_resource_policy(spec: ResourcePolicySpec) -> Optional[ResourcePolicy]:
+    """
+    Turn a policy spec into a ResourcePolicy.
+
+    Args:
+        spec: None/"none", a preset name ("text_only", "no_media", "no_third_party",
+            "no_trackers"), a dict with ResourcePolicy fields, a ResourcePolicy, or a list of
+            these (merged).
+
+    Returns:
+        The ResourcePolicy, or None when nothing is blocked.
+    """
+    if spec is None or spec == "none":
+        return None
+    if isinstance(spec, ResourcePolicy):
+        return spec
+    if isinstance(spec, str):
+        if spec not in RESOURCE_PRESETS:
+            raise ValueError(f"未知的 resource_policy: {spec}")
+        return resolve_resource_policy(RESOURCE_PRESETS[spec])
+    if isinstance(spec, dict):
+        unknown = set(spec) - {"block_types", "block_patterns", "allow_patterns", "block_third_party"}
+        if unknown:
+            raise ValueError(f"未知的 resource_policy 字段: {', '.join(sorted(unknown))}")
+        return ResourcePolicy(
+            block_types=frozenset(spec.get("block_types") or ()),
+            block_patterns=tuple(spec.get("block_patterns") or ()),
+            allow_patterns=tuple(spec.get("allow_patterns") or ()),
+            block_third_party=bool(spec.get("block_third_party", False)),
+        )
+    merged = ResourcePolicy()
+    for item in spec:
+        policy = resolve_resource_policy(item)
+        if policy is not None:
+            merged = merged.merge(policy)
+    return merged
+
+
+def compile_resource_policy(spec: ResourcePolicySpec) -> Optional[ResourceMatcher]:
+    policy = resolve_resource_policy(spec)
+    if policy is None:
+        return None
+    return ResourceMatcher(policy)
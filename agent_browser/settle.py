@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict
+
+from patchright.async_api import Page
+
+from .snapshot import DOM_WATCH_JS, NODE_HANDLE_ATTR
+
+
+# Requests that stay open by design and would otherwise keep the page "busy" forever.
+IGNORED_RESOURCE_TYPES = {"websocket", "eventsource", "media"}
+
+# Milliseconds since the DOM last changed, read from the shared watcher (see DOM_WATCH_JS).
+# Timers are not used: FREEZE_ANIMATIONS_JS swallows short setTimeout calls.
+MUTATION_IDLE_JS = (
+    "(ignoredAttr) => { const state = (" + DOM_WATCH_JS + ")(ignoredAttr); "
+    "return performance.now() - state.last; }"
+)
+
+
+class SettleTracker:
+    """
+    跟踪页面的网络请求与主框架导航，用于判断页面是否已稳定。
+    """
+
+    def __init__(self, long_request_ms: int = 3000) -> None:
+        self._inflight: Dict[Any, float] = {}
+        self._long_request_ms = long_request_ms
+        self._last_activity = time.monotonic()
+        self._navigations = 0
+        self._attached = False
+
+    def attach(self, page: Page) -> None:
+        if self._attached:
+            return
+        self._attached = True
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_request_done)
+        page.on("requestfailed", self._on_request_done)
+        page.on("framenavigated", lambda frame: self._on_navigated(page, frame))
+
+    def _on_request(self, request) -> None:
+        if request.resource_type in IGNORED_RESOURCE_TYPES:
+            return
+        now = time.monotonic()
+        self._inflight[request] = now
+        self._last_activity = now
+
+    def _on_request_done(self, request) -> None:
+        if self._inflight.pop(request, None) is not None:
+            self._last_activity = time.monotonic()
+
+    def _on_navigated(self, page: Page, frame) -> None:
+        if frame == page.main_frame:
+            self._navigations += 1
+        self._last_activity = time.monotonic()
+
+    def pending(self) -> int:
+        """
+        Number of requests that started recently and are still open (long polls excluded).
+        """
+        cutoff = time.monotonic() - self._long_request_ms / 1000
+        return sum(1 for started in self._inflight.values() if started >= cutoff)
+
+    async def wait(
+        self,
+        page: Page,
+        quiet_ms: int = 300,
+        timeout_ms: int = 5000,
+        network: bool = True,
+        mutations: bool = True,
+    ) -> dict:
+        """
+        Wait until there is no network activity and no DOM mutation for `quiet_ms`.
+
+        Args:
+            page: The page being tracked.
+            quiet_ms: Required quiet period in milliseconds.
+            timeout_ms: Maximum time to wait in milliseconds.
+            network: Whether pending requests keep the page busy.
+            mutations: Whether DOM mutations keep the page busy.
+
+        Returns:
+            A dict with settled (bool), elapsed_ms, pending_requests and navigated.
+        """
+        start = time.monotonic()
+        deadline = start + timeout_ms / 1000
+        quiet = quiet_ms / 1000
+        navigations_before = self._navigations
+        settled = False
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if network:
+                if self.pending():
+                    await asyncio.sleep(min(0.05, deadline - now))
+                    continue
+                network_quiet = now - self._last_activity
+                if network_quiet < quiet:
+                    await asyncio.sleep(min(quiet - network_quiet, deadline - now))
+                    continue
+            if mutations:
+                try:
+                    dom_quiet = await page.evaluate(MUTATION_IDLE_JS, NODE_HANDLE_ATTR) / 1000
+                except Exception:
+                    # The document was replaced mid-evaluation; treat it as activity.
+                    self._last_activity = time.monotonic()
+                    await asyncio.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+                    continue
+                if dom_quiet < quiet:
+                    await asyncio.sleep(min(quiet - dom_quiet, max(0.0, deadline - time.monotonic())))
+                    continue
+            settled = True
+            break
+        return {
+            "settled": settled,
+            "elapsed_ms": int((time.monotonic() - start) * 1000),
+            "pending_requests": self.pending(),
+            "navigated": self._navigations != navigations_before,
+        }
+
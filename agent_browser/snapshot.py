@@ -1,10 +1,13 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Dict, Optional
+import asyncio
+import json
+from bisect import bisect_left
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterator, Optional
 import re
 
-from patchright.async_api import Page
+from patchright.async_api import Page, TimeoutError as PlaywrightTimeoutError
 
 
 @dataclass
@@ -13,12 +16,17 @@ class RefTarget:
     role: str
     name: Optional[str]
     nth: Optional[int]
+    scope: str = ""
+    generation: int = 0
+    backend_node_id: Optional[int] = None
+    handle: Optional[str] = None
 
 
 @dataclass
 class EnhancedSnapshot:
     tree: str
     refs: Dict[str, RefTarget]
+    ref_nodes: Dict[str, int] = field(default_factory=dict)
 
 
 @dataclass
@@ -29,7 +37,157 @@ class SnapshotOptions:
     selector: Optional[str] = None
     text_limit: Optional[int] = None
     summary: bool = False
+    in_page: bool = False
+    max_chars: Optional[int] = None
+    max_tokens: Optional[int] = None
 
+    def char_budget(self) -> Optional[int]:
+        budgets = [self.max_chars] if self.max_chars is not None else []
+        if self.max_tokens is not None:
+            budgets.append(self.max_tokens * CHARS_PER_TOKEN)
+        return min(budgets) if budgets else None
+
+
+# Rough size of one token in snapshot text, used to turn max_tokens into a character budget.
+CHARS_PER_TOKEN = 4
+
+
+class RefRegistry:
+    """
+    Persistent ref table for one page.
+
+    Refs are keyed by a fingerprint of (role, name, ancestry path, nth among
+    identical siblings), so the same element keeps its `@eN` across snapshots.
+    Every snapshot of a scope (the page, or a selector) bumps that scope's
+    generation; a ref whose generation lags behind its scope was not found in the
+    latest snapshot and is stale. Refs stale for `max_stale_generations` snapshots
+    are dropped.
+    """
+
+    def __init__(self, max_stale_generations: int = 3) -> None:
+        self._max_stale_generations = max_stale_generations
+        self._targets: Dict[str, RefTarget] = {}
+        self._fingerprints: Dict[tuple[str, str], str] = {}
+        self._ref_keys: Dict[str, tuple[str, str]] = {}
+        self._scope_generations: Dict[str, int] = {}
+        self._next_index = 0
+
+    def __contains__(self, ref_id: object) -> bool:
+        return ref_id in self._targets
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def get(self, ref_id: str) -> Optional[RefTarget]:
+        return self._targets.get(ref_id)
+
+    @property
+    def issued(self) -> int:
+        return self._next_index
+
+    def lookup(self, scope: str, key: str) -> Optional[str]:
+        return self._fingerprints.get((scope, key))
+
+    def items(self):
+        return self._targets.items()
+
+    def generation(self, scope: str = "") -> int:
+        return self._scope_generations.get(scope, 0)
+
+    def is_stale(self, ref_id: str) -> bool:
+        target = self._targets.get(ref_id)
+        if target is None:
+            return True
+        return target.generation < self.generation(target.scope)
+
+    def begin(self, scope: str = "") -> int:
+        generation = self.generation(scope) + 1
+        self._scope_generations[scope] = generation
+        return generation
+
+    def assign(self, key: str, target: RefTarget) -> str:
+        fingerprint = (target.scope, key)
+        ref_id = self._fingerprints.get(fingerprint)
+        if ref_id is None:
+            self._next_index += 1
+            ref_id = f"e{self._next_index}"
+            self._fingerprints[fingerprint] = ref_id
+            self._ref_keys[ref_id] = fingerprint
+        target.generation = self.generation(target.scope)
+        self._targets[ref_id] = target
+        return ref_id
+
+    def finish(self, scope: str, tree: AriaTree) -> None:
+        """
+        Refresh refs of `scope` that the renderer skipped but that are still in
+        `tree`, then drop refs that have been stale for too long.
+        """
+        generation = self.generation(scope)
+        key_index: Optional[Dict[str, int]] = None
+        for ref_id, target in list(self._targets.items()):
+            if target.scope != scope or target.generation >= generation:
+                continue
+            if key_index is None:
+                key_index = {key: node_id for node_id, key in enumerate(tree.keys())}
+            node_id = key_index.get(self._ref_keys[ref_id][1])
+            if node_id is not None:
+                target.nth = _ref_nth(tree, node_id)
+                target.generation = generation
+            elif generation - target.generation >= self._max_stale_generations:
+                del self._targets[ref_id]
+                del self._fingerprints[self._ref_keys.pop(ref_id)]
+
+
+NODE_HANDLE_ATTR = "data-agent-node"
+
+# Installs one MutationObserver per document, shared by get_dom_version and the settle check,
+# and returns its state: `generation` counts DOM changes and user input, `last` is when the latest
+# happened. Writes to `ignoredAttr` (node handles) do not count. Open shadow roots lie outside the
+# document subtree, so they are observed too: the existing ones on install, later ones when their
+# host is added. Scripts run in an isolated world, where wrapping attachShadow would not see the
+# page's own calls; a root attached to a host already in place is only noticed through other changes.
+DOM_WATCH_JS = """(ignoredAttr) => {
+    const key = "__agentDomWatch";
+    let state = window[key];
+    if (!state) {
+        state = { id: Math.random().toString(36).slice(2), generation: 0, last: performance.now() };
+        const options = { subtree: true, childList: true, attributes: true, characterData: true };
+        const roots = new WeakSet();
+        const watchShadowRoots = (node) => {
+            if (!node.querySelectorAll) return;
+            const elements = node.nodeType === 1 ? [node, ...node.querySelectorAll("*")] : node.querySelectorAll("*");
+            for (const el of elements) {
+                const root = el.shadowRoot;
+                if (root && !roots.has(root)) {
+                    roots.add(root);
+                    state.observer.observe(root, options);
+                    watchShadowRoots(root);
+                }
+            }
+        };
+        const relevant = (records) => records.some(
+            (record) => !(record.type === "attributes" && record.attributeName === ignoredAttr)
+        );
+        const touch = () => {
+            state.generation += 1;
+            state.last = performance.now();
+        };
+        state.observer = new MutationObserver((records) => {
+            for (const record of records) record.addedNodes.forEach(watchShadowRoots);
+            if (relevant(records)) touch();
+        });
+        state.observer.observe(document.documentElement || document, options);
+        watchShadowRoots(document);
+        document.addEventListener("input", touch, true);
+        document.addEventListener("change", touch, true);
+        state.relevant = relevant;
+        state.touch = touch;
+        Object.defineProperty(window, key, { value: state, enumerable: false });
+    }
+    // Records queued in the current task have not reached the callback yet.
+    if (state.relevant(state.observer.takeRecords())) state.touch();
+    return state;
+}"""
 
 INTERACTIVE_ROLES = {
     "button",
@@ -86,9 +244,16 @@ STRUCTURAL_ROLES = {
 }
 
 
-def _get_indent_level(line: str) -> int:
-    match = re.match(r"^(\s*)", line)
-    return len(match.group(1)) // 2 if match else 0
+SUMMARY_ROLES = {
+    "heading",
+    "region",
+    "main",
+    "navigation",
+    "article",
+    "complementary",
+    "banner",
+    "contentinfo",
+}
 
 
 def _build_selector(role: str, name: Optional[str]) -> str:
@@ -566,74 +731,309 @@ def search_multiview_index_text(
     return "\n".join([header, *pruned]) if pruned else f"{header}\n(empty)"
 
 
-def _parse_aria_snapshot(aria_tree: str) -> tuple[list[dict], list[int], dict[str, int]]:
-    lines = aria_tree.splitlines()
-    element_pattern = re.compile(r'^(\s*-\s*)(\w+)(?:\s+"([^"]*)")?(.*)$')
-    nodes: list[dict] = []
-    root_ids: list[int] = []
-    stack: list[int] = []
+# Names are double-quoted with JSON escaping (\" and \\), as aria_snapshot() writes them.
+_ELEMENT_PATTERN = re.compile(r'^(\s*-\s*)(\w+)(?:\s+"((?:[^"\\]|\\.)*)")?(.*)$')
 
-    for line in lines:
-        match = element_pattern.match(line)
-        if not match:
-            continue
-        prefix, role, name, suffix = match.groups()
-        if role.startswith("/"):
-            continue
-        depth = _get_indent_level(line)
-        node_id = len(nodes)
-        node = {
-            "id": node_id,
-            "role": role.lower(),
-            "name": name,
-            "suffix": suffix or "",
-            "depth": depth,
-            "children": [],
-            "parent_id": None,
-            "path": "",
-        }
-        while len(stack) > depth:
-            stack.pop()
-        if stack:
-            parent_id = stack[-1]
-            node["parent_id"] = parent_id
-            nodes[parent_id]["children"].append(node_id)
-        else:
-            root_ids.append(node_id)
-        nodes.append(node)
-        stack.append(node_id)
 
-    path_to_id: dict[str, int] = {}
+def _unquote_name(raw: Optional[str]) -> Optional[str]:
+    if not raw or "\\" not in raw:
+        return raw
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+
+def _quote_name(name: str) -> str:
+    return json.dumps(name, ensure_ascii=False)
+
 
-    def assign_paths(node_id: int, path: str) -> None:
-        nodes[node_id]["path"] = path
-        path_to_id[path] = node_id
-        for idx, child_id in enumerate(nodes[node_id]["children"]):
-            child_path = f"{path}/{idx}" if path else str(idx)
-            assign_paths(child_id, child_path)
+class AriaTree:
+    """
+    A parsed ARIA snapshot shared by all snapshot builders.
+
+    The source text is scanned once. Nodes are stored column-wise in pre-order, so a
+    node id is an index into every column and a subtree is a contiguous id range.
+    Lines that are not elements (e.g. `- /url: ...`) stay in `lines` with a node id
+    of -1 in `line_nodes`, which lets the renderer reproduce the original text.
 
-    for idx, root_id in enumerate(root_ids):
-        assign_paths(root_id, str(idx))
+    Lookup indexes map `role`, `(role, name)` and `(role, text)` to ascending node
+    ids, so the nth occurrence of a node is a dictionary lookup plus a bisect.
+    """
 
-    return nodes, root_ids, path_to_id
+    __slots__ = (
+        "source",
+        "lines",
+        "line_nodes",
+        "roles",
+        "names",
+        "suffixes",
+        "prefixes",
+        "depths",
+        "parents",
+        "children",
+        "paths",
+        "root_ids",
+        "path_to_id",
+        "role_index",
+        "name_index",
+        "text_index",
+        "_keys",
+        "_search_index",
+    )
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.lines: list[str] = []
+        self.line_nodes: list[int] = []
+        self.roles: list[str] = []
+        self.names: list[Optional[str]] = []
+        self.suffixes: list[str] = []
+        self.prefixes: list[str] = []
+        self.depths: list[int] = []
+        self.parents: list[Optional[int]] = []
+        self.children: list[list[int]] = []
+        self.paths: list[str] = []
+        self.root_ids: list[int] = []
+        self.path_to_id: Dict[str, int] = {}
+        self.role_index: Dict[str, list[int]] = {}
+        self.name_index: Dict[tuple[str, str], list[int]] = {}
+        self.text_index: Dict[str, list[int]] = {}
+        self._keys: Optional[list[str]] = None
+        self._search_index: Optional[AriaSearchIndex] = None
+        self._parse(source)
+
+    def __len__(self) -> int:
+        return len(self.roles)
+
+    def _parse(self, source: str) -> None:
+        match_element = _ELEMENT_PATTERN.match
+        stack: list[int] = []
+        for line in source.splitlines():
+            match = match_element(line)
+            if not match:
+                self.lines.append(line)
+                self.line_nodes.append(-1)
+                continue
+            prefix, role, name, suffix = match.groups()
+            name = _unquote_name(name)
+            depth = (len(prefix) - len(prefix.lstrip())) // 2
+            node_id = len(self.roles)
+            while len(stack) > depth:
+                stack.pop()
+            if stack:
+                parent_id: Optional[int] = stack[-1]
+                siblings = self.children[parent_id]
+                path = f"{self.paths[parent_id]}/{len(siblings)}"
+                siblings.append(node_id)
+            else:
+                parent_id = None
+                path = str(len(self.root_ids))
+                self.root_ids.append(node_id)
+            role = role.lower()
+            suffix = suffix or ""
+            self.roles.append(role)
+            self.names.append(name)
+            self.suffixes.append(suffix)
+            self.role_index.setdefault(role, []).append(node_id)
+            if name:
+                self.name_index.setdefault((role, name), []).append(node_id)
+            if role == "text":
+                text_value = name or _clean_suffix(suffix)
+                if text_value:
+                    self.text_index.setdefault(text_value, []).append(node_id)
+            self.prefixes.append(prefix)
+            self.depths.append(depth)
+            self.parents.append(parent_id)
+            self.children.append([])
+            self.paths.append(path)
+            self.path_to_id[path] = node_id
+            self.lines.append(line)
+            self.line_nodes.append(node_id)
+            stack.append(node_id)
+
+    def text_value(self, node_id: int) -> str:
+        name = self.names[node_id]
+        if name:
+            return name
+        return _clean_suffix(self.suffixes[node_id])
+
+    def nth_of_role(self, node_id: int) -> int:
+        return bisect_left(self.role_index[self.roles[node_id]], node_id)
+
+    def nth_of_name(self, node_id: int) -> int:
+        return bisect_left(self.name_index[(self.roles[node_id], self.names[node_id])], node_id)
+
+    def nth_of_text(self, node_id: int) -> int:
+        return bisect_left(self.text_index[self.text_value(node_id)], node_id)
+
+    def subtree_end(self, node_id: int) -> int:
+        end = node_id + 1
+        depth = self.depths[node_id]
+        depths = self.depths
+        while end < len(depths) and depths[end] > depth:
+            end += 1
+        return end
+
+    def keys(self) -> list[str]:
+        """
+        Structural key per node: the role/name chain from the root, with an
+        occurrence index to disambiguate identical siblings.
+        """
+        if self._keys is not None:
+            return self._keys
+        keys: list[str] = []
+        sibling_counts: Dict[tuple[Optional[int], str], int] = {}
+        for node_id, role in enumerate(self.roles):
+            parent_id = self.parents[node_id]
+            segment = f"{role}:{self.names[node_id] or ''}"
+            occurrence = sibling_counts.get((parent_id, segment), 0)
+            sibling_counts[(parent_id, segment)] = occurrence + 1
+            base = keys[parent_id] if parent_id is not None else ""
+            keys.append(f"{base}/{segment}#{occurrence}")
+        self._keys = keys
+        return keys
+
+    def search_index(self) -> AriaSearchIndex:
+        """
+        Full-text index of this tree, built on first use and kept with the tree.
+        """
+        if self._search_index is None:
+            self._search_index = AriaSearchIndex(self)
+        return self._search_index
+
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _trigrams(token: str) -> set[str]:
+    return {token[index:index + 3] for index in range(len(token) - 2)}
+
+
+class AriaSearchIndex:
+    """
+    Inverted index over the nodes of an AriaTree.
 
+    Each node's searchable text is its role, name, state suffix and property lines
+    (such as `/url:`). Tokens map to ascending node ids, and the token vocabulary is
+    indexed by trigrams, so substring and misspelled query tokens are resolved against
+    the vocabulary instead of scanning every node.
+    """
 
-def _node_text_value(node: dict) -> str:
-    if node["name"]:
-        return node["name"]
-    return _clean_suffix(node["suffix"])
+    def __init__(self, tree: AriaTree) -> None:
+        self.texts: list[str] = [
+            f"{role} {tree.names[node_id] or ''} {_clean_suffix(tree.suffixes[node_id])}".lower()
+            for node_id, role in enumerate(tree.roles)
+        ]
+        last_node = -1
+        for line, node_id in zip(tree.lines, tree.line_nodes):
+            if node_id >= 0:
+                last_node = node_id
+            elif last_node >= 0:
+                self.texts[last_node] += " " + line.strip().lstrip("- ").lower()
+        self.postings: Dict[str, list[int]] = {}
+        for node_id, text in enumerate(self.texts):
+            for token in set(_TOKEN_PATTERN.findall(text)):
+                self.postings.setdefault(token, []).append(node_id)
+        self.trigrams: Dict[str, set[str]] = {}
+        for token in self.postings:
+            for trigram in _trigrams(token):
+                self.trigrams.setdefault(trigram, set()).add(token)
+
+    def _token_matches(self, query_token: str, fuzzy: bool) -> Dict[str, float]:
+        """
+        Vocabulary tokens matching one query token, with a weight per match kind.
+        """
+        matches: Dict[str, float] = {}
+        if query_token in self.postings:
+            matches[query_token] = 1.0
+        query_trigrams = _trigrams(query_token)
+        if query_trigrams:
+            candidates: Optional[set[str]] = None
+            for trigram in query_trigrams:
+                tokens = self.trigrams.get(trigram, set())
+                candidates = set(tokens) if candidates is None else candidates & tokens
+                if not candidates:
+                    break
+            candidates = candidates or set()
+        else:
+            candidates = set(self.postings)
+        for token in candidates:
+            if token != query_token and query_token in token:
+                matches[token] = 0.9 if token.startswith(query_token) else 0.8
+        if fuzzy and len(query_token) >= 4:
+            shared: Dict[str, int] = {}
+            for trigram in query_trigrams:
+                for token in self.trigrams.get(trigram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, common in shared.items():
+                if token in matches:
+                    continue
+                similarity = 2 * common / (len(query_trigrams) + len(_trigrams(token)))
+                if similarity >= 0.5:
+                    matches[token] = 0.6 * similarity
+        return matches
+
+    def search(self, query: str, tree: AriaTree, limit: int = 50, fuzzy: bool = True) -> list[int]:
+        """
+        Rank nodes for a free-text query.
+
+        Nodes matching more query tokens rank first, then by match quality (exact,
+        prefix, substring, trigram similarity), a bonus when the whole query appears
+        verbatim, and a small bonus for interactive roles; ties keep document order.
+        """
+        needle = query.strip().lower()
+        query_tokens = list(dict.fromkeys(_TOKEN_PATTERN.findall(needle)))
+        if not query_tokens:
+            return [node_id for node_id, text in enumerate(self.texts) if needle and needle in text][:limit]
+        hits: Dict[int, int] = {}
+        scores: Dict[int, float] = {}
+        for query_token in query_tokens:
+            best: Dict[int, float] = {}
+            for token, weight in self._token_matches(query_token, fuzzy).items():
+                for node_id in self.postings[token]:
+                    if weight > best.get(node_id, 0.0):
+                        best[node_id] = weight
+            for node_id, weight in best.items():
+                hits[node_id] = hits.get(node_id, 0) + 1
+                scores[node_id] = scores.get(node_id, 0.0) + weight
+        for node_id in scores:
+            if needle in self.texts[node_id]:
+                scores[node_id] += 1.0
+            if tree.roles[node_id] in INTERACTIVE_ROLES:
+                scores[node_id] += 0.25
+        ranked = sorted(scores, key=lambda node_id: (-hits[node_id], -scores[node_id], node_id))
+        return ranked[:limit]
+
+    def search_regex(self, pattern: re.Pattern, limit: int = 50) -> list[int]:
+        matches: list[int] = []
+        for node_id, text in enumerate(self.texts):
+            if pattern.search(text):
+                matches.append(node_id)
+                if len(matches) >= limit:
+                    break
+        return matches
 
 
-def _format_node_label(node: dict, text_limit: int) -> str:
-    text_value = _node_text_value(node)
+def parse_aria_tree(aria_tree: str | AriaTree) -> AriaTree:
+    """
+    Parse raw ARIA snapshot text, passing already parsed trees through unchanged.
+    """
+    if isinstance(aria_tree, AriaTree):
+        return aria_tree
+    return AriaTree(aria_tree or "")
+
+
+def _format_node_label(tree: AriaTree, node_id: int, text_limit: int) -> str:
+    text_value = tree.text_value(node_id)
     text_hint = _truncate_text(text_value, text_limit)
-    label = node["role"]
+    label = tree.roles[node_id]
     if text_hint:
-        label += f' "{text_hint}"'
+        label += f" {_quote_name(text_hint)}"
     return label
 
 
-def _collect_summary(nodes: list[dict], node_id: int, max_items: int, text_limit: int) -> str:
+def _collect_summary(tree: AriaTree, node_id: int, max_items: int, text_limit: int) -> str:
     priority_roles = {
         "heading",
         "button",
@@ -665,27 +1065,26 @@ def _collect_summary(nodes: list[dict], node_id: int, max_items: int, text_limit
         summary.append(text_hint)
 
     queue = [node_id]
-    while queue and len(summary) < max_items:
-        current_id = queue.pop(0)
-        node = nodes[current_id]
-        text_value = _node_text_value(node)
-        if node["role"] in priority_roles:
-            add_text(text_value)
-        for child_id in node["children"]:
-            queue.append(child_id)
+    head = 0
+    while head < len(queue) and len(summary) < max_items:
+        current_id = queue[head]
+        head += 1
+        if tree.roles[current_id] in priority_roles:
+            add_text(tree.text_value(current_id))
+        queue.extend(tree.children[current_id])
 
     return " | ".join(summary)
 
 
-def _format_preview_item(nodes: list[dict], node: dict, text_limit: int, summary_items: int) -> str:
-    label = _format_node_label(node, text_limit)
-    summary = _collect_summary(nodes, node["id"], summary_items, text_limit)
+def _format_preview_item(tree: AriaTree, node_id: int, text_limit: int, summary_items: int) -> str:
+    label = _format_node_label(tree, node_id, text_limit)
+    summary = _collect_summary(tree, node_id, summary_items, text_limit)
     suffix = f" :: {summary}" if summary else ""
-    return f"{label} [path={node['path']}]".strip() + suffix
+    return f"{label} [path={tree.paths[node_id]}]".strip() + suffix
 
 
 def build_snapshot_index_text(
-    aria_tree: str,
+    aria_tree: str | AriaTree,
     path: Optional[str],
     depth: int,
     max_nodes: int,
@@ -695,7 +1094,7 @@ def build_snapshot_index_text(
     Build a compact index from an ARIA snapshot.
 
     Args:
-        aria_tree: Raw ARIA snapshot text.
+        aria_tree: Raw ARIA snapshot text or a parsed AriaTree.
         path: Optional index path to expand from.
         depth: Depth to expand from the start node.
         max_nodes: Maximum number of nodes to return.
@@ -704,15 +1103,15 @@ def build_snapshot_index_text(
     Returns:
         A human-readable index string.
     """
-    if not aria_tree:
+    tree = parse_aria_tree(aria_tree)
+    if not tree.source:
         return "(empty)"
-    nodes, root_ids, path_to_id = _parse_aria_snapshot(aria_tree)
     if path is not None:
-        if path not in path_to_id:
+        if path not in tree.path_to_id:
             raise KeyError(f"未知的 path: {path}")
-        start_ids = [path_to_id[path]]
+        start_ids = [tree.path_to_id[path]]
     else:
-        start_ids = root_ids
+        start_ids = tree.root_ids
 
     counter = 0
     lines: list[str] = []
@@ -724,20 +1123,18 @@ def build_snapshot_index_text(
         nonlocal counter
         if counter >= max_nodes:
             return
-        node = nodes[node_id]
         counter += 1
-        label = _format_node_label(node, text_limit)
-        child_ids = node["children"]
+        label = _format_node_label(tree, node_id, text_limit)
+        child_ids = tree.children[node_id]
         summary = ""
-        line = f"{indent}- {label} [path={node['path']}]"
+        line = f"{indent}- {label} [path={tree.paths[node_id]}]"
         if summary:
             line += f" :: {summary}"
         expand_children = current_depth < depth and (path_mode or current_depth == 0)
         if child_ids and not expand_children:
             previews = []
             for child_id in child_ids[:grandchild_preview]:
-                child = nodes[child_id]
-                previews.append(_format_preview_item(nodes, child, text_limit, summary_items))
+                previews.append(_format_preview_item(tree, child_id, text_limit, summary_items))
             extra = len(child_ids) - min(grandchild_preview, len(child_ids))
             preview_text = "; ".join(previews)
             if extra > 0:
@@ -755,13 +1152,13 @@ def build_snapshot_index_text(
     lines.append(f"index (path={path or 'root'}, depth={depth}, max_nodes={max_nodes})")
     for node_id in start_ids:
         render_node(node_id, 0, "")
-    if counter >= max_nodes and counter < len(nodes):
-        lines.append(f"... (truncated: returned {counter} of {len(nodes)})")
+    if counter >= max_nodes and counter < len(tree):
+        lines.append(f"... (truncated: returned {counter} of {len(tree)})")
     return "\n".join(lines)
 
 
 def search_snapshot_index_text(
-    aria_tree: str,
+    aria_tree: str | AriaTree,
     query: str,
     mode: str,
     limit: int,
@@ -771,7 +1168,7 @@ def search_snapshot_index_text(
     Search index nodes by fuzzy text or regex.
 
     Args:
-        aria_tree: Raw ARIA snapshot text.
+        aria_tree: Raw ARIA snapshot text or a parsed AriaTree.
         query: Search keyword or regex pattern.
         mode: "fuzzy" for substring match, "regex" for regular expression.
         limit: Maximum number of matches to return.
@@ -782,7 +1179,7 @@ def search_snapshot_index_text(
     """
     if not aria_tree or not query:
         return "(empty)"
-    nodes, _, _ = _parse_aria_snapshot(aria_tree)
+    tree = parse_aria_tree(aria_tree)
     results: list[dict] = []
     if mode == "regex":
         try:
@@ -796,23 +1193,24 @@ def search_snapshot_index_text(
         def is_match(text: str) -> bool:
             return needle in text.lower()
 
-    for node in nodes:
-        text_value = _node_text_value(node)
-        suffix = _clean_suffix(node["suffix"])
-        haystack = " ".join(part for part in [node["role"], text_value, suffix] if part)
+    for node_id, role in enumerate(tree.roles):
+        text_value = tree.text_value(node_id)
+        suffix = _clean_suffix(tree.suffixes[node_id])
+        haystack = " ".join(part for part in [role, text_value, suffix] if part)
         if not haystack:
             continue
         if not is_match(haystack):
             continue
         snippet_source = text_value or suffix or haystack
         text_hint = _match_snippet(snippet_source, query, mode, text_limit)
-        label = node["role"]
+        label = role
         if text_hint:
             label += f' "{text_hint}"'
+        path = tree.paths[node_id]
         results.append(
             {
-                "path": node["path"],
-                "line": f"- {label} [path={node['path']}]",
+                "path": path,
+                "line": f"- {label} [path={path}]",
             }
         )
         if len(results) >= limit * 4:
@@ -832,13 +1230,13 @@ def search_snapshot_index_text(
     return "\n".join([header, *pruned]) if pruned else f"{header}\n(empty)"
 
 
-def resolve_path_locator(page: Page, aria_tree: str, path: str):
+def resolve_path_locator(page: Page, aria_tree: str | AriaTree, path: str):
     """
     Resolve an index path to a stable locator on the page.
 
     Args:
         page: Target Playwright page.
-        aria_tree: Raw ARIA snapshot text.
+        aria_tree: Raw ARIA snapshot text or a parsed AriaTree.
         path: Index path to resolve.
 
     Returns:
@@ -846,176 +1244,1005 @@ def resolve_path_locator(page: Page, aria_tree: str, path: str):
     """
     if not aria_tree:
         raise KeyError("空页面快照")
-    nodes, _, path_to_id = _parse_aria_snapshot(aria_tree)
-    if path not in path_to_id:
+    tree = parse_aria_tree(aria_tree)
+    if path not in tree.path_to_id:
         raise KeyError(f"未知的 path: {path}")
-    node = nodes[path_to_id[path]]
-    role = node["role"]
-    name = node["name"]
-    text_value = _node_text_value(node)
+    node_id = tree.path_to_id[path]
+    roles = tree.roles
+    names = tree.names
+    role = roles[node_id]
+    name = names[node_id]
+    text_value = tree.text_value(node_id)
     if role == "text":
         if text_value:
-            nth_index = 0
-            for candidate in nodes:
-                if candidate["role"] == "text" and _node_text_value(candidate) == text_value:
-                    if candidate["id"] == node["id"]:
-                        break
-                    nth_index += 1
-            return page.get_by_text(text_value, exact=True).nth(nth_index)
-        parent_id = node["parent_id"]
+            return page.get_by_text(text_value, exact=True).nth(tree.nth_of_text(node_id))
+        parent_id = tree.parents[node_id]
         while parent_id is not None:
-            parent = nodes[parent_id]
-            if parent["name"] or parent["role"] != "text":
-                node = parent
-                role = node["role"]
-                name = node["name"]
+            if names[parent_id] or roles[parent_id] != "text":
+                node_id = parent_id
+                role = roles[node_id]
+                name = names[node_id]
                 break
-            parent_id = parent["parent_id"]
+            parent_id = tree.parents[parent_id]
         if role == "text" and not name:
             raise KeyError(f"path 指向 text 节点且无可定位名称: {path}")
     if name:
-        nth_index = 0
-        for candidate in nodes:
-            if candidate["role"] == role and candidate["name"] == name:
-                if candidate["id"] == node["id"]:
-                    break
-                nth_index += 1
+        nth_index = tree.nth_of_name(node_id)
         if role == "text":
             return page.get_by_text(name, exact=True).nth(nth_index)
         return page.get_by_role(role, name=name, exact=True).nth(nth_index)
-    nth_index = 0
-    for candidate in nodes:
-        if candidate["role"] == role:
-            if candidate["id"] == node["id"]:
-                break
-            nth_index += 1
-    return page.get_by_role(role).nth(nth_index)
+    return page.get_by_role(role).nth(tree.nth_of_role(node_id))
 
 
-def _build_snapshot_from_aria_tree(aria_tree: str, options: SnapshotOptions) -> EnhancedSnapshot:
-    if not aria_tree:
-        return EnhancedSnapshot(tree="(empty)", refs={})
+def _ref_nth(tree: AriaTree, node_id: int) -> Optional[int]:
+    # Mirrors how the ref is resolved: by role and exact name, or by role alone.
+    if tree.names[node_id]:
+        matches = tree.name_index[(tree.roles[node_id], tree.names[node_id])]
+    else:
+        matches = tree.role_index[tree.roles[node_id]]
+    if len(matches) == 1:
+        return None
+    return bisect_left(matches, node_id)
 
-    lines = aria_tree.splitlines()
-    element_pattern = re.compile(r'^(\s*-\s*)(\w+)(?:\s+"([^"]*)")?(.*)$')
 
-    counts: Dict[str, int] = {}
-    parsed_lines = []
+def _build_snapshot_from_aria_tree(
+    aria_tree: str | AriaTree,
+    options: SnapshotOptions,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+) -> EnhancedSnapshot:
+    snapshot, _, _ = _render_aria_tree(parse_aria_tree(aria_tree), options, registry=registry, scope=scope)
+    return snapshot
 
-    for line in lines:
-        match = element_pattern.match(line)
-        if not match:
-            parsed_lines.append((line, None))
-            continue
 
-        prefix, role, name, suffix = match.groups()
-        role_lower = role.lower()
+def _kept_nodes(tree: AriaTree, options: SnapshotOptions) -> list[bool]:
+    roles = tree.roles
+    names = tree.names
+    kept_nodes = [False] * len(tree)
 
-        if role.startswith("/"):
-            parsed_lines.append((line, None))
-            continue
-
-        depth = _get_indent_level(line)
-        if options.max_depth is not None and depth > options.max_depth:
-            parsed_lines.append((None, None))
+    for node_id, role_lower in enumerate(roles):
+        if options.max_depth is not None and tree.depths[node_id] > options.max_depth:
             continue
 
+        name = names[node_id]
         is_interactive = role_lower in INTERACTIVE_ROLES
-        is_content = role_lower in CONTENT_ROLES
         is_structural = role_lower in STRUCTURAL_ROLES
 
         if options.summary:
-            keep = is_interactive or role_lower == "heading" or role_lower in {
-                "region", "main", "navigation", "article", "complementary", "banner", "contentinfo"
-            }
+            keep = is_interactive or role_lower in SUMMARY_ROLES
             if not keep:
-                parsed_lines.append((None, None))
                 continue
 
         if options.interactive and not is_interactive:
-            parsed_lines.append((None, None))
             continue
 
         if options.compact and is_structural and not name:
-            parsed_lines.append((None, None))
             continue
 
-        key = f"{role_lower}:{name or ''}"
-        counts[key] = counts.get(key, 0) + 1
-        parsed_lines.append(((prefix, role, name, suffix, key), "element"))
+        kept_nodes[node_id] = True
+    return kept_nodes
 
-    refs: Dict[str, RefTarget] = {}
-    result_lines = []
-    ref_index = 0
-    key_counters: Dict[str, int] = {}
 
-    for entry, kind in parsed_lines:
-        if entry is None and kind is None:
-            continue
+def _node_line(tree: AriaTree, node_id: int, options: SnapshotOptions, ref_id: Optional[str]) -> str:
+    name = tree.names[node_id]
+    line = f"{tree.prefixes[node_id]}{tree.roles[node_id]}"
+    if name:
+        display_name = name
+        if options.text_limit is not None:
+            display_name = _truncate_text(name, options.text_limit)
+        line += f" {_quote_name(display_name)}"
+    if ref_id is not None:
+        line += f" [ref=@{ref_id}]"
+    return line + tree.suffixes[node_id]
 
-        if kind is None:
-            result_lines.append(entry)
-            continue
 
-        prefix, role, name, suffix, key = entry
-        role_lower = role.lower()
-        is_interactive = role_lower in INTERACTIVE_ROLES
-        is_content = role_lower in CONTENT_ROLES
-        should_have_ref = is_interactive or (is_content and name)
+def _wants_ref(role_lower: str, name: Optional[str]) -> bool:
+    return role_lower in INTERACTIVE_ROLES or (role_lower in CONTENT_ROLES and bool(name))
 
-        line = f'{prefix}{role}'
-        if name:
-            display_name = name
-            if options.text_limit is not None:
-                display_name = _truncate_text(name, options.text_limit)
-            line += f' "{display_name}"'
-
-        if should_have_ref:
-            ref_index += 1
-            ref_id = f"e{ref_index}"
-            total = counts.get(key, 0)
-            nth_index = None
-            if total > 1:
-                nth_index = key_counters.get(key, 0)
-                key_counters[key] = nth_index + 1
-
-            refs[ref_id] = RefTarget(
+
+def _iter_rendered_lines(
+    tree: AriaTree,
+    options: SnapshotOptions,
+    registry: RefRegistry,
+    scope: str,
+    kept_nodes: Optional[list[bool]] = None,
+    line_start: int = 0,
+    line_end: Optional[int] = None,
+) -> Iterator[tuple[str, int, Optional[str], Optional[RefTarget]]]:
+    """
+    Yield (line, node_id, ref_id, target) for every rendered line, assigning refs as it goes.
+
+    Lines that carry no node (text, properties) have node_id -1. `line_start`/`line_end`
+    restrict the walk to a slice of `tree.lines` (a subtree is a contiguous slice).
+    """
+    roles = tree.roles
+    names = tree.names
+    keys = tree.keys()
+    if kept_nodes is None:
+        kept_nodes = _kept_nodes(tree, options)
+    if line_end is None:
+        line_end = len(tree.lines)
+
+    for line_index in range(line_start, line_end):
+        line = tree.lines[line_index]
+        node_id = tree.line_nodes[line_index]
+        if node_id < 0:
+            yield line, node_id, None, None
+            continue
+        if not kept_nodes[node_id]:
+            continue
+
+        role_lower = roles[node_id]
+        name = names[node_id]
+        ref_id = None
+        target = None
+        if _wants_ref(role_lower, name):
+            target = RefTarget(
                 selector=_build_selector(role_lower, name),
                 role=role_lower,
                 name=name,
-                nth=nth_index,
+                nth=_ref_nth(tree, node_id),
+                scope=scope,
             )
-            line += f" [ref=@{ref_id}]"
+            ref_id = registry.assign(keys[node_id], target)
+        yield _node_line(tree, node_id, options, ref_id), node_id, ref_id, target
+
 
-        line += suffix
+# Weight of a kept node when a character budget forces parts of the tree to be hidden.
+def _node_value(role_lower: str, name: Optional[str]) -> int:
+    if role_lower in INTERACTIVE_ROLES:
+        return 3
+    if (role_lower in CONTENT_ROLES and name) or role_lower in SUMMARY_ROLES:
+        return 2
+    if role_lower == "text" or name:
+        return 1
+    return 0
+
+
+def _iter_budgeted_lines(
+    tree: AriaTree,
+    options: SnapshotOptions,
+    registry: RefRegistry,
+    scope: str,
+    budget: int,
+    root_id: Optional[int] = None,
+) -> Iterator[tuple[str, int, Optional[str], Optional[RefTarget]]]:
+    """
+    Like `_iter_rendered_lines`, but keep the output within `budget` characters.
+
+    Per-subtree cost, value and rank are summed in one backward pass. Siblings are then
+    visited with subtrees holding interactive elements first, then ones holding other
+    ref-bearing nodes, each group by value density: a subtree that fits is rendered
+    whole, one that does not is opened if at least one of its children fits, and the
+    rest are folded into one "(+N hidden) [path=...]" line per parent, pointing at the
+    first hidden subtree. The placeholder is reserved before any sibling is placed, so
+    the result never exceeds the budget.
+    """
+    count = len(tree)
+    kept_nodes = _kept_nodes(tree, options)
+    ref_width = len(f" [ref=@e{registry.issued + count}]")
+    line_starts = [0] * count
+    own_cost = [0] * count
+    last_node = -1
+    for line_index, (line, node_id) in enumerate(zip(tree.lines, tree.line_nodes)):
+        if node_id >= 0:
+            line_starts[node_id] = line_index
+            last_node = node_id
+            if kept_nodes[node_id]:
+                role_lower = tree.roles[node_id]
+                name = tree.names[node_id]
+                width = ref_width if _wants_ref(role_lower, name) else 0
+                own_cost[node_id] = len(_node_line(tree, node_id, options, None)) + width + 1
+        elif last_node >= 0:
+            own_cost[last_node] += len(line) + 1
+    # Every kept node is visible in full, partial or as part of a placeholder count.
+    sub_cost = list(own_cost)
+    sub_value = [
+        _node_value(tree.roles[node_id], tree.names[node_id]) if kept_nodes[node_id] else 0
+        for node_id in range(count)
+    ]
+    sub_nodes = [1 if kept else 0 for kept in kept_nodes]
+    # 2: holds an interactive element, 1: holds another ref-bearing node, 0: static only.
+    sub_rank = [0] * count
+    for node_id in range(count):
+        if kept_nodes[node_id]:
+            role_lower = tree.roles[node_id]
+            if role_lower in INTERACTIVE_ROLES:
+                sub_rank[node_id] = 2
+            elif _wants_ref(role_lower, tree.names[node_id]):
+                sub_rank[node_id] = 1
+    for node_id in range(count - 1, -1, -1):
+        parent_id = tree.parents[node_id]
+        if parent_id is not None:
+            sub_cost[parent_id] += sub_cost[node_id]
+            sub_value[parent_id] += sub_value[node_id]
+            sub_nodes[parent_id] += sub_nodes[node_id]
+            sub_rank[parent_id] = max(sub_rank[parent_id], sub_rank[node_id])
+
+    def placeholder(first_id: int, hidden: int) -> str:
+        return f"{tree.prefixes[first_id]}(+{hidden} hidden) [path={tree.paths[first_id]}]"
+
+    def plan(children: list[int], budget_left: int) -> tuple[list[tuple], int]:
+        if len(children) == 1:
+            # A lone child is shown, opened or replaced by its placeholder: nothing to reserve.
+            reserve = 0
+        else:
+            reserve = len(placeholder(children[0], sum(sub_nodes[c] for c in children))) + 1
+            reserve += max(len(tree.paths[c]) for c in children) - len(tree.paths[children[0]])
+        remaining = budget_left - reserve
+        if remaining < 0:
+            return [], 0
+        modes: Dict[int, Any] = {}
+        order = sorted(children, key=lambda c: (-sub_rank[c], -sub_value[c] / max(1, sub_cost[c]), c))
+        for child in order:
+            if sub_cost[child] <= remaining:
+                modes[child] = "full"
+                remaining -= sub_cost[child]
+                continue
+            grandchildren = tree.children[child]
+            if grandchildren and sub_value[child] > 0 and own_cost[child] < remaining:
+                entries, used = plan(grandchildren, remaining - own_cost[child])
+                # A node opened only to show a placeholder costs lines and tells nothing.
+                if any(entry[0] != "hidden" for entry in entries):
+                    modes[child] = entries
+                    remaining -= own_cost[child] + used
+        entries: list[tuple] = []
+        hidden = 0
+        placeholder_at = None
+        for child in children:
+            mode = modes.get(child)
+            if mode is None:
+                if sub_nodes[child]:
+                    hidden += sub_nodes[child]
+                    if placeholder_at is None:
+                        placeholder_at = len(entries)
+                        entries.append(("hidden", child))
+                continue
+            entries.append(("full", child) if mode == "full" else ("open", child, mode))
+        used = budget_left - reserve - remaining
+        if placeholder_at is not None:
+            first = entries[placeholder_at][1]
+            entries[placeholder_at] = ("hidden", first, placeholder(first, hidden))
+            used += len(entries[placeholder_at][2]) + 1
+            if used > budget_left:
+                return [], 0
+        return entries, used
+
+    def line_end(node_id: int) -> int:
+        end = tree.subtree_end(node_id)
+        return line_starts[end] if end < count else len(tree.lines)
+
+    def emit(entries: list[tuple]):
+        for entry in entries:
+            kind, node_id = entry[0], entry[1]
+            if kind == "hidden":
+                yield entry[2], -1, None, None
+            elif kind == "full":
+                yield from _iter_rendered_lines(
+                    tree, options, registry, scope, kept_nodes, line_starts[node_id], line_end(node_id)
+                )
+            else:
+                own_end = line_starts[tree.children[node_id][0]]
+                yield from _iter_rendered_lines(
+                    tree, options, registry, scope, kept_nodes, line_starts[node_id], own_end
+                )
+                yield from emit(entry[2])
+
+    roots = tree.root_ids if root_id is None else [root_id]
+    if not roots:
+        return
+    entries, _ = plan(roots, budget)
+    yield from emit(entries)
+
+
+def _iter_lines(
+    tree: AriaTree,
+    options: SnapshotOptions,
+    registry: RefRegistry,
+    scope: str,
+    root_id: Optional[int] = None,
+) -> Iterator[tuple[str, int, Optional[str], Optional[RefTarget]]]:
+    budget = options.char_budget()
+    if budget is not None:
+        return _iter_budgeted_lines(tree, options, registry, scope, budget, root_id)
+    if root_id is None:
+        return _iter_rendered_lines(tree, options, registry, scope)
+    start = tree.line_nodes.index(root_id)
+    end = tree.subtree_end(root_id)
+    line_end = tree.line_nodes.index(end) if end < len(tree) else len(tree.lines)
+    return _iter_rendered_lines(tree, options, registry, scope, line_start=start, line_end=line_end)
+
+
+def _render_aria_tree(
+    tree: AriaTree,
+    options: SnapshotOptions,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+    root_id: Optional[int] = None,
+) -> tuple[EnhancedSnapshot, Dict[int, str], Dict[str, int]]:
+    """
+    Render a parsed ARIA snapshot into the readable tree.
+
+    Refs are taken from `registry` (a fresh one when omitted) under `scope`.
+    `root_id` limits the output to one subtree; `options.max_chars`/`max_tokens`
+    bound its size. Besides the snapshot itself, returns the rendered line of every
+    kept node and the node id behind every ref.
+    """
+    if registry is None:
+        registry = RefRegistry()
+    registry.begin(scope)
+    if not tree.source:
+        return EnhancedSnapshot(tree="(empty)", refs={}), {}, {}
+
+    refs: Dict[str, RefTarget] = {}
+    ref_nodes: Dict[str, int] = {}
+    node_lines: Dict[int, str] = {}
+    result_lines = []
+
+    for line, node_id, ref_id, target in _iter_lines(tree, options, registry, scope, root_id):
         result_lines.append(line)
+        if node_id < 0:
+            continue
+        if ref_id is not None:
+            refs[ref_id] = target
+            ref_nodes[ref_id] = node_id
+        node_lines[node_id] = line
+
+    registry.finish(scope, tree)
+    snapshot = EnhancedSnapshot(tree="\n".join(result_lines), refs=refs, ref_nodes=ref_nodes)
+    return snapshot, node_lines, ref_nodes
+
+
+def build_path_snapshot(
+    aria_tree: str | AriaTree,
+    options: SnapshotOptions,
+    path: str,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+) -> EnhancedSnapshot:
+    """
+    Render only the subtree at `path` (as shown by "(+N hidden) [path=...]" placeholders).
+
+    Refs come from the same registry scope as the full snapshot, so they match it.
+    """
+    tree = parse_aria_tree(aria_tree)
+    root_id = None
+    if path not in ("root", ""):
+        if path not in tree.path_to_id:
+            raise KeyError(f"未知的 path: {path}")
+        root_id = tree.path_to_id[path]
+    snapshot, _, _ = _render_aria_tree(tree, options, registry=registry, scope=scope, root_id=root_id)
+    return snapshot
+
+
+def build_search_results(
+    tree: AriaTree,
+    node_ids: list[int],
+    options: SnapshotOptions,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+) -> list[str]:
+    """
+    Render matched nodes as single lines with their refs and paths.
+
+    Only the matched nodes touch the registry: a node keeps its current ref when it
+    is still valid, so refs handed out by earlier snapshots stay usable.
+    """
+    if registry is None:
+        registry = RefRegistry()
+    keys = tree.keys()
+    lines: list[str] = []
+    for node_id in node_ids:
+        role_lower = tree.roles[node_id]
+        name = tree.names[node_id]
+        ref_id = None
+        if _wants_ref(role_lower, name):
+            nth = _ref_nth(tree, node_id)
+            ref_id = registry.lookup(scope, keys[node_id])
+            current = registry.get(ref_id) if ref_id else None
+            if current is None or registry.is_stale(ref_id) or current.nth != nth:
+                ref_id = registry.assign(
+                    keys[node_id],
+                    RefTarget(
+                        selector=_build_selector(role_lower, name),
+                        role=role_lower,
+                        name=name,
+                        nth=nth,
+                        scope=scope,
+                    ),
+                )
+        line = _node_line(tree, node_id, options, ref_id).strip().rstrip(":")
+        lines.append(f"{line} [path={tree.paths[node_id]}]")
+    return lines
+
 
-    return EnhancedSnapshot(tree="\n".join(result_lines), refs=refs)
+@dataclass
+class SnapshotChunk:
+    """
+    One piece of a streamed snapshot: consecutive rendered lines and the refs they introduce.
+    """
+
+    text: str
+    refs: Dict[str, RefTarget]
+    ref_nodes: Dict[str, int]
+    nodes: int
+    truncated: bool = False
+
+
+def iter_snapshot_chunks(
+    tree: AriaTree,
+    options: SnapshotOptions,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+    chunk_lines: int = 200,
+    max_nodes: Optional[int] = None,
+    max_chars: Optional[int] = None,
+) -> Iterator[SnapshotChunk]:
+    """
+    Render `tree` like `_render_aria_tree`, but hand out the lines in chunks as they are produced.
+
+    Chunks end at top-level subtree boundaries once they hold `chunk_lines` lines (or at
+    twice that size inside a very large subtree). Rendering stops once `max_nodes` nodes
+    or `max_chars` characters were emitted; the last chunk then ends with a
+    "... (truncated ...)" line and has `truncated` set. The registry is finished even when
+    the consumer stops early.
+    """
+    if registry is None:
+        registry = RefRegistry()
+    registry.begin(scope)
+    if not tree.source:
+        yield SnapshotChunk(text="(empty)", refs={}, ref_nodes={}, nodes=0)
+        return
+
+    lines: list[str] = []
+    refs: Dict[str, RefTarget] = {}
+    ref_nodes: Dict[str, int] = {}
+    nodes = 0
+    chars = 0
+    try:
+        for line, node_id, ref_id, target in _iter_lines(tree, options, registry, scope):
+            is_top_level = node_id >= 0 and tree.depths[node_id] == 0
+            if lines and (
+                (is_top_level and len(lines) >= chunk_lines) or len(lines) >= chunk_lines * 2
+            ):
+                yield SnapshotChunk(text="\n".join(lines), refs=refs, ref_nodes=ref_nodes, nodes=nodes)
+                lines, refs, ref_nodes = [], {}, {}
+            if node_id >= 0:
+                if (max_nodes is not None and nodes >= max_nodes) or (
+                    max_chars is not None and chars + len(line) > max_chars
+                ):
+                    lines.append(f"... (truncated after {nodes} nodes)")
+                    yield SnapshotChunk(
+                        text="\n".join(lines), refs=refs, ref_nodes=ref_nodes, nodes=nodes, truncated=True
+                    )
+                    return
+                nodes += 1
+            chars += len(line) + 1
+            lines.append(line)
+            if ref_id is not None:
+                refs[ref_id] = target
+                ref_nodes[ref_id] = node_id
+        if lines or not nodes:
+            yield SnapshotChunk(text="\n".join(lines), refs=refs, ref_nodes=ref_nodes, nodes=nodes)
+    finally:
+        registry.finish(scope, tree)
+
+
+@dataclass
+class SnapshotBaseline:
+    """
+    Parsed view of the previous full-page snapshot, kept for `diff_since="last"`.
+    """
+
+    keys: list[str]
+    parents: list[Optional[int]]
+    paths: list[str]
+    signatures: list[str]
+    labels: list[str]
+    kept: list[bool]
+
+
+def build_snapshot_diff(
+    aria_tree: str | AriaTree,
+    options: SnapshotOptions,
+    previous: Optional[SnapshotBaseline],
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+) -> tuple[EnhancedSnapshot, SnapshotBaseline]:
+    """
+    Render an ARIA snapshot as a structural diff against the previous snapshot.
+
+    Nodes are matched by their role/name chain, the same fingerprint the ref
+    registry uses, so unchanged nodes keep their refs. Without a previous snapshot
+    the full tree is returned.
+
+    Args:
+        aria_tree: Raw ARIA snapshot text or a parsed AriaTree.
+        options: Snapshot rendering options.
+        previous: Baseline returned by the previous call, if any.
+        registry: Ref registry of the page.
+        scope: Registry scope the refs belong to.
+
+    Returns:
+        A tuple of (snapshot, baseline). `snapshot.tree` holds only added, removed and
+        changed subtrees; `snapshot.refs` covers every ref in the current tree.
+    """
+    tree = parse_aria_tree(aria_tree)
+    keys = tree.keys()
+    snapshot, node_lines, _ = _render_aria_tree(tree, options, registry=registry, scope=scope)
+    label_limit = options.text_limit if options.text_limit is not None else 80
+    signatures = [
+        f"{role}|{tree.names[node_id] or ''}|{_clean_suffix(tree.suffixes[node_id])}"
+        for node_id, role in enumerate(tree.roles)
+    ]
+    baseline = SnapshotBaseline(
+        keys=keys,
+        parents=tree.parents,
+        paths=tree.paths,
+        signatures=signatures,
+        labels=[_format_node_label(tree, node_id, label_limit) for node_id in range(len(tree))],
+        kept=[node_id in node_lines for node_id in range(len(tree))],
+    )
+    if previous is None:
+        return snapshot, baseline
+
+    current_ids = {key: node_id for node_id, key in enumerate(keys)}
+    previous_ids = {key: node_id for node_id, key in enumerate(previous.keys)}
+    output: list[str] = []
+    added = removed = changed = 0
+
+    node_id = 0
+    while node_id < len(tree):
+        key = keys[node_id]
+        previous_id = previous_ids.get(key)
+        if previous_id is None:
+            end = tree.subtree_end(node_id)
+            subtree = [node_lines[i] for i in range(node_id, end) if i in node_lines]
+            if subtree:
+                added += 1
+                base_indent = min(len(line) - len(line.lstrip()) for line in subtree)
+                output.append(f"+ [path={tree.paths[node_id]}]")
+                output.extend(f"  {line[base_indent:]}" for line in subtree)
+            node_id = end
+            continue
+        if node_id in node_lines and previous.signatures[previous_id] != signatures[node_id]:
+            changed += 1
+            line = node_lines[node_id].strip()
+            if line.startswith("- "):
+                line = line[2:]
+            output.append(f"~ {line} [path={tree.paths[node_id]}]")
+        node_id += 1
+
+    removed_roots: Dict[int, bool] = {}
+    for previous_id, key in enumerate(previous.keys):
+        if key in current_ids:
+            continue
+        root_id = previous_id
+        parent_id = previous.parents[root_id]
+        while parent_id is not None and previous.keys[parent_id] not in current_ids:
+            root_id = parent_id
+            parent_id = previous.parents[root_id]
+        removed_roots[root_id] = removed_roots.get(root_id, False) or previous.kept[previous_id]
+    for root_id, visible in removed_roots.items():
+        if not visible:
+            continue
+        removed += 1
+        output.append(f"- {previous.labels[root_id]} [path={previous.paths[root_id]}]")
+
+    header = f"diff (since=last, added={added}, removed={removed}, changed={changed})"
+    tree_text = "\n".join([header, *output]) if output else f"{header}\n(no changes)"
+    return EnhancedSnapshot(tree=tree_text, refs=snapshot.refs, ref_nodes=snapshot.ref_nodes), baseline
+
+
+_FILTERED_TREE_JS = """(root, params) => {
+    const interactiveRoles = new Set(params.interactiveRoles);
+    const summaryRoles = new Set(params.summaryRoles);
+    const maxDepth = params.maxDepth;
+    const skipTags = new Set(["script", "style", "noscript", "template", "head", "meta", "link"]);
+    const nameFromContent = new Set([
+        "button", "link", "heading", "tab", "menuitem", "menuitemcheckbox", "menuitemradio", "option",
+        "treeitem", "cell", "gridcell", "columnheader", "rowheader", "switch", "checkbox", "radio"
+    ]);
+    const inputRoles = {
+        button: "button", submit: "button", reset: "button", image: "button", file: "button",
+        checkbox: "checkbox", radio: "radio", range: "slider", number: "spinbutton", search: "searchbox"
+    };
+    const squash = (text) => (text || "").replace(/\\s+/g, " ").trim();
+    const implicitRole = (el) => {
+        const tag = el.localName;
+        if (/^h[1-6]$/.test(tag)) return "heading";
+        switch (tag) {
+            case "a":
+            case "area":
+                return el.hasAttribute("href") ? "link" : null;
+            case "button":
+            case "summary":
+                return "button";
+            case "input": {
+                const type = (el.getAttribute("type") || "text").toLowerCase();
+                if (type === "hidden") return null;
+                if (inputRoles[type]) return inputRoles[type];
+                return el.hasAttribute("list") ? "combobox" : "textbox";
+            }
+            case "textarea":
+                return "textbox";
+            case "select":
+                return el.multiple || el.size > 1 ? "listbox" : "combobox";
+            case "option":
+                return "option";
+            case "main":
+                return "main";
+            case "nav":
+                return "navigation";
+            case "aside":
+                return "complementary";
+            case "header":
+                return el.closest("article, aside, main, nav, section") ? null : "banner";
+            case "footer":
+                return el.closest("article, aside, main, nav, section") ? null : "contentinfo";
+            case "section":
+                return el.hasAttribute("aria-label") || el.hasAttribute("aria-labelledby") ? "region" : null;
+            case "article":
+                return "article";
+            case "ul":
+            case "ol":
+                return "list";
+            case "li":
+                return "listitem";
+            case "table":
+                return "table";
+            case "tr":
+                return "row";
+            case "td":
+                return "cell";
+            case "th":
+                return "columnheader";
+            case "dialog":
+                return "dialog";
+            case "img":
+                return el.getAttribute("alt") === "" ? null : "img";
+        }
+        if (el.isContentEditable && el.hasAttribute("contenteditable")) return "textbox";
+        return null;
+    };
+    const roleOf = (el) => {
+        const explicit = (el.getAttribute("role") || "").trim().split(/\\s+/)[0].toLowerCase();
+        if (explicit === "presentation" || explicit === "none") return null;
+        return explicit || implicitRole(el);
+    };
+    const nameOf = (el, role) => {
+        const labelledBy = el.getAttribute("aria-labelledby");
+        if (labelledBy) {
+            const text = squash(labelledBy.split(/\\s+/)
+                .map((id) => document.getElementById(id))
+                .filter(Boolean)
+                .map((node) => node.textContent)
+                .join(" "));
+            if (text) return text;
+        }
+        const label = squash(el.getAttribute("aria-label"));
+        if (label) return label;
+        if (el.labels && el.labels.length) {
+            const text = squash(Array.from(el.labels).map((node) => node.innerText || node.textContent).join(" "));
+            if (text) return text;
+        }
+        if (el.localName === "img" || (el.localName === "input" && el.type === "image")) {
+            const alt = squash(el.getAttribute("alt"));
+            if (alt) return alt;
+        }
+        if (el.localName === "input" && ["button", "submit", "reset"].includes(el.type)) {
+            const value = squash(el.value);
+            if (value) return value;
+            if (el.type === "submit") return "Submit";
+            if (el.type === "reset") return "Reset";
+        }
+        if (nameFromContent.has(role)) {
+            const text = squash(el.innerText || el.textContent);
+            if (text) return text;
+        }
+        return squash(el.getAttribute("title")) || squash(el.getAttribute("placeholder"));
+    };
+    const suffixOf = (el, role) => {
+        let suffix = "";
+        if (role === "heading") {
+            const level = el.getAttribute("aria-level") || (/^h[1-6]$/.test(el.localName) ? el.localName.slice(1) : "");
+            if (level) suffix += ` [level=${level}]`;
+        }
+        if (["checkbox", "radio", "switch", "menuitemcheckbox", "menuitemradio"].includes(role)) {
+            const checked = el.getAttribute("aria-checked") || (el.checked ? "true" : "false");
+            if (checked === "true") suffix += " [checked]";
+            if (checked === "mixed") suffix += " [checked=mixed]";
+        }
+        if (el.getAttribute("aria-expanded") === "true") suffix += " [expanded]";
+        if (el.disabled || el.getAttribute("aria-disabled") === "true") suffix += " [disabled]";
+        if (role === "option" && (el.selected || el.getAttribute("aria-selected") === "true")) suffix += " [selected]";
+        if (["textbox", "searchbox", "combobox", "spinbutton"].includes(role)) {
+            let value = "";
+            if (el.localName === "select") {
+                value = el.selectedOptions && el.selectedOptions.length ? el.selectedOptions[0].textContent : "";
+            } else if (typeof el.value === "string") {
+                value = el.type === "password" ? "" : el.value;
+            } else if (el.isContentEditable) {
+                value = el.textContent;
+            }
+            value = squash(value);
+            if (value) suffix += `: ${value}`;
+        }
+        return suffix;
+    };
+    const isVisible = (el) => {
+        if (typeof el.checkVisibility === "function") {
+            return el.checkVisibility({ visibilityProperty: true });
+        }
+        const style = window.getComputedStyle(el);
+        return style.display !== "none" && style.visibility !== "hidden";
+    };
+    const lines = [];
+    const handles = [];
+    let handleCount = 0;
+    // depth counts role-bearing ancestors (for max_depth); indent counts emitted ones, so
+    // every line is at most one level deeper than the line above, as in aria_snapshot().
+    const visit = (el, depth, indent) => {
+        if (skipTags.has(el.localName)) return;
+        if (el.getAttribute("aria-hidden") === "true" || el.hasAttribute("hidden")) return;
+        const role = roleOf(el);
+        let childDepth = depth;
+        let childIndent = indent;
+        if (role) {
+            childDepth = depth + 1;
+            const isInteractive = interactiveRoles.has(role);
+            let keep = maxDepth === null || depth <= maxDepth;
+            if (params.summary && !isInteractive && !summaryRoles.has(role)) keep = false;
+            if (params.interactive && !isInteractive) keep = false;
+            if (keep && isVisible(el)) {
+                const name = nameOf(el, role);
+                const quoted = name ? ` ${JSON.stringify(name)}` : "";
+                lines.push(`${"  ".repeat(indent)}- ${role}${quoted}${suffixOf(el, role)}`);
+                childIndent = indent + 1;
+                if (params.handlePrefix) {
+                    const handle = params.handlePrefix + handleCount++;
+                    el.setAttribute(params.handleAttr, handle);
+                    handles.push(handle);
+                }
+            }
+        }
+        const scope = el.shadowRoot || el;
+        for (let child = scope.firstElementChild; child; child = child.nextElementSibling) {
+            visit(child, childDepth, childIndent);
+        }
+    };
+    visit(root, 0, 0);
+    return { tree: lines.join("\\n"), handles };
+}"""
+
+
+async def get_filtered_aria_tree(
+    locator,
+    options: SnapshotOptions,
+    timeout_ms: Optional[int] = None,
+    handle_prefix: Optional[str] = None,
+) -> tuple[str, list[str]]:
+    """
+    Build an ARIA-style tree inside the page, keeping only the nodes selected by
+    the interactive/summary filters, so the full tree never crosses the CDP pipe.
+
+    Roles and names come from a lightweight in-page approximation of the ARIA
+    mapping; max_depth counts role-bearing ancestors, while lines are indented by
+    their emitted ancestors only. The tree uses the same line
+    format as `aria_snapshot()` and can be fed to any snapshot builder.
+
+    When `handle_prefix` is given, every emitted element is stamped with a unique
+    `NODE_HANDLE_ATTR` value, returned per line so refs can target it directly.
+    """
+    params = {
+        "interactive": options.interactive,
+        "summary": options.summary,
+        "maxDepth": options.max_depth,
+        "interactiveRoles": sorted(INTERACTIVE_ROLES),
+        "summaryRoles": sorted(SUMMARY_ROLES),
+        "handlePrefix": handle_prefix,
+        "handleAttr": NODE_HANDLE_ATTR,
+    }
+    if timeout_ms is None:
+        result = await locator.evaluate(_FILTERED_TREE_JS, params)
+    else:
+        result = await locator.evaluate(_FILTERED_TREE_JS, params, timeout=timeout_ms)
+    return result["tree"], result["handles"]
+
+
+# Runs the filtered walk over every matched root in one evaluate_all call. Each section gets
+# its own handle prefix so stamped handles stay unique across sections.
+_FILTERED_SECTIONS_JS = (
+    "(roots, params) => {\n    const walk = "
+    + _FILTERED_TREE_JS
+    + """;
+    return roots.map((root, index) => walk(root, Object.assign({}, params, {
+        handlePrefix: params.handlePrefix ? `${params.handlePrefix}${index}-` : null,
+    })));
+}"""
+)
+
+# Upper bound on concurrent aria_snapshot() calls when snapshotting many sections.
+SECTION_CONCURRENCY = 8
+
+
+async def get_section_snapshots(
+    locator,
+    count: int,
+    options: SnapshotOptions,
+    timeout_ms: Optional[int] = None,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
+    handle_prefix: Optional[str] = None,
+    concurrency: int = SECTION_CONCURRENCY,
+) -> list[Optional[EnhancedSnapshot]]:
+    """
+    Snapshot each of the `count` elements matched by `locator` as its own section.
+
+    With in-page filtering all sections come from a single evaluate_all walk; otherwise
+    the aria_snapshot() calls run concurrently, at most `concurrency` at a time. Trees
+    are rendered in document order into the shared `registry` under the scopes
+    "<scope>#1", "<scope>#2", ..., so refs never collide across sections.
+    A section that timed out is None.
+    """
+    captured: list[Optional[tuple[str, list[str]]]]
+    if options.in_page and (options.interactive or options.summary):
+        params = {
+            "interactive": options.interactive,
+            "summary": options.summary,
+            "maxDepth": options.max_depth,
+            "interactiveRoles": sorted(INTERACTIVE_ROLES),
+            "summaryRoles": sorted(SUMMARY_ROLES),
+            "handlePrefix": handle_prefix,
+            "handleAttr": NODE_HANDLE_ATTR,
+        }
+        try:
+            results = await asyncio.wait_for(
+                locator.evaluate_all(_FILTERED_SECTIONS_JS, params),
+                timeout=None if timeout_ms is None else timeout_ms / 1000,
+            )
+        except asyncio.TimeoutError:
+            raise PlaywrightTimeoutError(f"Timeout {timeout_ms}ms exceeded.") from None
+        captured = [(result["tree"], result["handles"]) for result in results]
+    else:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def capture(index: int) -> Optional[tuple[str, list[str]]]:
+            async with semaphore:
+                try:
+                    return await _capture_aria_tree(locator.nth(index), options, timeout_ms), []
+                except PlaywrightTimeoutError:
+                    return None
+
+        captured = list(await asyncio.gather(*(capture(index) for index in range(count))))
+
+    if registry is None:
+        registry = RefRegistry()
+    # A character budget is shared: each section gets an even share of what is left.
+    remaining = options.char_budget()
+    snapshots: list[Optional[EnhancedSnapshot]] = []
+    for index, item in enumerate(captured):
+        if item is None:
+            snapshots.append(None)
+            continue
+        aria_tree, handles = item
+        tree = parse_aria_tree(aria_tree)
+        section_options = options
+        if remaining is not None:
+            share = remaining // (len(captured) - index)
+            section_options = replace(options, max_chars=share, max_tokens=None)
+        snapshot, _, _ = _render_aria_tree(
+            tree, section_options, registry=registry, scope=f"{scope}#{index + 1}"
+        )
+        if remaining is not None:
+            remaining -= len(snapshot.tree)
+        if handles:
+            attach_node_handles(tree, snapshot, handles)
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def attach_node_handles(tree: AriaTree, snapshot: EnhancedSnapshot, handles: list[str]) -> None:
+    """
+    Copy per-line handles from `get_filtered_aria_tree` onto the snapshot refs.
+    """
+    line_handles: Dict[int, str] = {}
+    for line_index, node_id in enumerate(tree.line_nodes):
+        if node_id >= 0 and line_index < len(handles):
+            line_handles[node_id] = handles[line_index]
+    for ref_id, node_id in snapshot.ref_nodes.items():
+        snapshot.refs[ref_id].handle = line_handles.get(node_id)
+
+
+async def capture_backend_node_ids(cdp_session, tree: AriaTree, refs: Dict[str, RefTarget]) -> int:
+    """
+    Attach CDP backend DOM node ids to refs.
+
+    The accessibility tree is fetched once and matched to refs by role, name and
+    occurrence. A role/name group is only used when Chrome reports as many nodes
+    as the ARIA snapshot, so ambiguous refs keep resolving by role and name.
+
+    Returns:
+        The number of refs that received a node id.
+    """
+    response = await cdp_session.send("Accessibility.getFullAXTree")
+    by_role: Dict[str, list[int]] = {}
+    by_name: Dict[tuple[str, str], list[int]] = {}
+    for node in response.get("nodes", []):
+        backend_node_id = node.get("backendDOMNodeId")
+        if node.get("ignored") or backend_node_id is None:
+            continue
+        role = str((node.get("role") or {}).get("value") or "").lower()
+        name = str((node.get("name") or {}).get("value") or "")
+        by_role.setdefault(role, []).append(backend_node_id)
+        if name:
+            by_name.setdefault((role, name), []).append(backend_node_id)
+    matched = 0
+    for target in refs.values():
+        target.backend_node_id = None
+        if target.name:
+            candidates = by_name.get((target.role, target.name), [])
+            expected = len(tree.name_index.get((target.role, target.name), []))
+        else:
+            candidates = by_role.get(target.role, [])
+            expected = len(tree.role_index.get(target.role, []))
+        if not candidates or len(candidates) != expected:
+            continue
+        target.backend_node_id = candidates[target.nth or 0]
+        matched += 1
+    return matched
+
+
+# Installs one MutationObserver per document and returns "<document id>:<generation>".
+# The generation grows on every DOM change except our own node handle attributes, and on
+# input/change events: typing, checking and selecting change properties (value, checked,
+# selected) that the ARIA tree shows but that never mutate the DOM.
+_DOM_VERSION_JS = (
+    "(ignoredAttr) => { const state = (" + DOM_WATCH_JS + ")(ignoredAttr); "
+    "return state.id + ':' + state.generation; }"
+)
+
+
+async def get_dom_version(page: Page) -> Optional[str]:
+    """
+    Return a token that changes whenever the page DOM changes, or None when it cannot be read.
+    """
+    try:
+        return await page.evaluate(_DOM_VERSION_JS, NODE_HANDLE_ATTR)
+    except Exception:
+        # Navigation in progress or the document was replaced.
+        return None
+
+
+async def _capture_aria_tree(locator, options: SnapshotOptions, timeout_ms: Optional[int]) -> str:
+    if options.in_page and (options.interactive or options.summary):
+        aria_tree, _ = await get_filtered_aria_tree(locator, options, timeout_ms=timeout_ms)
+        return aria_tree
+    if timeout_ms is None:
+        return await locator.aria_snapshot()
+    return await locator.aria_snapshot(timeout=timeout_ms)
 
 
 async def get_enhanced_snapshot(
     page: Page,
     options: SnapshotOptions,
     timeout_ms: Optional[int] = None,
+    registry: Optional[RefRegistry] = None,
 ) -> EnhancedSnapshot:
     """
     基于 ARIA 树生成可读快照，并为可交互元素生成可复用的 ref。
     """
     locator = page.locator(options.selector) if options.selector else page.locator(":root")
-    if timeout_ms is None:
-        aria_tree = await locator.aria_snapshot()
-    else:
-        aria_tree = await locator.aria_snapshot(timeout=timeout_ms)
-    return _build_snapshot_from_aria_tree(aria_tree, options)
+    aria_tree = await _capture_aria_tree(locator, options, timeout_ms)
+    return _build_snapshot_from_aria_tree(aria_tree, options, registry=registry, scope=options.selector or "")
 
 
 async def get_enhanced_snapshot_locator(
     locator,
     options: SnapshotOptions,
     timeout_ms: Optional[int] = None,
+    registry: Optional[RefRegistry] = None,
+    scope: str = "",
 ) -> EnhancedSnapshot:
-    if timeout_ms is None:
-        aria_tree = await locator.aria_snapshot()
-    else:
-        aria_tree = await locator.aria_snapshot(timeout=timeout_ms)
-    return _build_snapshot_from_aria_tree(aria_tree, options)
+    aria_tree = await _capture_aria_tree(locator, options, timeout_ms)
+    return _build_snapshot_from_aria_tree(aria_tree, options, registry=registry, scope=scope)
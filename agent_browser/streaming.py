@@ -2,10 +2,301 @@ from __future__ import annotations
 
 import asyncio
 import base64
+import hashlib
+import json
+import struct
+import time
 from typing import Any, Awaitable, Callable, Dict, Optional
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+    np = None
+
+import websockets
 from patchright.async_api import Page
 
 
+# Adaptive ladder, best first: (quality factor, size scale, every_nth_frame multiplier).
+ADAPTIVE_LEVELS = (
+    (1.0, 1.0, 1),
+    (0.85, 1.0, 1),
+    (0.7, 0.85, 1),
+    (0.6, 0.75, 2),
+    (0.5, 0.6, 2),
+    (0.4, 0.5, 3),
+    (0.35, 0.4, 4),
+    (0.3, 0.3, 6),
+)
+
+
+class AdaptiveFrameController:
+    """
+    根据 on_frame 回调耗时、ack 耗时、丢帧数与输出码率，在 ADAPTIVE_LEVELS 档位之间升降，
+    并按 target_fps 限制帧间隔。
+    """
+
+    def __init__(
+        self,
+        target_fps: float = 10.0,
+        target_kbps: Optional[float] = None,
+        base_quality: int = 80,
+        min_quality: int = 30,
+        base_width: Optional[int] = None,
+        base_height: Optional[int] = None,
+        base_every_nth: int = 1,
+        window: float = 1.0,
+        calm_windows: int = 3,
+    ) -> None:
+        if target_fps <= 0:
+            raise ValueError("target_fps 必须大于 0")
+        self.target_fps = target_fps
+        self.target_kbps = target_kbps
+        self.level = 0
+        self._base_quality = base_quality
+        self._min_quality = min(min_quality, base_quality)
+        self._base_width = base_width
+        self._base_height = base_height
+        self._base_every_nth = max(1, base_every_nth)
+        self._window = window
+        self._calm_needed = calm_windows
+        self._calm = 0
+        self._window_start = time.monotonic()
+        self._frames = 0
+        self._bytes = 0
+        self._dropped = 0
+        self._latency = 0.0
+        self._last_emit = 0.0
+        self.latency_ms = 0.0
+        self.ack_ms = 0.0
+        self.kbps = 0.0
+        self.fps = 0.0
+        self.dropped_total = 0
+
+    @property
+    def quality(self) -> int:
+        factor = ADAPTIVE_LEVELS[self.level][0]
+        return max(self._min_quality, int(round(self._base_quality * factor)))
+
+    @property
+    def max_width(self) -> Optional[int]:
+        if not self._base_width:
+            return None
+        return max(1, int(self._base_width * ADAPTIVE_LEVELS[self.level][1]))
+
+    @property
+    def max_height(self) -> Optional[int]:
+        if not self._base_height:
+            return None
+        return max(1, int(self._base_height * ADAPTIVE_LEVELS[self.level][1]))
+
+    @property
+    def every_nth_frame(self) -> int:
+        return self._base_every_nth * ADAPTIVE_LEVELS[self.level][2]
+
+    @property
+    def frame_interval(self) -> float:
+        return ADAPTIVE_LEVELS[self.level][2] / self.target_fps
+
+    def next_emit_delay(self) -> float:
+        return max(0.0, self._last_emit + self.frame_interval - time.monotonic())
+
+    def record_drop(self) -> None:
+        self._dropped += 1
+        self.dropped_total += 1
+
+    def record_frame(self, size: int, emit_seconds: float, ack_seconds: float = 0.0) -> bool:
+        """
+        Record one delivered frame.
+
+        Returns:
+            True when the level changed and capture settings must be reapplied.
+        """
+        now = time.monotonic()
+        self._last_emit = now
+        self._frames += 1
+        self._bytes += size
+        self._latency += emit_seconds + ack_seconds
+        self.latency_ms = self.latency_ms * 0.8 + emit_seconds * 1000 * 0.2
+        self.ack_ms = self.ack_ms * 0.8 + ack_seconds * 1000 * 0.2
+        elapsed = now - self._window_start
+        if elapsed < self._window:
+            return False
+        self.fps = self._frames / elapsed
+        self.kbps = self._bytes * 8 / 1000 / elapsed
+        average_latency = self._latency / self._frames
+        budget = 1 / self.target_fps
+        over = (
+            self._dropped > 0
+            or average_latency > budget
+            or (self.target_kbps is not None and self.kbps > self.target_kbps)
+        )
+        calm = (
+            self._dropped == 0
+            and average_latency < budget * 0.5
+            and (self.target_kbps is None or self.kbps < self.target_kbps * 0.6)
+        )
+        self._window_start = now
+        self._frames = 0
+        self._bytes = 0
+        self._dropped = 0
+        self._latency = 0.0
+        if over:
+            self._calm = 0
+            if self.level < len(ADAPTIVE_LEVELS) - 1:
+                self.level += 1
+                return True
+            return False
+        if calm:
+            self._calm += 1
+            if self._calm >= self._calm_needed and self.level > 0:
+                self._calm = 0
+                self.level -= 1
+                return True
+        else:
+            self._calm = 0
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "level": self.level,
+            "quality": self.quality,
+            "max_width": self.max_width,
+            "max_height": self.max_height,
+            "every_nth_frame": self.every_nth_frame,
+            "fps": round(self.fps, 2),
+            "kbps": round(self.kbps, 1),
+            "latency_ms": round(self.latency_ms, 1),
+            "ack_ms": round(self.ack_ms, 1),
+            "dropped": self.dropped_total,
+        }
+
+
+class FallbackFrameFilter:
+    """
+    截图兜底模式下的帧过滤：跳过与上一帧相同的截图，可选地只输出变化的图块。
+
+    dedupe="hash" 比较截图字节的摘要；"thumbnail" 比较缩小后的灰度图（最大差值不超过 threshold
+    视为相同），能忽略编码噪声与极小的像素抖动。
+    thumbnail 与 tile_size 需要 opencv-python 和 numpy。
+    """
+
+    def __init__(
+        self,
+        dedupe: str = "hash",
+        threshold: int = 8,
+        tile_size: Optional[int] = None,
+        tile_threshold: int = 16,
+        keyframe_interval: float = 5.0,
+        thumbnail_width: int = 64,
+    ) -> None:
+        if dedupe not in ("off", "hash", "thumbnail"):
+            raise ValueError(f"未知的 dedupe: {dedupe}")
+        if (dedupe == "thumbnail" or tile_size) and (cv2 is None or np is None):
+            raise RuntimeError("dedupe=\"thumbnail\" 和 tile_size 需要安装 opencv-python 和 numpy")
+        if tile_size is not None and tile_size < 16:
+            raise ValueError("tile_size 不能小于 16")
+        self._dedupe = dedupe
+        self._threshold = threshold
+        self._tile_size = tile_size
+        self._tile_threshold = tile_threshold
+        self._keyframe_interval = keyframe_interval
+        self._thumbnail_width = thumbnail_width
+        self._digest: Optional[bytes] = None
+        self._thumbnail = None
+        # What the consumer currently shows: the last keyframe with every emitted tile applied.
+        self._reference = None
+        self._keyframe_at = 0.0
+        self.skipped = 0
+
+    @property
+    def decodes(self) -> bool:
+        return self._dedupe == "thumbnail" or bool(self._tile_size)
+
+    def reset(self) -> None:
+        self._digest = None
+        self._thumbnail = None
+        self._reference = None
+
+    def process(self, image_bytes: bytes, image_format: str = "jpeg", quality: int = 80) -> tuple[str, Any]:
+        """
+        Decide what to emit for a new screenshot.
+
+        Returns:
+            ("skip", None), ("frame", None), or ("tiles", {"width", "height", "tiles"}) where each
+            tile is {"x", "y", "w", "h", "data"} with encoded image bytes.
+        """
+        if self._dedupe == "hash":
+            digest = hashlib.blake2b(image_bytes, digest_size=16).digest()
+            if digest == self._digest:
+                self.skipped += 1
+                return "skip", None
+            self._digest = digest
+        if self._dedupe != "thumbnail" and not self._tile_size:
+            return "frame", None
+
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            self.reset()
+            return "frame", None
+        if self._dedupe == "thumbnail":
+            height, width = image.shape[:2]
+            size = (self._thumbnail_width, max(1, height * self._thumbnail_width // max(1, width)))
+            thumbnail = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+            if self._thumbnail is not None and self._thumbnail.shape == thumbnail.shape:
+                if int(cv2.absdiff(thumbnail, self._thumbnail).max()) <= self._threshold:
+                    self.skipped += 1
+                    return "skip", None
+            self._thumbnail = thumbnail
+        if not self._tile_size:
+            return "frame", None
+        return self._diff_tiles(image, image_format, quality)
+
+    def _diff_tiles(self, image: Any, image_format: str, quality: int) -> tuple[str, Any]:
+        now = time.monotonic()
+        reference = self._reference
+        if (
+            reference is None
+            or reference.shape != image.shape
+            or now - self._keyframe_at >= self._keyframe_interval
+        ):
+            self._reference = image
+            self._keyframe_at = now
+            return "frame", None
+        diff = cv2.absdiff(image, reference)
+        height, width = image.shape[:2]
+        size = self._tile_size
+        changed = []
+        for y in range(0, height, size):
+            for x in range(0, width, size):
+                if int(diff[y:y + size, x:x + size].max()) > self._tile_threshold:
+                    changed.append((x, y))
+        if not changed:
+            self.skipped += 1
+            return "skip", None
+        total = ((height + size - 1) // size) * ((width + size - 1) // size)
+        if len(changed) * 2 > total:
+            self._reference = image
+            self._keyframe_at = now
+            return "frame", None
+        if image_format == "jpeg":
+            extension, params = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        else:
+            extension, params = ".png", []
+        tiles = []
+        for x, y in changed:
+            tile = image[y:y + size, x:x + size]
+            ok, encoded = cv2.imencode(extension, tile, params)
+            if not ok:
+                self._reference = image
+                self._keyframe_at = now
+                return "frame", None
+            reference[y:y + size, x:x + size] = tile
+            tiles.append({"x": x, "y": y, "w": tile.shape[1], "h": tile.shape[0], "data": encoded.tobytes()})
+        return "tiles", {"width": width, "height": height, "tiles": tiles}
+
 
 class StreamServer:
     """
@@ -24,7 +315,19 @@ class StreamServer:
         max_height: Optional[int] = None,
         every_nth_frame: Optional[int] = None,
         fallback_interval: float = 0.2,
+        frame_encoding: str = "base64",
+        adaptive: bool = False,
+        target_fps: float = 10.0,
+        target_kbps: Optional[float] = None,
+        min_quality: int = 30,
+        dedupe: str = "hash",
+        tile_size: Optional[int] = None,
+        fallback_idle_interval: float = 1.0,
     ) -> None:
+        if frame_encoding not in ("base64", "bytes"):
+            raise ValueError(f"未知的 frame_encoding: {frame_encoding}")
+        if adaptive and target_fps <= 0:
+            raise ValueError("target_fps 必须大于 0")
         self._page = page
         self._page_id = page_id
         self._on_frame = on_frame
@@ -35,6 +338,16 @@ class StreamServer:
         self._max_height = max_height
         self._every_nth_frame = every_nth_frame
         self._fallback_interval = fallback_interval
+        self._frame_encoding = frame_encoding
+        self._adaptive = adaptive
+        self._target_fps = target_fps
+        self._target_kbps = target_kbps
+        self._min_quality = min_quality
+        self._controller: Optional[AdaptiveFrameController] = None
+        self._frame_filter = FallbackFrameFilter(dedupe=dedupe, tile_size=tile_size)
+        self._fallback_idle_interval = fallback_idle_interval
+        self._pending_frame: Optional[Dict[str, Any]] = None
+        self._pump_task: Optional[asyncio.Task] = None
         self._cdp_session = None
         self._screencast_task: Optional[asyncio.Task] = None
         self._frame_watch_task: Optional[asyncio.Task] = None
@@ -47,11 +360,44 @@ class StreamServer:
     async def start(self) -> None:
         self._running = True
         self._frame_count = 0
+        if self._adaptive:
+            viewport = self._page.viewport_size or {}
+            self._controller = AdaptiveFrameController(
+                target_fps=self._target_fps,
+                target_kbps=self._target_kbps,
+                base_quality=self._quality,
+                min_quality=self._min_quality,
+                base_width=self._max_width or viewport.get("width"),
+                base_height=self._max_height or viewport.get("height"),
+                base_every_nth=self._every_nth_frame or 1,
+            )
         await self._emit_status()
         await self._start_screencast()
 
+    def stats(self) -> Dict[str, Any]:
+        """
+        Current capture settings and measured throughput.
+
+        Returns:
+            A dict with frames emitted and, in adaptive mode, the level, quality, size,
+            every_nth_frame, fps, kbps, callback/ack latency and dropped frame count. `skipped`
+            counts fallback screenshots that were not emitted because nothing changed.
+        """
+        result: Dict[str, Any] = {
+            "frames": self._frame_count,
+            "adaptive": self._adaptive,
+            "skipped": self._frame_filter.skipped,
+        }
+        if self._controller:
+            result.update(self._controller.stats())
+        return result
+
     async def stop(self) -> None:
         self._running = False
+        if self._pump_task:
+            self._pump_task.cancel()
+            self._pump_task = None
+        self._pending_frame = None
         if self._frame_watch_task:
             self._frame_watch_task.cancel()
             self._frame_watch_task = None
@@ -100,17 +446,26 @@ class StreamServer:
         else:
             self._screencast_task = asyncio.create_task(self._start_fallback_stream())
 
-    async def _start_cdp_screencast(self) -> None:
+    def _screencast_params(self) -> Dict[str, Any]:
+        controller = self._controller
+        quality = controller.quality if controller else self._quality
+        max_width = controller.max_width if controller else self._max_width
+        max_height = controller.max_height if controller else self._max_height
+        every_nth_frame = controller.every_nth_frame if controller else self._every_nth_frame
         params: Dict[str, Any] = {
             "format": self._image_format,
-            "quality": self._quality,
+            "quality": quality,
         }
-        if self._max_width:
-            params["maxWidth"] = self._max_width
-        if self._max_height:
-            params["maxHeight"] = self._max_height
-        if self._every_nth_frame:
-            params["everyNthFrame"] = self._every_nth_frame
+        if max_width:
+            params["maxWidth"] = max_width
+        if max_height:
+            params["maxHeight"] = max_height
+        if every_nth_frame:
+            params["everyNthFrame"] = every_nth_frame
+        return params
+
+    async def _start_cdp_screencast(self) -> None:
+        params = self._screencast_params()
 
         async def handle_frame(frame: Dict[str, Any]) -> None:
             session = self._cdp_session
@@ -121,12 +476,15 @@ class StreamServer:
             if self._frame_watch_task:
                 self._frame_watch_task.cancel()
                 self._frame_watch_task = None
+            if self._controller:
+                await self._queue_adaptive_frame(session, frame)
+                return
             await self._emit_frame(
                 {
                     "type": "frame",
                     "page_id": self._page_id,
                     "url": self._last_url,
-                    "data": frame.get("data"),
+                    "data": self._cdp_frame_data(frame.get("data")),
                     "metadata": frame.get("metadata", {}),
                 }
             )
@@ -141,6 +499,61 @@ class StreamServer:
         if not self._frame_watch_task:
             self._frame_watch_task = asyncio.create_task(self._ensure_frames())
 
+    async def _queue_adaptive_frame(self, session: Any, frame: Dict[str, Any]) -> None:
+        # Keep only the newest unacked frame; a frame replaced before delivery is stale and
+        # is acked at once so the browser can move on.
+        previous = self._pending_frame
+        self._pending_frame = frame
+        if previous is not None:
+            self._controller.record_drop()
+            await self._ack_frame(session, previous)
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump_frames())
+
+    async def _pump_frames(self) -> None:
+        controller = self._controller
+        try:
+            while self._running and self._pending_frame is not None:
+                delay = controller.next_emit_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                frame = self._pending_frame
+                self._pending_frame = None
+                session = self._cdp_session
+                started = time.monotonic()
+                await self._emit_frame(
+                    {
+                        "type": "frame",
+                        "page_id": self._page_id,
+                        "url": self._last_url,
+                        "data": self._cdp_frame_data(frame.get("data")),
+                        "metadata": frame.get("metadata", {}),
+                    }
+                )
+                emitted = time.monotonic()
+                if session:
+                    await self._ack_frame(session, frame)
+                size = len(frame.get("data") or "") * 3 // 4
+                changed = controller.record_frame(size, emitted - started, time.monotonic() - emitted)
+                if changed and session and self._running:
+                    await self._restart_cdp_screencast(session)
+        finally:
+            self._pump_task = None
+
+    async def _ack_frame(self, session: Any, frame: Dict[str, Any]) -> None:
+        try:
+            await session.send("Page.screencastFrameAck", {"sessionId": frame.get("sessionId")})
+        except Exception:
+            pass
+
+    async def _restart_cdp_screencast(self, session: Any) -> None:
+        try:
+            await session.send("Page.stopScreencast")
+            await session.send("Page.startScreencast", self._screencast_params())
+        except Exception:
+            pass
+
     async def _ensure_frames(self) -> None:
         await asyncio.sleep(self._fallback_startup_timeout)
         if not self._running or not self._cdp_session:
@@ -152,26 +565,75 @@ class StreamServer:
                 self._screencast_task = asyncio.create_task(self._start_fallback_stream())
 
     async def _start_fallback_stream(self) -> None:
+        controller = self._controller
+        frame_filter = self._frame_filter
+        frame_filter.reset()
+        idle_streak = 0
         while self._running:
+            captured = time.monotonic()
+            interval = controller.frame_interval if controller else self._fallback_interval
+            quality = controller.quality if controller else self._quality
             image_bytes = await self._page.screenshot(
                 type="jpeg" if self._image_format == "jpeg" else "png",
-                quality=self._quality if self._image_format == "jpeg" else None,
+                quality=quality if self._image_format == "jpeg" else None,
                 full_page=False,
             )
-            data = base64.b64encode(image_bytes).decode("utf-8")
             self._last_url = self._page.url
-            await self._emit_frame(
-                {
+            if frame_filter.decodes:
+                action, update = await asyncio.to_thread(
+                    frame_filter.process, image_bytes, self._image_format, quality
+                )
+            else:
+                action, update = frame_filter.process(image_bytes, self._image_format, quality)
+            if action == "skip":
+                # Nothing changed: back off toward fallback_idle_interval until it does.
+                idle_streak += 1
+                interval = min(max(self._fallback_idle_interval, interval), interval * 2 ** idle_streak)
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - captured)))
+                continue
+            idle_streak = 0
+            self._frame_count += 1
+            metadata = {"timestamp": asyncio.get_running_loop().time()}
+            if action == "tiles":
+                size = sum(len(tile["data"]) for tile in update["tiles"])
+                for tile in update["tiles"]:
+                    tile["data"] = self._encode_image(tile["data"])
+                payload = {
+                    "type": "tiles",
+                    "page_id": self._page_id,
+                    "url": self._last_url,
+                    "width": update["width"],
+                    "height": update["height"],
+                    "tiles": update["tiles"],
+                    "metadata": metadata,
+                }
+            else:
+                size = len(image_bytes)
+                payload = {
                     "type": "frame",
                     "page_id": self._page_id,
                     "url": self._last_url,
-                    "data": data,
-                    "metadata": {
-                        "timestamp": asyncio.get_running_loop().time(),
-                    },
+                    "data": self._encode_image(image_bytes),
+                    "metadata": metadata,
                 }
-            )
-            await asyncio.sleep(self._fallback_interval)
+            await self._emit_frame(payload)
+            elapsed = time.monotonic() - captured
+            if controller is not None:
+                # Screenshot time counts against the budget; the interval stretches with the level.
+                controller.record_frame(size, elapsed)
+                interval = controller.frame_interval
+            await asyncio.sleep(max(0.0, interval - elapsed))
+
+    def _encode_image(self, image_bytes: bytes) -> Any:
+        if self._frame_encoding == "bytes":
+            return image_bytes
+        return base64.b64encode(image_bytes).decode("utf-8")
+
+    def _cdp_frame_data(self, data: Optional[str]) -> Any:
+        # CDP always delivers base64; decode it exactly once in bytes mode.
+        if self._frame_encoding == "bytes" and data is not None:
+            return base64.b64decode(data)
+        return data
 
     async def _keepalive(self) -> None:
         while self._running:
@@ -255,3 +717,184 @@ class StreamServer:
                 "modifiers": modifiers,
             },
         )
+
+
+def _image_bytes(data: Any) -> bytes:
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return data or b""
+
+
+def pack_frame(payload: Dict[str, Any]) -> bytes:
+    """
+    把帧打包成二进制消息：4 字节大端头长度 + UTF-8 JSON 头 + 原始图片字节。
+
+    tiles 消息的头里带 width、height 和每个图块的 x、y、w、h、size，图块字节按同样顺序依次拼接。
+    """
+    header: Dict[str, Any] = {
+        "type": payload.get("type", "frame"),
+        "page_id": payload.get("page_id"),
+        "url": payload.get("url"),
+        "metadata": payload.get("metadata", {}),
+    }
+    if header["type"] == "tiles":
+        chunks = [_image_bytes(tile["data"]) for tile in payload["tiles"]]
+        header["width"] = payload["width"]
+        header["height"] = payload["height"]
+        header["tiles"] = [
+            {"x": tile["x"], "y": tile["y"], "w": tile["w"], "h": tile["h"], "size": len(chunk)}
+            for tile, chunk in zip(payload["tiles"], chunks)
+        ]
+    else:
+        chunks = [_image_bytes(payload.get("data"))]
+    encoded = json.dumps(header).encode("utf-8")
+    return b"".join((struct.pack(">I", len(encoded)), encoded, *chunks))
+
+
+class FrameStreamServer:
+    """
+    通过二进制 WebSocket 消息推送画面帧；每个客户端每个页面只保留最新一帧，慢客户端直接跳过旧帧。
+    tiles 更新是增量，不能跳过：未发送的图块按位置合并，新的完整帧会替换掉之前所有未发送的图块。
+    服务端为每个页面保留最近的完整帧及其后合并的图块，新连接的客户端先收到这份画面，再接收后续增量。
+
+    用法: 把 publish 作为 stream_start 的 on_frame，publish_status 作为 on_status。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9225) -> None:
+        self._host = host
+        self._port = port
+        self._server: Optional[Any] = None
+        self._clients: Dict[Any, "_FrameClient"] = {}
+        # page_id -> 最近的完整帧；page_id -> 该帧之后合并的图块（与 _FrameClient 待发送图块同结构）。
+        self._frames: Dict[Any, Dict[str, Any]] = {}
+        self._frame_tiles: Dict[Any, Dict[str, Any]] = {}
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    async def start(self) -> None:
+        self._server = await websockets.serve(self._handle_client, self._host, self._port)
+
+    async def stop(self) -> None:
+        self._frames.clear()
+        self._frame_tiles.clear()
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.stop()
+            try:
+                await client.websocket.close()
+            except Exception:
+                pass
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def publish(self, payload: Dict[str, Any]) -> None:
+        kind = payload.get("type")
+        if kind not in ("frame", "tiles"):
+            return
+        page_id = payload.get("page_id")
+        if kind == "tiles":
+            # 没有完整帧打底的图块无法拼出画面，不记录。
+            if page_id in self._frames:
+                _merge_tiles(self._frame_tiles, page_id, payload)
+            for client in list(self._clients.values()):
+                client.offer_tiles(("tiles", page_id), payload)
+            return
+        self._frames[page_id] = payload
+        self._frame_tiles.pop(page_id, None)
+        if not self._clients:
+            return
+        message = pack_frame(payload)
+        for client in list(self._clients.values()):
+            client.offer(page_id, message, supersedes=("tiles", page_id))
+
+    def publish_status(self, payload: Dict[str, Any]) -> None:
+        if not self._clients:
+            return
+        message = json.dumps(payload)
+        for client in list(self._clients.values()):
+            client.offer(("status", payload.get("page_id")), message)
+
+    async def _handle_client(self, websocket: Any) -> None:
+        client = _FrameClient(websocket)
+        # 先补发每个页面当前的画面，之后的增量才有基准。
+        for page_id, frame in self._frames.items():
+            client.offer(page_id, pack_frame(frame))
+            tiles = self._frame_tiles.get(page_id)
+            if tiles is not None:
+                client.offer_tiles(("tiles", page_id), {**tiles, "tiles": list(tiles["cells"].values())})
+        self._clients[websocket] = client
+        client.start()
+        try:
+            async for _ in websocket:
+                pass
+        finally:
+            self._clients.pop(websocket, None)
+            await client.stop()
+
+
+def _merge_tiles(pending_by_key: Dict[Any, Any], key: Any, payload: Dict[str, Any]) -> None:
+    # 画面尺寸变化后旧图块失效，重新开始合并。
+    pending = pending_by_key.get(key)
+    if pending is None or (pending["width"], pending["height"]) != (payload["width"], payload["height"]):
+        pending_by_key.pop(key, None)
+        pending = pending_by_key[key] = {**payload, "cells": {}}
+    pending["url"] = payload.get("url")
+    pending["metadata"] = payload.get("metadata", {})
+    for tile in payload["tiles"]:
+        pending["cells"][(tile["x"], tile["y"])] = tile
+
+
+class _FrameClient:
+    def __init__(self, websocket: Any) -> None:
+        self.websocket = websocket
+        # key -> 最新的待发送消息；新帧覆盖未发送的旧帧。
+        self._latest: Dict[Any, Any] = {}
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._closed = True
+        self._wakeup.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def offer(self, key: Any, message: Any, supersedes: Any = None) -> None:
+        if self._closed:
+            return
+        if supersedes is not None:
+            self._latest.pop(supersedes, None)
+        self._latest.pop(key, None)
+        self._latest[key] = message
+        self._wakeup.set()
+
+    def offer_tiles(self, key: Any, payload: Dict[str, Any]) -> None:
+        if self._closed:
+            return
+        # 未发送的图块按 (x, y) 合并，同一位置保留最新的；保持原有排队位置，保证排在之前的完整帧之后。
+        _merge_tiles(self._latest, key, payload)
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._latest and not self._closed:
+                key = next(iter(self._latest))
+                message = self._latest.pop(key)
+                if isinstance(message, dict):
+                    message = pack_frame({**message, "tiles": list(message["cells"].values())})
+                try:
+                    await self.websocket.send(message)
+                except Exception:
+                    self._closed = True
+                    return
@@ -1,7 +1,6 @@
 import sys
 import asyncio
 import shlex
-import base64
 import time
 from pathlib import Path
 
@@ -309,8 +308,7 @@ async def cli() -> None:
                         frame_counters[page_id] = counter
                         ext = "jpg" if image_format == "jpeg" else "png"
                         filename = f"{page_id}_{int(time.time() * 1000)}_{counter}.{ext}"
-                        image_bytes = base64.b64decode(data)
-                        await asyncio.to_thread((output_dir / filename).write_bytes, image_bytes)
+                        await asyncio.to_thread((output_dir / filename).write_bytes, data)
 
                     await browser.stream_start(
                         "*",
@@ -318,6 +316,7 @@ async def cli() -> None:
                         image_format=image_format,
                         quality=quality,
                         every_nth_frame=every_nth_frame,
+                        frame_encoding="bytes",
                     )
                     stream_running = True
                     print(f"帧监听已启动，输出目录: {output_dir}")
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from urllib.parse import quote
+
+import pytest
+
+pytest.importorskip("patchright")
+
+from agent_browser import AgentBrowser
+
+
+def data_url(html: str) -> str:
+    return "data:text/html," + quote(html)
+
+
+@pytest.fixture
+def run_page():
+    """
+    Run `scenario(browser, page_id)` against a fresh AgentBrowser showing `html`.
+
+    Set AGENT_BROWSER_EXECUTABLE to use a specific Chrome/Chromium build.
+    """
+
+    def run(html: str, scenario):
+        async def main():
+            browser = AgentBrowser(executable_path=os.environ.get("AGENT_BROWSER_EXECUTABLE"))
+            try:
+                page_id = await browser.open(data_url(html))
+                return await scenario(browser, page_id)
+            finally:
+                await browser.close()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent_browser import AgentBrowser
+from agent_browser.cache import ResponseCache
+
+
+def test_cookie_requests_are_not_shared(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    private = {"cache-control": "max-age=600"}
+    public = {"cache-control": "public, max-age=600"}
+    assert not cache.put("https://a/1", {"cookie": "sid=1"}, 200, private, b"x")
+    assert cache.put("https://a/2", {"cookie": "sid=1"}, 200, public, b"x")
+    assert not cache.put("https://a/3", {}, 200, {**public, "vary": "Accept, Cookie"}, b"x")
+    assert not cache.put("https://a/4", {"authorization": "t"}, 200, private, b"x")
+    assert cache.put("https://a/5", {}, 200, private, b"x")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/":
+            body = b'<script src="/private.js"></script><script src="/public.js"></script>'
+            content_type = "text/html"
+            cache_control = "no-store"
+        else:
+            body = b"window.loaded = (window.loaded || 0) + 1;"
+            content_type = "application/javascript"
+            cache_control = "public, max-age=600" if self.path == "/public.js" else "max-age=600"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_routed_requests_see_cookies(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin = f"http://127.0.0.1:{server.server_address[1]}"
+    cache = ResponseCache(str(tmp_path))
+
+    async def main():
+        browser = AgentBrowser(
+            executable_path=os.environ.get("AGENT_BROWSER_EXECUTABLE"),
+            response_cache=cache,
+        )
+        try:
+            await browser.start()
+            await browser._context.add_cookies([{"name": "sid", "value": "1", "url": origin}])
+            await browser.open(origin + "/")
+        finally:
+            await browser.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
+    assert cache.get(origin + "/public.js", {}) is not None
+    assert cache.get(origin + "/private.js", {}) is None
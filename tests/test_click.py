@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent_browser import AgentBrowser
+from agent_browser.events import PageEventJournal
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/":
+            body = b'<a href="/report.csv">Export</a>'
+            headers = {"Content-Type": "text/html"}
+        else:
+            time.sleep(0.1)
+            body = b"a,b\n1,2\n"
+            headers = {"Content-Type": "text/csv", "Content-Disposition": 'attachment; filename="report.csv"'}
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_click_reports_attachment_from_plain_link():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin = f"http://127.0.0.1:{server.server_address[1]}"
+
+    async def main():
+        browser = AgentBrowser(executable_path=os.environ.get("AGENT_BROWSER_EXECUTABLE"))
+        try:
+            page_id = await browser.open(origin + "/")
+            return await browser.click(page_id, "text=Export")
+        finally:
+            await browser.close()
+
+    try:
+        result = asyncio.run(main())
+    finally:
+        server.shutdown()
+    assert result["downloaded"]
+    assert result["download"]["suggested_filename"] == "report.csv"
+    assert result["url_after"] == origin + "/"
+
+
+def test_uncommitted_navigation_waits_for_download():
+    async def main():
+        journal = PageEventJournal()
+        journal.record("navigation_request", "https://a/")
+        journal.record("navigation", "https://a/")
+        committed = journal.pending_navigation(0)
+        seq = journal.seq
+        journal.record("navigation_request", "https://a/report.csv")
+        pending = journal.pending_navigation(seq)
+        asyncio.get_running_loop().call_later(0.05, journal.record, "download", "report.csv")
+        events = await journal.wait_for(pending, {"download", "navigation"}, timeout=1)
+        return committed, pending, events
+
+    committed, pending, events = asyncio.run(main())
+    assert committed is None
+    assert pending == 3
+    assert [event.kind for event in events] == ["download"]
@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import json
+
+import websockets
+
+
+def test_console_hub_reports_bound_port(run_page):
+    async def scenario(browser, page_id):
+        port = await browser.console_hub_start(port=0)
+        async with websockets.connect(f"ws://127.0.0.1:{port}") as client:
+            await client.send(json.dumps({"action": "subscribe", "page_id": "*"}))
+            status = json.loads(await client.recv())
+        again = await browser.console_hub_start(port=0)
+        await browser.console_hub_stop()
+        return port, again, status
+
+    port, again, status = run_page("<p>console</p>", scenario)
+    assert port != 0 and again == port
+    assert status["type"] == "status"
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+
+import agent_browser.agent as agent_module
+from agent_browser.snapshot import SnapshotOptions, get_filtered_aria_tree, parse_aria_tree
+
+
+FILTERED_PAGE = """
+<main>
+  <ul>
+    <li><form><input aria-label="Email"></form></li>
+    <li><section aria-label="Profile"><input aria-label="Name"></section></li>
+    <li><button>Submit</button></li>
+  </ul>
+  <nav><a href="#top"><span role="button">Top</span></a></nav>
+</main>
+"""
+
+
+def test_filtered_tree_round_trips_through_parser(run_page):
+    async def scenario(browser, page_id):
+        page = browser._get_state(page_id).page
+        options = SnapshotOptions(interactive=True, in_page=True)
+        aria_tree, _ = await get_filtered_aria_tree(page.locator(":root"), options)
+        return aria_tree
+
+    tree = parse_aria_tree(run_page(FILTERED_PAGE, scenario))
+    labels = [(role, name) for role, name in zip(tree.roles, tree.names)]
+    assert labels == [
+        ("textbox", "Email"),
+        ("textbox", "Name"),
+        ("button", "Submit"),
+        ("link", "Top"),
+        ("button", "Top"),
+    ]
+    # Filtered ancestors (main, list, listitem, region, navigation) add no indentation,
+    # so siblings stay siblings and only the button inside the link is nested.
+    assert tree.parents == [None, None, None, None, 3]
+    assert tree.keys()[2] == "/button:Submit#0"
+
+
+def test_filtered_tree_max_depth_counts_role_ancestors(run_page):
+    async def scenario(browser, page_id):
+        page = browser._get_state(page_id).page
+        options = SnapshotOptions(interactive=True, in_page=True, max_depth=3)
+        aria_tree, _ = await get_filtered_aria_tree(page.locator(":root"), options)
+        return aria_tree
+
+    tree = parse_aria_tree(run_page(FILTERED_PAGE, scenario))
+    # main > list > listitem puts the Email textbox at depth 3; region adds one more for Name.
+    assert tree.names == ["Email", "Submit", "Top", "Top"]
+    assert tree.parents == [None, None, None, 2]
+
+
+QUOTED_PAGE = """<button onclick="document.title='quoted'">Say "hi" \\ now</button><button>Other</button>"""
+
+
+def test_quoted_names_round_trip(run_page):
+    async def scenario(browser, page_id):
+        page = browser._get_state(page_id).page
+        options = SnapshotOptions(interactive=True, in_page=True)
+        filtered, _ = await get_filtered_aria_tree(page.locator(":root"), options)
+        full = await page.locator(":root").aria_snapshot()
+        text = await browser.snapshot(page_id, interactive=True, in_page=True)
+        ref = text.split("[ref=@", 1)[1].split("]", 1)[0]
+        await browser.click(page_id, f"@{ref}")
+        return filtered, full, text, await page.title()
+
+    filtered, full, text, title = run_page(QUOTED_PAGE, scenario)
+    for source in (filtered, full):
+        tree = parse_aria_tree(source)
+        assert ("button", 'Say "hi" \\ now') in zip(tree.roles, tree.names)
+        assert ("button", "Other") in zip(tree.roles, tree.names)
+    assert 'button "Say \\"hi\\" \\\\ now"' in text
+    assert title == "quoted"
+
+
+FORM_PAGE = """
+<main>
+  <input aria-label="Email">
+  <label><input type="checkbox"> Subscribe</label>
+  <button>Send</button>
+</main>
+"""
+
+
+def test_snapshot_after_fill_shows_new_value(run_page):
+    async def scenario(browser, page_id):
+        before = await browser.snapshot(page_id)
+        await browser.fill(page_id, "input[aria-label=Email]", "me@example.com")
+        after_fill = await browser.snapshot(page_id)
+        await browser.check(page_id, "input[type=checkbox]")
+        after_check = await browser.snapshot(page_id)
+        found = await browser.snapshot_search(page_id, "example")
+        return before, after_fill, after_check, found
+
+    before, after_fill, after_check, found = run_page(FORM_PAGE, scenario)
+    assert "me@example.com" not in before
+    assert 'textbox "Email"' in after_fill and "me@example.com" in after_fill
+    assert "[checked]" in after_check
+    assert "me@example.com" in found
+
+
+def test_snapshot_sees_input_made_outside_agent_actions(run_page):
+    async def scenario(browser, page_id):
+        await browser.snapshot(page_id)
+        # Typed through Playwright directly: no action bumps the cache, only the input events do.
+        await browser._get_state(page_id).page.fill("input[aria-label=Email]", "typed")
+        return await browser.snapshot(page_id)
+
+    assert "typed" in run_page(FORM_PAGE, scenario)
+
+
+def test_batch_diff_reports_filled_value(run_page):
+    async def scenario(browser, page_id):
+        await browser.snapshot(page_id, interactive=True)
+        return await browser.batch(
+            page_id,
+            [{"action": "fill", "target": "input[aria-label=Email]", "value": "batch@example.com"}],
+        )
+
+    output = run_page(FORM_PAGE, scenario)
+    assert output["completed"] == 1
+    assert "changed=1" in output["snapshot"]
+    assert "batch@example.com" in output["snapshot"]
+
+
+TWO_FORMS_PAGE = """
+<form onsubmit="return false"><button onclick="document.title='first'">Go</button></form>
+<form onsubmit="return false"><button onclick="document.title='second'">Go</button></form>
+"""
+
+
+def test_snapshot_stream_selector_refs_stay_in_rendered_match(run_page):
+    async def scenario(browser, page_id):
+        text = "".join([chunk async for chunk in browser.snapshot_stream(page_id, selector="form")])
+        ref = text.split("[ref=@", 1)[1].split("]", 1)[0]
+        await browser.click(page_id, f"@{ref}")
+        return text, await browser._get_state(page_id).page.title()
+
+    text, title = run_page(TWO_FORMS_PAGE, scenario)
+    assert text.count('button "Go"') == 1
+    assert title == "first"
+
+
+SIGNUP_PAGE = """
+<main>
+  <h1>Create your account</h1>
+  <p>Welcome to the example service. Please fill in the form below to get started today.</p>
+  <form>
+    <label>Email <input name="email"></label>
+    <label>Password <input type="password" name="pw"></label>
+    <button>Sign up</button>
+  </form>
+  <p>By signing up you agree to the terms of service and the privacy policy.</p>
+</main>
+"""
+
+
+def test_tight_budget_keeps_interactive_nodes(run_page):
+    async def scenario(browser, page_id):
+        return [await browser.snapshot(page_id, max_chars=budget) for budget in (120, 160)]
+
+    tight, roomier = run_page(SIGNUP_PAGE, scenario)
+    assert len(tight) <= 120
+    assert 'textbox "Email"' in tight and 'button "Sign up"' in tight
+    assert "path=root" not in tight
+    assert "paragraph" not in tight and "text:" not in tight
+    assert len(roomier) <= 160
+    assert all(label in roomier for label in ('textbox "Email"', 'textbox "Password"', 'button "Sign up"'))
+
+
+SHADOW_PAGE = """
+<div id="host"></div>
+<script>
+  document.getElementById("host").attachShadow({mode: "open"}).innerHTML = "<button>Before</button>";
+</script>
+"""
+
+
+def test_snapshot_sees_changes_inside_shadow_roots(run_page):
+    async def scenario(browser, page_id):
+        page = browser._get_state(page_id).page
+        await browser.snapshot(page_id)
+        await page.evaluate("document.getElementById('host').shadowRoot.querySelector('button').textContent = 'After'")
+        existing = await browser.snapshot(page_id)
+        # A host added after the watcher was installed brings its own shadow root.
+        await page.evaluate(
+            """() => {
+                const host = document.createElement("div");
+                host.attachShadow({mode: "open"}).innerHTML = "<button>Late</button>";
+                document.body.append(host);
+            }"""
+        )
+        await browser.snapshot(page_id)
+        await page.evaluate("document.querySelectorAll('div')[1].shadowRoot.querySelector('button').textContent = 'Later'")
+        added = await browser.snapshot(page_id)
+        return existing, added
+
+    existing, added = run_page(SHADOW_PAGE, scenario)
+    assert 'button "After"' in existing
+    assert 'button "Later"' in added
+
+
+def test_snapshot_sees_silent_value_writes_after_reuse_window(run_page, monkeypatch):
+    monkeypatch.setattr(agent_module, "ARIA_TREE_REUSE_WINDOW_S", 0.2)
+
+    async def scenario(browser, page_id):
+        page = browser._get_state(page_id).page
+        await browser.snapshot(page_id)
+        # Setting .value from script fires no input event and changes no attribute.
+        await page.evaluate("document.querySelector('input').value = 'silent'")
+        await asyncio.sleep(0.25)
+        return await browser.snapshot(page_id)
+
+    assert "silent" in run_page(FORM_PAGE, scenario)
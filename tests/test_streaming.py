@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import socket
+import struct
+
+import websockets
+
+from agent_browser.streaming import FrameStreamServer
+
+
+def unpack(message: bytes) -> tuple[dict, bytes]:
+    (length,) = struct.unpack(">I", message[:4])
+    return json.loads(message[4 : 4 + length]), message[4 + length :]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def tiles(*cells: tuple[int, int, bytes]) -> dict:
+    return {
+        "type": "tiles",
+        "page_id": "p1",
+        "url": "about:blank",
+        "width": 256,
+        "height": 128,
+        "tiles": [{"x": x, "y": y, "w": 128, "h": 128, "data": data} for x, y, data in cells],
+        "metadata": {},
+    }
+
+
+async def connect(server: FrameStreamServer):
+    client = await websockets.connect(f"ws://127.0.0.1:{server.port}")
+    while not server._clients:
+        await asyncio.sleep(0.01)
+    return client
+
+
+def test_byte_tiles_are_forwarded_and_merged():
+    async def main():
+        server = FrameStreamServer(port=free_port())
+        await server.start()
+        try:
+            client = await connect(server)
+            # Published within one loop turn, so the tile updates are still pending and merge.
+            server.publish({"type": "frame", "page_id": "p1", "url": "about:blank", "data": b"full"})
+            server.publish(tiles((0, 0, b"a1"), (128, 0, b"b1")))
+            server.publish(tiles((0, 0, b"a2")))
+            frame = unpack(await client.recv())
+            update = unpack(await client.recv())
+            await client.close()
+            return frame, update
+        finally:
+            await server.stop()
+
+    (frame_header, frame_data), (tiles_header, tiles_data) = asyncio.run(main())
+    assert frame_header["type"] == "frame" and frame_data == b"full"
+    assert tiles_header["type"] == "tiles"
+    assert (tiles_header["width"], tiles_header["height"]) == (256, 128)
+    assert [(tile["x"], tile["y"], tile["size"]) for tile in tiles_header["tiles"]] == [(0, 0, 2), (128, 0, 2)]
+    assert tiles_data == b"a2b1"
+
+
+def test_frame_supersedes_pending_tiles():
+    async def main():
+        server = FrameStreamServer(port=free_port())
+        await server.start()
+        try:
+            client = await connect(server)
+            server.publish(tiles((0, 0, b"a1")))
+            server.publish({"type": "frame", "page_id": "p1", "url": "about:blank", "data": "ZnVsbA=="})
+            message = unpack(await client.recv())
+            try:
+                extra = await asyncio.wait_for(client.recv(), timeout=0.2)
+            except asyncio.TimeoutError:
+                extra = None
+            await client.close()
+            return message, extra
+        finally:
+            await server.stop()
+
+    (header, data), extra = asyncio.run(main())
+    assert header["type"] == "frame" and data == b"full"
+    assert extra is None
+
+
+def test_late_client_gets_current_frame_first():
+    async def main():
+        server = FrameStreamServer(port=free_port())
+        await server.start()
+        try:
+            server.publish(tiles((0, 0, b"a0")))
+            server.publish({"type": "frame", "page_id": "p1", "url": "about:blank", "data": b"full"})
+            server.publish(tiles((0, 0, b"a1"), (128, 0, b"b1")))
+            server.publish(tiles((0, 0, b"a2")))
+            client = await connect(server)
+            frame = unpack(await client.recv())
+            update = unpack(await client.recv())
+            server.publish(tiles((128, 0, b"b2")))
+            live = unpack(await client.recv())
+            await client.close()
+            return frame, update, live
+        finally:
+            await server.stop()
+
+    (frame_header, frame_data), (tiles_header, tiles_data), (_, live_data) = asyncio.run(main())
+    assert frame_header["type"] == "frame" and frame_data == b"full"
+    assert tiles_header["type"] == "tiles" and tiles_data == b"a2b1"
+    assert live_data == b"b2"